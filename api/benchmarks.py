@@ -0,0 +1,226 @@
+import gc
+import json
+import math
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from pathlib import Path
+from django.db import connections
+from django.test import Client
+from rest_framework_simplejwt.tokens import AccessToken
+from order.models import Cart
+from order.services import CartService
+from phi_mart.middleware import QueryTimer
+from product.models import Category, Product
+from users.models import User
+
+WORDS = [
+    'smart', 'phone', 'laptop', 'camera', 'wireless', 'cotton', 'shirt', 'leather', 'bag', 'steel',
+    'bottle', 'organic', 'coffee', 'desk', 'lamp', 'gaming', 'mouse', 'keyboard', 'running', 'shoe',
+]
+
+BASELINE_PATH = Path(__file__).resolve().parent / 'benchmark_baseline.json'
+
+
+@dataclass
+class BenchmarkData:
+    category_ids: list
+    product_ids: list
+    users: list = field(default_factory=list)  # [(user id, auth headers)]
+
+
+def seed(scale=1, seed=42):
+    """ Deterministic catalog and shoppers: 5 categories, 100 products and 10 users per unit of scale"""
+    rng = random.Random(seed)
+    categories = Category.objects.bulk_create(
+        Category(name=f'{rng.choice(WORDS).title()} {index}', description='benchmark')
+        for index in range(5 * scale)
+    )
+    products = Product.objects.bulk_create(
+        Product(
+            name=' '.join(rng.sample(WORDS, 3)).title(),
+            description=' '.join(rng.choices(WORDS, k=12)),
+            price=rng.randint(100, 100000) / 100,
+            stock=100000,
+            category=rng.choice(categories),
+        )
+        for _ in range(100 * scale)
+    )
+    # no password, hashing would dominate the seeding time
+    users = User.objects.bulk_create(
+        User(email=f'bench{index}@example.com', password='!') for index in range(10 * scale)
+    )
+    return BenchmarkData(
+        category_ids=[category.id for category in categories],
+        product_ids=[product.id for product in products],
+        users=[(user.id, {'HTTP_AUTHORIZATION': f'JWT {AccessToken.for_user(user)}'}) for user in users],
+    )
+
+
+# a flow prepares whatever it needs outside the measurement and returns the request to time
+
+def browse(data, user, rng):
+    page = rng.randint(1, max(1, len(data.product_ids) // 10))
+    return lambda client: client.get(f'/api/v1/products/?page={page}')
+
+
+def search(data, user, rng):
+    term = rng.choice(WORDS)
+    return lambda client: client.get(f'/api/v1/products/?search={term}')
+
+
+def filter_products(data, user, rng):
+    category_id = rng.choice(data.category_ids)
+    price = rng.randint(1, 500)
+    return lambda client: client.get(f'/api/v1/products/?category_id={category_id}&price__gt={price}')
+
+
+def add_to_cart(data, user, rng):
+    user_id, auth = user
+    cart, _ = Cart.objects.get_or_create(user_id=user_id)
+    body = {'product_id': rng.choice(data.product_ids), 'quantity': rng.randint(1, 3)}
+    return lambda client: client.post(f'/api/v1/carts/{cart.id}/items/', body, content_type='application/json', **auth)
+
+
+def checkout(data, user, rng):
+    user_id, auth = user
+    cart, _ = Cart.objects.get_or_create(user_id=user_id)
+    CartService.add_items(cart.id, [(product_id, 1) for product_id in rng.sample(data.product_ids, 3)])
+    body = {'cart_id': str(cart.id)}
+    return lambda client: client.post('/api/v1/orders/', body, content_type='application/json', **auth)
+
+
+def list_orders(data, user, rng):
+    _, auth = user
+    return lambda client: client.get('/api/v1/orders/', **auth)
+
+
+def post_review(data, user, rng):
+    _, auth = user
+    product_id = rng.choice(data.product_ids)
+    body = {'ratings': rng.randint(1, 5), 'comment': 'benchmark'}
+    return lambda client: client.post(f'/api/v1/products/{product_id}/reviews/', body, content_type='application/json', **auth)
+
+
+FLOWS = {
+    'browse': browse,
+    'search': search,
+    'filter': filter_products,
+    'add_to_cart': add_to_cart,
+    'checkout': checkout,
+    'list_orders': list_orders,
+    'review': post_review,
+}
+
+
+def percentile(values, percent):
+    """ Nearest-rank percentile of sorted values"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, math.ceil(percent / 100 * len(values)) - 1))]
+
+
+def run_flow(flow, data, requests=50, threads=4, seed=42):
+    """
+    Send `requests` requests of one flow from `threads` worker threads.
+    Every worker has its own client and its own slice of the users, so two
+    threads never share a cart.
+    """
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        users = data.users[index::threads] or data.users
+        client = Client()
+        samples = []
+        try:
+            for number in range(index, requests, threads):
+                timer = QueryTimer()
+                start = time.perf_counter()
+                try:
+                    request = flow(data, users[number // threads % len(users)], rng)
+                    # the clock starts after the preparation
+                    start = time.perf_counter()
+                    with ExitStack() as stack:
+                        for alias in connections:
+                            stack.enter_context(connections[alias].execute_wrapper(timer))
+                        status_code = request(client).status_code
+                except Exception:
+                    status_code = None
+                samples.append((time.perf_counter() - start, timer.queries, status_code))
+        finally:
+            connections.close_all()
+        return samples
+
+    # garbage left by earlier work must not be collected inside a timed request
+    gc.collect()
+    gc.freeze()
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            samples = [sample for result in executor.map(worker, range(threads)) for sample in result]
+    finally:
+        gc.unfreeze()
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(seconds * 1000 for seconds, _, _ in samples)
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for _, _, status_code in samples if status_code is None or status_code >= 400),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'throughput': round(len(samples) / elapsed, 1) if elapsed else 0.0,
+        'queries_per_request': round(sum(queries for _, queries, _ in samples) / max(1, len(samples)), 2),
+    }
+
+
+def run_benchmark(data, flows=None, requests=50, threads=4, seed=42):
+    return {name: run_flow(FLOWS[name], data, requests, threads, seed) for name in flows or FLOWS}
+
+
+RUN_DEFAULTS = {'scale': 1, 'requests': 50, 'threads': 4, 'seed': 42}
+
+
+def fails_concurrent_writes(database):
+    """ SQLite only queues concurrent writers with OPTIONS['transaction_mode'] = 'IMMEDIATE', otherwise they fail as locked"""
+    return database.vendor == 'sqlite' and database.settings_dict['OPTIONS'].get('transaction_mode') != 'IMMEDIATE'
+
+
+def load_baseline(path=BASELINE_PATH):
+    """ {'run': parameters of the baseline run, 'database': its vendor, 'flows': {flow: {'p95_ms', 'queries_per_request'}}}"""
+    with open(path) as file:
+        return json.load(file)
+
+
+def write_baseline(results, run, path=BASELINE_PATH, database=None):
+    baseline = {
+        'run': run,
+        'database': database,
+        'flows': {name: {'p95_ms': result['p95_ms'], 'queries_per_request': result['queries_per_request']} for name, result in results.items()},
+    }
+    with open(path, 'w') as file:
+        json.dump(baseline, file, indent=2)
+        file.write('\n')
+
+
+def compare(results, baseline, tolerance=1.0, latency_slack_ms=50, query_slack=1):
+    """
+    Regressions against the baseline: any error, a p95 above baseline * (1 + tolerance)
+    + latency_slack_ms, or more than query_slack extra queries per request.
+    Thread scheduling makes short runs noisy, the slacks keep that from failing a run;
+    queries per request is the stable signal and catches N+1 regressions.
+    Cache hit ratios depend on the run, compare runs made with baseline['run'].
+    """
+    regressions = []
+    for name, result in results.items():
+        if result['errors']:
+            regressions.append(f"{name}: {result['errors']} of {result['requests']} requests failed")
+        expected = baseline['flows'].get(name)
+        if not expected:
+            continue
+        if result['p95_ms'] > expected['p95_ms'] * (1 + tolerance) + latency_slack_ms:
+            regressions.append(f"{name}: p95 {result['p95_ms']}ms, baseline {expected['p95_ms']}ms")
+        if result['queries_per_request'] > expected['queries_per_request'] + query_slack:
+            regressions.append(f"{name}: {result['queries_per_request']} queries per request, baseline {expected['queries_per_request']}")
+    return regressions
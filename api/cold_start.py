@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+
+# a cold start: the WSGI app plus the URLconf the first request loads
+COLD_START = 'import phi_mart.wsgi; from django.urls import get_resolver; get_resolver().url_patterns'
+
+
+def import_times(code=COLD_START):
+    """ {module: (self µs, cumulative µs)} of a fresh interpreter running `code` with -X importtime"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True, env=os.environ.copy())
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return parse_import_times(result.stderr)
+
+
+def parse_import_times(text):
+    times = {}
+    for line in text.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if self_us.strip().isdigit():
+            times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def import_report(times, top=15, watch=()):
+    """ Total ms, the packages costing the most (sum of their modules' own time) and the ms of each watched package, None when not imported"""
+    packages = defaultdict(int)
+    for name, (self_us, _) in times.items():
+        packages[name.split('.')[0]] += self_us
+    ranked = sorted(packages.items(), key=lambda item: item[1], reverse=True)
+    return {
+        'total_ms': round(sum(packages.values()) / 1000, 1),
+        'modules': len(times),
+        'packages': [(name, round(us / 1000, 1)) for name, us in ranked[:top]],
+        'watched': {name: round(packages[name] / 1000, 1) if name in packages else None for name in watch},
+    }
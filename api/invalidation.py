@@ -0,0 +1,198 @@
+import itertools
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from datetime import timedelta
+from functools import lru_cache
+from django.conf import settings
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+
+@dataclass(frozen=True)
+class Invalidation:
+    """
+    One change to apply to the local caches.
+    topic is the label of the changed model ('product.Product'), or the name of
+    a cache keyed by something else ('purchases' is keyed by user id). pk is the
+    changed row as text, None when any row may have changed.
+    """
+    topic: str
+    pk: str
+    version: int
+    origin: str
+
+
+class MemoryTransport:
+    """
+    Events of this process only, for tests and a single worker.
+    Keeps the last `max_events`, cursors count every event ever sent.
+    """
+
+    max_events = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = deque(maxlen=self.max_events)
+        self._dropped = 0
+
+    def start(self):
+        with self._lock:
+            return self._dropped + len(self._events)
+
+    def send(self, event):
+        with self._lock:
+            if len(self._events) == self._events.maxlen:
+                self._dropped += 1
+            self._events.append(event)
+
+    def receive(self, cursor):
+        """ (events after the cursor, new cursor), a cursor that fell out of the log resumes at the oldest kept event"""
+        with self._lock:
+            start = max(0, cursor - self._dropped)
+            return list(itertools.islice(self._events, start, None)), self._dropped + len(self._events)
+
+
+class DatabaseTransport:
+    """
+    Events go through the InvalidationEvent table, every process polls for rows newer than its cursor.
+    Ids are handed out before commit, so a row can show up behind a higher one:
+    each poll looks back `lookback` ids and skips the ones it has already seen.
+    """
+
+    lookback = 100
+    batch_size = 1000
+
+    def __init__(self):
+        self._seen = deque(maxlen=self.lookback * 4)
+        self._floor = 0
+
+    @property
+    def events(self):
+        from api.models import InvalidationEvent
+        # the primary always, a replica may not have the newest rows yet
+        return InvalidationEvent.objects.using(DEFAULT_DB_ALIAS)
+
+    def start(self):
+        self._floor = self.events.aggregate(last=Max('id'))['last'] or 0
+        return self._floor
+
+    def send(self, event):
+        self.events.create(topic=event.topic, object_pk=event.pk or '', version=event.version, origin=event.origin)
+
+    def receive(self, cursor):
+        rows = self.events.filter(id__gt=max(0, cursor - self.lookback)).order_by('id')[:self.batch_size]
+        events = []
+        for row in rows:
+            cursor = max(cursor, row.id)
+            if row.id <= self._floor or row.id in self._seen:
+                continue
+            self._seen.append(row.id)
+            events.append(Invalidation(row.topic, row.object_pk or None, row.version, row.origin))
+        return events, cursor
+
+    def prune(self, seconds):
+        """ Delete events older than `seconds`, every process has long applied them"""
+        return self.events.filter(created_at__lt=timezone.now() - timedelta(seconds=seconds)).delete()[0]
+
+
+def is_process_local(backend):
+    """ True for cache backends every process keeps to itself (local memory, dummy)"""
+    return isinstance(backend, (LocMemCache, DummyCache))
+
+
+@lru_cache(maxsize=None)
+def _load_transport(path):
+    return import_string(path)()
+
+
+def get_transport():
+    return _load_transport(settings.INVALIDATION_TRANSPORT)
+
+
+class InvalidationBus:
+    """
+    Keeps the caches of every process in step with committed writes.
+    - Model signals publish an Invalidation after commit, the publishing
+      process applies it right away and the transport carries it to the others
+    - Caches subscribe a handler per topic, handlers update local state or the
+      cache backend. One that needs the changed row reads it by pk (the autocomplete
+      index does, in every process that loaded it), events only go out after commit
+    - Other processes apply the events on their next poll (InvalidationMiddleware
+      polls at most every INVALIDATION_POLL_INTERVAL seconds)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handlers = defaultdict(list)
+        self._cursor = None
+        self._polled_at = 0
+        self._origin = None
+        self._origin_pid = None
+
+    @property
+    def origin(self):
+        """ Id of this process on the bus, made after the fork so preloaded workers don't share it"""
+        pid = os.getpid()
+        if self._origin_pid != pid:
+            self._origin, self._origin_pid = uuid.uuid4().hex, pid
+        return self._origin
+
+    def subscribe(self, topic, handler, backend=None):
+        """
+        Call handler(event) for every event of the topic. backend is the cache the handler
+        writes to: when it is shared by all processes (redis, memcached, database) the
+        publisher's own run already updated it, and the other processes leave it alone.
+        """
+        if backend is not None and not is_process_local(backend):
+            handler = self._own_events_only(handler)
+        self._handlers[topic].append(handler)
+
+    def _own_events_only(self, handler):
+        def own_handler(event):
+            if event.origin == self.origin:
+                handler(event)
+        return own_handler
+
+    def publish(self, topic, pk=None):
+        event = Invalidation(topic, None if pk is None else str(pk), time.time_ns(), self.origin)
+        self.apply(event)
+        get_transport().send(event)
+        return event
+
+    def publish_on_commit(self, topic, pk=None):
+        transaction.on_commit(lambda: self.publish(topic, pk))
+
+    def apply(self, event):
+        for handler in self._handlers.get(event.topic, ()):
+            handler(event)
+
+    def poll(self):
+        """ Apply the events other processes published since the last poll, returns how many"""
+        transport = get_transport()
+        with self._lock:
+            if self._cursor is None:
+                # nothing is cached yet, earlier events don't matter
+                self._cursor = transport.start()
+            events, self._cursor = transport.receive(self._cursor)
+            self._polled_at = time.monotonic()
+        applied = 0
+        for event in events:
+            if event.origin != self.origin:
+                self.apply(event)
+                applied += 1
+        return applied
+
+    def poll_if_due(self):
+        if time.monotonic() - self._polled_at >= settings.INVALIDATION_POLL_INTERVAL:
+            self.poll()
+
+
+invalidation_bus = InvalidationBus()
@@ -0,0 +1,54 @@
+import math
+import random
+import time
+from rest_framework.renderers import JSONRenderer
+from api.renderers import FastJSONRenderer
+from order.models import Order, OrderItem
+from order.serializers import OrderSerializer
+from product.models import Product
+from product.serializers import ProductSerializer
+
+
+def json_payloads(data, orders=200, seed=42):
+    """ Serialized product and order lists as the API builds them, orders are created on the way"""
+    rng = random.Random(seed)
+    created = Order.objects.bulk_create(
+        Order(user_id=rng.choice(data.users)[0], total_price=0) for _ in range(orders)
+    )
+    prices = dict(Product.objects.values_list('id', 'price'))
+    items = []
+    for order in created:
+        for product_id in rng.sample(data.product_ids, 3):
+            quantity = rng.randint(1, 4)
+            items.append(OrderItem(order=order, product_id=product_id, quantity=quantity, price=prices[product_id], total_price=prices[product_id] * quantity))
+            order.total_price += prices[product_id] * quantity
+    OrderItem.objects.bulk_create(items)
+    Order.objects.bulk_update(created, ['total_price'])
+    return {
+        'products': ProductSerializer(Product.objects.prefetch_related('images'), many=True).data,
+        'orders': OrderSerializer(Order.objects.prefetch_related('items__product'), many=True).data,
+    }
+
+
+def compare_renderers(payloads, repeat=20, renderers=(JSONRenderer, FastJSONRenderer)):
+    """ Best of `repeat` render time per payload and renderer, speedup of the last over the first and whether they gave the same bytes"""
+    results = {}
+    for name, payload in payloads.items():
+        timings, outputs = {}, set()
+        for renderer_class in renderers:
+            renderer = renderer_class()
+            best = math.inf
+            for _ in range(repeat):
+                start = time.perf_counter()
+                body = renderer.render(payload, 'application/json')
+                best = min(best, time.perf_counter() - start)
+            outputs.add(body)
+            timings[renderer_class.__name__] = round(best * 1000, 2)
+        first, last = timings[renderers[0].__name__], timings[renderers[-1].__name__]
+        results[name] = {
+            'bytes': len(body),
+            'ms': timings,
+            'speedup': round(first / last, 1) if last else 0.0,
+            'identical': len(outputs) == 1,
+        }
+    return results
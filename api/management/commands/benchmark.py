@@ -0,0 +1,74 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+from api.benchmarks import BASELINE_PATH, FLOWS, RUN_DEFAULTS, compare, fails_concurrent_writes, load_baseline, run_benchmark, seed, write_baseline
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway test database (SQLite or the configured Postgres server), drive the main API '
+        'flows from a thread pool and compare latency and queries per request with the committed baseline'
+    )
+
+    def add_arguments(self, parser):
+        # unset run parameters come from the baseline, so the comparison is like for like
+        parser.add_argument('--scale', type=int, help='5 categories, 100 products and 10 users per unit')
+        parser.add_argument('--requests', type=int, help='Requests per flow')
+        parser.add_argument('--threads', type=int)
+        parser.add_argument('--seed', type=int)
+        parser.add_argument('--flows', default=','.join(FLOWS), help=f"Comma separated, any of {', '.join(FLOWS)}")
+        parser.add_argument('--baseline', default=str(BASELINE_PATH))
+        parser.add_argument('--tolerance', type=float, default=1.0, help='Allowed p95 slowdown over the baseline, 1.0 = twice as slow')
+        parser.add_argument('--write-baseline', action='store_true', help='Store this run as the new baseline instead of comparing')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **options):
+        baseline = None if options['write_baseline'] else load_baseline(options['baseline'])
+        run = dict(RUN_DEFAULTS, **(baseline['run'] if baseline else {}))
+        run.update({name: options[name] for name in RUN_DEFAULTS if options[name] is not None})
+
+        flows = [name.strip() for name in options['flows'].split(',') if name.strip()]
+        unknown = set(flows) - set(FLOWS)
+        if unknown:
+            raise CommandError(f"Unknown flows: {', '.join(sorted(unknown))}")
+
+        if run['threads'] > 1 and fails_concurrent_writes(connections['default']):
+            self.stderr.write(self.style.WARNING(
+                "SQLite without OPTIONS['transaction_mode'] = 'IMMEDIATE' fails concurrent writes with "
+                "'database is locked', use it or --threads 1"
+            ))
+        vendor = connections['default'].vendor
+        if baseline and baseline.get('database', vendor) != vendor:
+            self.stderr.write(self.style.WARNING(
+                f"The baseline was recorded on {baseline['database']}, latencies on {vendor} are not comparable"
+            ))
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            data = seed(scale=run['scale'], seed=run['seed'])
+            results = run_benchmark(data, flows, run['requests'], run['threads'], run['seed'])
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.stdout.write(f"{'flow':<12} {'req':>5} {'err':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} {'queries':>8}")
+            for name, result in results.items():
+                self.stdout.write(
+                    f"{name:<12} {result['requests']:>5} {result['errors']:>4} {result['p50_ms']:>8} {result['p95_ms']:>8} "
+                    f"{result['p99_ms']:>8} {result['throughput']:>8} {result['queries_per_request']:>8}"
+                )
+
+        if options['write_baseline']:
+            write_baseline(results, run, options['baseline'], database=vendor)
+            self.stdout.write(self.style.SUCCESS(f"Baseline written to {options['baseline']}"))
+            return
+
+        regressions = compare(results, baseline, options['tolerance'])
+        if regressions:
+            raise CommandError('Benchmark regressed:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('Within the baseline.'))
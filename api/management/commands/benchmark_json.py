@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+from api.benchmarks import seed
+from api.json_benchmark import compare_renderers, json_payloads
+
+
+class Command(BaseCommand):
+    help = 'Render large product and order lists with the stdlib JSONRenderer and FastJSONRenderer in a throwaway test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int, default=10, help='100 products per unit')
+        parser.add_argument('--orders', type=int, default=1000, help='Orders of 3 items each')
+        parser.add_argument('--repeat', type=int, default=20, help='Renders per payload, the best one counts')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            data = seed(scale=options['scale'])
+            payloads = json_payloads(data, orders=options['orders'])
+            results = compare_renderers(payloads, repeat=options['repeat'])
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(f"{'payload':<10} {'bytes':>10} {'stdlib ms':>10} {'fast ms':>10} {'speedup':>8}")
+        for name, result in results.items():
+            stdlib_ms, fast_ms = result['ms'].values()
+            self.stdout.write(f"{name:<10} {result['bytes']:>10} {stdlib_ms:>10} {fast_ms:>10} {result['speedup']:>7}x")
+
+        different = [name for name, result in results.items() if not result['identical']]
+        if different:
+            raise CommandError(f"Renderers disagree on: {', '.join(different)}")
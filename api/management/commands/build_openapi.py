@@ -0,0 +1,31 @@
+from pathlib import Path
+from urllib.parse import urlsplit
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from phi_mart.openapi import ui_view
+
+
+class Command(BaseCommand):
+    help = (
+        'Write the OpenAPI document /swagger/?format=openapi serves to settings.OPENAPI_SCHEMA_PATH, '
+        'commit it after changing the API (a test fails while it is out of date)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url', default='',
+            help='Public URL of the API to name in the document, without it clients use the host serving the document',
+        )
+        parser.add_argument('--output', default=settings.OPENAPI_SCHEMA_PATH)
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        # the same view the live endpoint falls back to, so both give the same document
+        request = RequestFactory().get('/swagger/', {'format': 'openapi'}, HTTP_HOST=url.netloc or settings.ALLOWED_HOSTS[-1], secure=url.scheme == 'https')
+        response = ui_view('swagger', options['url'] or '')(request)
+        response.render()
+        if response.status_code != 200:
+            raise CommandError(f'Schema generation answered {response.status_code}: {response.content[:200]!r}')
+        Path(options['output']).write_bytes(response.content)
+        self.stdout.write(self.style.SUCCESS(f"{len(response.content)} bytes written to {options['output']}"))
@@ -0,0 +1,35 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from api.cold_start import COLD_START, import_report, import_times
+
+# heavy dependencies that should only load with the endpoints using them
+WATCHED = ['cloudinary', 'cloudinary_storage', 'drf_yasg', 'debug_toolbar', 'urllib3', 'PIL', 'djoser']
+
+
+class Command(BaseCommand):
+    help = 'Import a cold start in a fresh interpreter with -X importtime and report where the time goes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--code', default=COLD_START, help='Python code to time, a cold start by default')
+        parser.add_argument('--top', type=int, default=15, help='Packages to list')
+        parser.add_argument('--max-ms', type=float, help='Fail when the imports take longer than this')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        try:
+            report = import_report(import_times(options['code']), top=options['top'], watch=WATCHED)
+        except RuntimeError as error:
+            raise CommandError(f'Import failed: {error}')
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.stdout.write(f"{report['modules']} modules imported in {report['total_ms']}ms")
+            for name, ms in report['packages']:
+                self.stdout.write(f"  {name:<30} {ms:>8}ms")
+            self.stdout.write('Watched:')
+            for name, ms in report['watched'].items():
+                self.stdout.write(f"  {name:<30} {'not imported' if ms is None else f'{ms}ms':>12}")
+
+        if options['max_ms'] is not None and report['total_ms'] > options['max_ms']:
+            raise CommandError(f"Imports took {report['total_ms']}ms, more than {options['max_ms']}ms")
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from api.invalidation import DatabaseTransport
+
+
+class Command(BaseCommand):
+    help = 'Delete old rows of the DatabaseTransport invalidation table, run it periodically'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=24, help='Keep events younger than this')
+
+    def handle(self, *args, **options):
+        deleted = DatabaseTransport().prune(options['hours'] * 3600)
+        self.stdout.write(self.style.SUCCESS(f'{deleted} invalidation events deleted'))
@@ -0,0 +1,74 @@
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from api.seeding import BASE_COUNTS, make_plan, seed
+from order.services import SalesRollupService
+from product.autocomplete import autocomplete_index
+from api.invalidation import invalidation_bus
+from product.search import get_search_backend
+from product.services import RatingService
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate synthetic users, products, orders with items and reviews with chunked bulk_create '
+        'from a process pool, e.g. --scale 67 writes about ten million order items'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1, help=', '.join(f'{count} {kind}' for kind, count in BASE_COUNTS.items()) + ' per unit')
+        for kind in BASE_COUNTS:
+            parser.add_argument(f'--{kind}', type=int, help=f'Exact number of {kind}, overrides --scale')
+        parser.add_argument('--items-per-order', type=int, default=3, help='Average number of lines per order')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--distribution', choices=['zipf', 'uniform'], default='zipf', help='Popularity of products in orders and reviews')
+        parser.add_argument('--zipf-exponent', type=float, default=1.1)
+        parser.add_argument('--days', type=int, default=365, help='Spread creation times over this many past days')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Rows generated by one task, memory per worker grows with it')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per INSERT statement')
+        parser.add_argument('--skip-derived', action='store_true', help='Leave rating aggregates, search index, autocomplete and sales rollups alone')
+
+    def handle(self, *args, **options):
+        counts = {
+            kind: options[kind] if options[kind] is not None else int(base * options['scale'])
+            for kind, base in BASE_COUNTS.items()
+        }
+        if min(counts.values()) < 0 or options['workers'] < 1 or options['chunk_size'] < 1:
+            raise CommandError('Counts, --workers and --chunk-size must be positive.')
+        if connections['default'].vendor == 'sqlite' and options['workers'] > 1:
+            self.stderr.write(self.style.WARNING('SQLite takes one writer at a time, extra workers only generate rows faster.'))
+
+        started = time.monotonic()
+        plan = make_plan(
+            counts,
+            seed=options['seed'],
+            distribution=options['distribution'],
+            exponent=options['zipf_exponent'],
+            items_per_order=options['items_per_order'],
+            days=options['days'],
+            batch_size=options['batch_size'],
+        )
+
+        def report(kind, inserted):
+            self.stdout.write(f"  {kind}: {inserted.get(kind, 0)} ({time.monotonic() - started:.0f}s)", ending='\r')
+            self.stdout.flush()
+
+        try:
+            inserted = seed(counts, plan, workers=options['workers'], chunk_size=options['chunk_size'], report=report)
+        except ValueError as error:
+            raise CommandError(str(error))
+        self.stdout.write('')
+        self.stdout.write(', '.join(f'{count} {kind}' for kind, count in inserted.items()) + f' in {time.monotonic() - started:.1f}s')
+
+        if not options['skip_derived']:
+            # bulk_create sends no signals, bring the derived data up to date in one pass each
+            RatingService.reconcile()
+            backend = get_search_backend()
+            if backend:
+                backend.rebuild()
+            autocomplete_index.publish_rebuild()
+            SalesRollupService.update_rollups(full=True)
+            invalidation_bus.publish('product.Product')
+        self.stdout.write(self.style.SUCCESS(f'Seeding done in {time.monotonic() - started:.1f}s.'))
@@ -0,0 +1,44 @@
+import hashlib
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+class ConditionalGetMixin:
+    """
+    ETag and Last-Modified on list and retrieve.
+    - Views supply cheap validators through get_validators(request), returning
+      (version, last modified epoch seconds or None), or None to skip validation
+    - If-None-Match / If-Modified-Since are answered with a 304 before any
+      queryset is evaluated or serialized
+    """
+
+    def get_validators(self, request):
+        raise NotImplementedError('ConditionalGetMixin needs get_validators()')
+
+    def get_etag(self, request, version):
+        # one representation per url and renderer
+        raw = f'{version}:{request.get_full_path()}:{request.accepted_renderer.format}'
+        return f'"{hashlib.md5(raw.encode()).hexdigest()}"'
+
+    def conditional_response(self, request, render):
+        validators = self.get_validators(request)
+        if validators is None:
+            return render()
+        version, last_modified = validators
+        etag = self.get_etag(request, version)
+        last_modified = int(last_modified) if last_modified else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = render()
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(request, lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs))
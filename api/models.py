@@ -1,3 +1,13 @@
 from django.db import models
 
 # Create your models here.
+class InvalidationEvent(models.Model):
+    """ Cache invalidations published through api.invalidation.DatabaseTransport"""
+    topic = models.CharField(max_length=100)
+    object_pk = models.CharField(max_length=64, blank=True)
+    version = models.BigIntegerField()
+    origin = models.CharField(max_length=32, help_text='Process that published it, it skips its own events')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.topic} {self.object_pk or '*'}"
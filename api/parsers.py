@@ -0,0 +1,81 @@
+import codecs
+import csv
+import io
+import json
+from django.conf import settings
+from rest_framework.parsers import JSONParser
+
+try:
+    import orjson
+except ImportError:  # optional, the stdlib parser is used without it
+    orjson = None
+
+
+class FastJSONParser(JSONParser):
+    """
+    JSONParser backed by orjson for UTF-8 bodies. Anything orjson rejects goes
+    through the stdlib parser again, so error messages don't change.
+    Integers past 64 bits come back as floats, no field here accepts them anyway.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or stream is None or encoding.lower().replace('_', '-') not in ('utf-8', 'utf8'):
+            return super().parse(stream, media_type, parser_context)
+        body = stream.read()
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            return super().parse(io.BytesIO(body), media_type, parser_context)
+
+
+def iter_lines(stream, chunk_size=64 * 1024):
+    """ Decoded lines of a binary stream, read chunk_size bytes at a time (a leading BOM is dropped)"""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    pending = ''
+    while True:
+        chunk = stream.read(chunk_size)
+        pending += decoder.decode(chunk or b'', final=not chunk)
+        lines = pending.split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+        if not chunk:
+            break
+    if pending:
+        yield pending
+
+
+def read_csv(stream):
+    """ (row number, dict, error) for every data row of a CSV stream with a header line"""
+    for number, row in enumerate(csv.DictReader(iter_lines(stream)), start=1):
+        if None in row:
+            yield number, None, 'Row has more values than the header.'
+        else:
+            yield number, row, None
+
+
+def read_ndjson(stream):
+    """ (row number, dict, error) for every non-blank line of an NDJSON stream"""
+    for number, line in enumerate(iter_lines(stream), start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            yield number, None, f'Invalid JSON: {error}'
+            continue
+        if isinstance(row, dict):
+            yield number, row, None
+        else:
+            yield number, None, 'Expected a JSON object.'
+
+
+def get_row_reader(name):
+    """ Reader for a file name or content type, None when it is neither CSV nor NDJSON"""
+    name = (name or '').lower()
+    if 'ndjson' in name or 'jsonl' in name:
+        return read_ndjson
+    if 'csv' in name:
+        return read_csv
+    return None
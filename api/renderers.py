@@ -0,0 +1,102 @@
+import csv
+import io
+import itertools
+import json
+from decimal import Decimal
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # optional, the stdlib encoder is used without it
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer backed by orjson, byte for byte the same output for API data.
+    - Decimal, datetime, date and time still go through DRF's JSONEncoder, so
+      prices stay floats and datetimes keep their milliseconds/Z format
+    - Indented output (browsable API, `; indent=` media types), non compact or
+      ascii-only settings and anything orjson refuses fall back to the stdlib
+    """
+
+    options = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS) if orjson else 0
+    encoder = JSONEncoder()
+
+    def default(self, obj):
+        # prices are by far the most common, skip the encoder's isinstance chain for them
+        if type(obj) is Decimal:
+            return float(obj)
+        return self.encoder.default(obj)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.default, option=self.options)
+        except orjson.JSONEncodeError:
+            # e.g. integers over 64 bits
+            return super().render(data, accepted_media_type, renderer_context)
+        # same strict javascript subset as JSONRenderer
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+class StreamingRenderer(BaseRenderer):
+    """
+    Lets ?format=ndjson|csv through content negotiation. The streaming views build
+    the body themselves, only error responses (plain dicts) are rendered here.
+    """
+
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return json.dumps(data, cls=JSONEncoder).encode()
+
+
+class NDJSONRenderer(StreamingRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+
+class CSVRenderer(StreamingRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+def buffered(lines, buffer_size=64 * 1024):
+    # write ~64KB at a time instead of one tiny chunk per row
+    buffer = []
+    size = 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= buffer_size:
+            yield ''.join(buffer).encode()
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer).encode()
+
+
+def ndjson_stream(rows):
+    encoder = JSONEncoder(separators=(',', ':'))
+    return buffered(encoder.encode(row) + '\n' for row in rows)
+
+
+def csv_stream(header, rows):
+    output = io.StringIO()
+    writer = csv.writer(output)
+
+    def lines():
+        for row in itertools.chain([header], rows):
+            writer.writerow(row)
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate(0)
+
+    return buffered(lines())
@@ -0,0 +1,248 @@
+import random
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from math import gcd
+from multiprocessing import get_context
+from django.core.management.color import no_style
+from django.db import connection, connections, transaction
+from django.utils import timezone
+from order.models import Order, OrderItem
+from product.models import Category, Product, Review
+from users.models import User
+
+WORDS = [
+    'smart', 'phone', 'laptop', 'camera', 'wireless', 'cotton', 'shirt', 'leather', 'bag', 'steel',
+    'bottle', 'organic', 'coffee', 'desk', 'lamp', 'gaming', 'mouse', 'keyboard', 'running', 'shoe',
+    'classic', 'portable', 'mini', 'pro', 'ultra', 'eco', 'vintage', 'kids', 'travel', 'home',
+]
+
+# per unit of --scale
+BASE_COUNTS = {'categories': 20, 'users': 5000, 'products': 10000, 'orders': 50000, 'reviews': 20000}
+
+STATUS_WEIGHTS = [(Order.DELIVERED, 50), (Order.SHIPPED, 10), (Order.READY_TO_SHIP, 10), (Order.NOT_PAID, 20), (Order.CANCELED, 10)]
+RATING_WEIGHTS = [5, 5, 10, 30, 50]
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """ Let bulk_create keep the created_at/updated_at values we generate"""
+    fields = [field for model in models for field in model._meta.concrete_fields if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def price_of(product_id):
+    """ Prices are a pure function of the id, workers never have to look them up"""
+    return Decimal((product_id * 2654435761) % 99900 + 100) / 100
+
+
+class Popularity:
+    """
+    Draws indexes in [0, size) either uniformly or Zipf distributed.
+    Zipf ranks come from the inverse CDF of its continuous approximation, O(1)
+    memory whatever the size. Ranks are scattered over the id range with a
+    multiplicative step, so the best sellers are not simply the lowest ids.
+    """
+
+    def __init__(self, size, distribution='zipf', exponent=1.1):
+        self.size = size
+        self.zipf = distribution == 'zipf'
+        self.exponent = exponent
+        self.step = next(step for step in range(size // 2 + 1, 2 * size + 2) if gcd(step, size) == 1) if size > 1 else 1
+
+    def _rank(self, u):
+        if self.exponent == 1:
+            x = (self.size + 1) ** u
+        else:
+            power = 1 - self.exponent
+            x = (u * ((self.size + 1) ** power - 1) + 1) ** (1 / power)
+        return min(self.size, int(x)) - 1
+
+    def sample(self, rng, k):
+        if not self.zipf:
+            return [rng.randrange(self.size) for _ in range(k)]
+        return [(self._rank(rng.random()) * self.step) % self.size for _ in range(k)]
+
+
+def _rng(plan, kind, index):
+    return random.Random(f"{plan['seed']}:{kind}:{index}")
+
+
+def _moment(plan, rng):
+    return plan['now'] - timedelta(seconds=rng.random() * plan['days'] * 86400)
+
+
+def seed_users(plan, index, start, count):
+    rng = _rng(plan, 'users', index)
+    users = []
+    for number in range(start, start + count):
+        joined = _moment(plan, rng)
+        users.append(User(
+            id=plan['user_offset'] + number,
+            email=f"seed{plan['user_offset'] + number}@example.com",
+            first_name=rng.choice(WORDS).title(),
+            password='!',  # unusable, hashing millions of passwords would take hours
+            date_joined=joined,
+        ))
+    User.objects.bulk_create(users, batch_size=plan['batch_size'])
+    return {'users': len(users)}
+
+
+def seed_products(plan, index, start, count):
+    rng = _rng(plan, 'products', index)
+    products = []
+    for number in range(start, start + count):
+        product_id = plan['product_offset'] + number
+        created = _moment(plan, rng)
+        products.append(Product(
+            id=product_id,
+            name=' '.join(rng.sample(WORDS, 3)).title(),
+            description=' '.join(rng.choices(WORDS, k=20)),
+            price=price_of(product_id),
+            stock=rng.randint(0, 500),
+            category_id=rng.choice(plan['category_ids']),
+            created_at=created,
+            updated_at=created,
+        ))
+    with explicit_timestamps(Product):
+        Product.objects.bulk_create(products, batch_size=plan['batch_size'])
+    return {'products': len(products)}
+
+
+def seed_orders(plan, index, start, count):
+    rng = _rng(plan, 'orders', index)
+    popularity = Popularity(plan['products'], plan['distribution'], plan['exponent'])
+    statuses, status_weights = zip(*STATUS_WEIGHTS)
+    orders, items = [], []
+    for _ in range(count):
+        created = _moment(plan, rng)
+        order = Order(
+            id=uuid.UUID(int=rng.getrandbits(128), version=4),
+            user_id=plan['user_offset'] + rng.randrange(plan['users']),
+            status=rng.choices(statuses, status_weights)[0],
+            created_at=created,
+            updated_at=created + timedelta(hours=rng.random() * 72),
+        )
+        lines = set(popularity.sample(rng, rng.randint(1, 2 * plan['items_per_order'] - 1)))
+        total = Decimal(0)
+        for line in lines:
+            product_id = plan['product_offset'] + line
+            quantity = rng.choices([1, 2, 3, 4], [70, 20, 7, 3])[0]
+            price = price_of(product_id)
+            items.append(OrderItem(order=order, product_id=product_id, quantity=quantity, price=price, total_price=price * quantity))
+            total += price * quantity
+        order.total_price = total
+        orders.append(order)
+    with explicit_timestamps(Order), transaction.atomic():
+        Order.objects.bulk_create(orders, batch_size=plan['batch_size'])
+        OrderItem.objects.bulk_create(items, batch_size=plan['batch_size'])
+    return {'orders': len(orders), 'order_items': len(items)}
+
+
+def seed_reviews(plan, index, start, count):
+    rng = _rng(plan, 'reviews', index)
+    popularity = Popularity(plan['products'], plan['distribution'], plan['exponent'])
+    reviews = []
+    for line in popularity.sample(rng, count):
+        created = _moment(plan, rng)
+        reviews.append(Review(
+            product_id=plan['product_offset'] + line,
+            user_id=plan['user_offset'] + rng.randrange(plan['users']),
+            ratings=rng.choices(range(1, 6), RATING_WEIGHTS)[0],
+            comment=' '.join(rng.choices(WORDS, k=8)),
+            created_at=created,
+            updated_at=created,
+        ))
+    with explicit_timestamps(Review):
+        Review.objects.bulk_create(reviews, batch_size=plan['batch_size'])
+    return {'reviews': len(reviews)}
+
+
+SEEDERS = [('users', seed_users), ('products', seed_products), ('orders', seed_orders), ('reviews', seed_reviews)]
+
+
+def _run_chunk(seeder, plan, index, start, count):
+    try:
+        return seeder(plan, index, start, count)
+    finally:
+        connections.close_all()
+
+
+def run_chunks(executor, seeder, plan, total, chunk_size, window):
+    """
+    Feed chunks to the pool keeping at most `window` in flight, so memory stays
+    bounded whatever the total. Yields {kind: rows} of every finished chunk.
+    """
+    pending = deque()
+    for index, start in enumerate(range(0, total, chunk_size)):
+        pending.append(executor.submit(_run_chunk, seeder, plan, index, start, min(chunk_size, total - start)))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def make_plan(counts, seed=42, distribution='zipf', exponent=1.1, items_per_order=3, days=365, batch_size=1000):
+    """ Everything a worker needs, ids continue after the rows already in the database"""
+    rng = random.Random(f'{seed}:categories')
+    Category.objects.bulk_create(
+        Category(name=' '.join(rng.sample(WORDS, 2)).title(), description='seeded')
+        for _ in range(counts['categories'])
+    )
+    last_user = User.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    last_product = Product.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    return {
+        'seed': seed,
+        'now': timezone.now(),
+        'days': days,
+        'distribution': distribution,
+        'exponent': exponent,
+        'items_per_order': max(1, items_per_order),
+        'batch_size': batch_size,
+        'users': counts['users'],
+        'products': counts['products'],
+        'user_offset': last_user + 1,
+        'product_offset': last_product + 1,
+        'category_ids': list(Category.objects.values_list('id', flat=True)),
+    }
+
+
+def reset_sequences():
+    """ Explicit ids leave PostgreSQL sequences behind, move them past the new rows"""
+    statements = connection.ops.sequence_reset_sql(no_style(), [User, Product])
+    if statements:
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+
+
+def seed(counts, plan, workers=4, chunk_size=10000, report=None):
+    """ Insert counts[kind] rows per kind in parallel, returns {kind: rows inserted} (order_items included)"""
+    if counts['products'] and not plan['category_ids']:
+        raise ValueError('Products need at least one category.')
+    if (counts['orders'] or counts['reviews']) and not (plan['users'] and plan['products']):
+        raise ValueError('Orders and reviews need users and products to point at.')
+
+    # children must not share the parent's database connection
+    connections.close_all()
+    inserted = {}
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('fork')) as executor:
+        # kinds run one after another, orders and reviews need their users and products in place
+        for kind, seeder in SEEDERS:
+            for rows in run_chunks(executor, seeder, plan, counts[kind], chunk_size, window=workers * 2):
+                for name, count in rows.items():
+                    inserted[name] = inserted.get(name, 0) + count
+                if report:
+                    report(kind, inserted)
+    reset_sequences()
+    return inserted
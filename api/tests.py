@@ -1,3 +1,401 @@
-from django.test import TestCase
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+from asgiref.sync import iscoroutinefunction
+from unittest import mock
+from datetime import date, datetime, time, timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.db.models import Count
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import resolve
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from django.core.cache.backends.filebased import FileBasedCache
+from api.benchmarks import FLOWS, compare, fails_concurrent_writes, load_baseline, run_benchmark, seed
+from api.cold_start import import_report, import_times
+from api.json_benchmark import compare_renderers, json_payloads
+from api import versions
+from api.invalidation import DatabaseTransport, Invalidation, InvalidationBus, MemoryTransport, invalidation_bus
+from api.models import InvalidationEvent
+from api.parsers import FastJSONParser
+from api.renderers import FastJSONRenderer
+from rest_framework_simplejwt.tokens import AccessToken
+from phi_mart.metrics import registry, MetricsRegistry
+from phi_mart.middleware import MetricsMiddleware, ReplicaMiddleware
+from phi_mart.openapi import prebuilt_schema
+from phi_mart.routers import ReplicaRouter, reads_from_replica, reset_replica, use_replica
+from order.models import Cart
+from product.models import Category
+from order.models import Order, OrderItem
+from product.models import Product, Review
+from users.models import User
 
-# Create your tests here.
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        self.staff = User.objects.create_user(email='ops@example.com', is_staff=True)
+
+    def scrape(self, user):
+        return self.client.get('/metrics', HTTP_AUTHORIZATION=f'JWT {AccessToken.for_user(user)}')
+
+    def test_requests_are_recorded_per_route(self):
+        self.client.get('/api/v1/products/')
+        self.client.get('/api/v1/products/')
+        self.client.get('/api/v1/categories/')
+
+        response = self.scrape(self.staff)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        body = response.content.decode()
+        self.assertIn('phimart_requests_total{route="products-list",method="GET",status="200"} 2', body)
+        self.assertIn('phimart_request_duration_seconds_count{route="category-list"} 1', body)
+        self.assertIn('phimart_request_queries_bucket{route="products-list",le="+Inf"} 2', body)
+        self.assertIn('phimart_response_bytes_total{route="products-list"}', body)
+
+    async def test_async_mode_counts_queries(self):
+        async def view(request):
+            request.resolver_match = resolve('/api/v1/products/')
+            await Category.objects.acount()
+            return HttpResponse(b'ok')
+
+        middleware = MetricsMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        await middleware(RequestFactory().get('/api/v1/products/'))
+        # the ORM ran on a sync thread, not on the loop, and was still counted
+        self.assertIn('phimart_request_queries_sum{route="products-list"} 1', registry.render())
+
+    def test_only_staff_can_scrape(self):
+        user = User.objects.create_user(email='shopper@example.com')
+        self.assertEqual(self.scrape(user).status_code, 403)
+
+    def test_routes_are_bounded(self):
+        metrics = MetricsRegistry()
+        metrics.max_routes = 3
+        for index in range(10):
+            metrics.record(f'route-{index}', 'GET', 200, 0.01, 1, 0.001, 10)
+        self.assertIn('route="other",method="GET",status="200"} 7', metrics.render())
+
+
+class FastJSONTest(TestCase):
+    def test_renders_like_the_stdlib_renderer(self):
+        data = {
+            'price': Decimal('10.50'), 'total': Decimal('1234567.89'), 'id': uuid.uuid4(),
+            'at': datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc), 'naive': datetime(2024, 5, 1, 12, 30),
+            'day': date(2024, 5, 1), 'time': time(9, 15, 30, 250000), 'label': gettext_lazy('Shipped'),
+            'text': 'café \u2028 line', 1: [None, True, 1.5, 2 ** 70], 'nested': [{'items': [Decimal('0.01')]}],
+        }
+        for media_type in ['application/json', 'application/json; indent=4']:
+            self.assertEqual(FastJSONRenderer().render(data, media_type), JSONRenderer().render(data, media_type))
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+
+    def test_parses_like_the_stdlib_parser(self):
+        body = '{"product_id": 3, "quantity": 2, "comment": "ok \u00e9", "ratio": 0.5, "tags": [null, false]}'.encode()
+        self.assertEqual(FastJSONParser().parse(BytesIO(body)), JSONParser().parse(BytesIO(body)))
+        for broken in [b'{"quantity": }', b'[NaN]']:
+            errors = []
+            for parser in [FastJSONParser(), JSONParser()]:
+                with self.assertRaises(ParseError) as context:
+                    parser.parse(BytesIO(broken))
+                errors.append(str(context.exception))
+            self.assertEqual(errors[0], errors[1])
+
+    def test_api_payloads_are_identical(self):
+        cache.clear()
+        results = compare_renderers(json_payloads(seed(), orders=20), repeat=1)
+        self.assertEqual(set(results), {'products', 'orders'})
+        self.assertTrue(all(result['identical'] for result in results.values()))
+        response = self.client.post('/api/v1/carts/', {}, content_type='application/json')
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+
+@override_settings(INVALIDATION_TRANSPORT='api.invalidation.MemoryTransport')
+class InvalidationBusTest(TestCase):
+    """ Model writes reach the caches of the other processes, a second bus plays the other process"""
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Bus')
+        self.other = InvalidationBus()
+        self.received = []
+        self.other.subscribe('product.Product', self.received.append)
+        self.other.poll()
+        # events of earlier tests stay in the memory transport
+        invalidation_bus.poll()
+
+    def test_signals_publish_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(name='Lamp', description='x', price=5, stock=1, category=self.category)
+            self.assertEqual(self.other.poll(), 0)
+        self.assertEqual(self.other.poll(), 1)
+        self.assertEqual((self.received[0].topic, self.received[0].pk), ('product.Product', str(product.pk)))
+        # the publisher applied it already, its own poll skips it
+        self.assertEqual(invalidation_bus.poll(), 0)
+
+    def test_shared_backend_is_left_to_the_publisher(self):
+        calls = []
+        shared = FileBasedCache(tempfile.mkdtemp(), {})
+        self.addCleanup(shutil.rmtree, shared._dir)
+        self.other.subscribe('product.Category', calls.append, backend=shared)
+        invalidation_bus.publish('product.Category', self.category.pk)
+        self.other.poll()
+        self.assertEqual(calls, [])
+        self.other.publish('product.Category', self.category.pk)
+        self.assertEqual(len(calls), 1)
+
+    def test_forked_workers_get_their_own_origin(self):
+        bus = InvalidationBus()
+        bus.subscribe('purchases', self.received.append)
+        bus.poll()
+        parent = bus.origin
+        # a worker forked from a master that already used the bus
+        with mock.patch('api.invalidation.os.getpid', return_value=os.getpid() + 1):
+            self.assertNotEqual(bus.origin, parent)
+            bus.publish('purchases', 1)
+        # back in the master, the worker's event is not mistaken for its own
+        self.assertEqual(bus.poll(), 1)
+        self.assertEqual([event.pk for event in self.received], ['1', '1'])
+
+    def test_memory_log_is_bounded(self):
+        with mock.patch.object(MemoryTransport, 'max_events', 3):
+            transport = MemoryTransport()
+        cursor = transport.start()
+        for pk in range(5):
+            transport.send(Invalidation('purchases', str(pk), pk, 'elsewhere'))
+        self.assertEqual(len(transport._events), 3)
+        # a cursor that fell behind resumes at the oldest kept event
+        events, cursor = transport.receive(cursor)
+        self.assertEqual([event.pk for event in events], ['2', '3', '4'])
+        self.assertEqual(transport.receive(cursor), ([], 5))
+        transport.send(Invalidation('purchases', '5', 5, 'elsewhere'))
+        events, cursor = transport.receive(cursor)
+        self.assertEqual(([event.pk for event in events], cursor), (['5'], 6))
+
+    @override_settings(INVALIDATION_TRANSPORT='api.invalidation.DatabaseTransport')
+    def test_database_transport(self):
+        publisher, other = InvalidationBus(), InvalidationBus()
+        other.subscribe('purchases', self.received.append)
+        other.poll()
+        publisher.publish('purchases', 7)
+        publisher.publish('purchases')
+        self.assertEqual(other.poll(), 2)
+        self.assertEqual([event.pk for event in self.received], ['7', None])
+        self.assertEqual(other.poll(), 0)
+
+        # an id handed out earlier but committed later is still picked up
+        last = InvalidationEvent.objects.order_by('id').last().id
+        InvalidationEvent.objects.create(id=last + 2, topic='purchases', object_pk='8', version=1, origin=publisher.origin)
+        self.assertEqual(other.poll(), 1)
+        InvalidationEvent.objects.create(id=last + 1, topic='purchases', object_pk='9', version=1, origin=publisher.origin)
+        self.assertEqual(other.poll(), 1)
+        self.assertEqual([event.pk for event in self.received[2:]], ['8', '9'])
+        self.assertEqual(DatabaseTransport().prune(-1), 4)
+
+
+class VersionCounterTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_lost_counter_never_goes_back(self):
+        first = versions.get_version(cache, 'test:version')
+        self.assertEqual(versions.get_version(cache, 'test:version'), first)
+        bumped = versions.bump_version(cache, 'test:version')
+        self.assertGreater(bumped, first)
+
+        cache.delete('test:version')
+        self.assertGreater(versions.bump_version(cache, 'test:version'), bumped)
+        cache.delete('test:version')
+        self.assertGreater(versions.get_version(cache, 'test:version'), bumped)
+
+
+class ColdStartTest(TestCase):
+    """ A cold start leaves the heavy dependencies alone until their endpoints are used"""
+
+    def test_heavy_imports_are_deferred(self):
+        times = import_times()
+        report = import_report(times, watch=['cloudinary', 'debug_toolbar', 'PIL'])
+        self.assertEqual(report['watched'], {'cloudinary': None, 'debug_toolbar': None, 'PIL': None})
+        # the app is in INSTALLED_APPS, its views and schema generator are not
+        self.assertNotIn('drf_yasg.views', times)
+        self.assertIn('phi_mart.wsgi', times)
+
+    def build_openapi(self, path, **options):
+        # ReviewByUserViewSets logs a warning while the schema is generated
+        logging.disable(logging.WARNING)
+        try:
+            call_command('build_openapi', output=path, stdout=StringIO(), **options)
+        finally:
+            logging.disable(logging.NOTSET)
+        with open(path, 'rb') as file:
+            return file.read()
+
+    def test_prebuilt_schema_is_served(self):
+        path = os.path.join(tempfile.mkdtemp(), 'openapi.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        self.addCleanup(prebuilt_schema.cache_clear)
+        self.build_openapi(path, url='http://testserver')
+        logging.disable(logging.WARNING)
+        try:
+            with override_settings(OPENAPI_SCHEMA_PATH=path + '.missing'):
+                live = self.client.get('/swagger/?format=openapi')
+        finally:
+            logging.disable(logging.NOTSET)
+
+        with override_settings(OPENAPI_SCHEMA_PATH=path), mock.patch('phi_mart.openapi.ui_view') as ui_view:
+            response = self.client.get('/swagger/?format=openapi')
+        ui_view.assert_not_called()
+        self.assertEqual(response.content, live.content)
+        self.assertEqual(response['Content-Type'], live['Content-Type'])
+
+    def test_committed_schema_is_current(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        built = self.build_openapi(os.path.join(directory, 'openapi.json'))
+        with open(settings.BASE_DIR / 'phi_mart' / 'openapi.json', 'rb') as file:
+            committed = file.read()
+        self.assertEqual(built, committed, 'phi_mart/openapi.json is out of date, run `manage.py build_openapi` and commit it')
+
+
+@unittest.skipUnless(os.environ.get('RUN_BENCHMARKS'), 'wall-clock timings, set RUN_BENCHMARKS=1 to run them')
+class BenchmarkTest(TransactionTestCase):
+    """ A short run of every flow has to stay within the committed baseline"""
+
+    def setUp(self):
+        if fails_concurrent_writes(connection):
+            self.skipTest("SQLite needs OPTIONS['transaction_mode'] = 'IMMEDIATE' for the concurrent flows")
+        self.baseline = load_baseline()
+        if self.baseline['database'] != connection.vendor:
+            self.skipTest(f"the baseline was recorded on {self.baseline['database']}")
+        cache.clear()
+
+    def test_flows_within_baseline(self):
+        baseline = self.baseline
+        run = baseline['run']
+        data = seed(scale=run['scale'], seed=run['seed'])
+        results = run_benchmark(data, requests=run['requests'], threads=run['threads'], seed=run['seed'])
+        self.assertEqual(set(results), set(FLOWS))
+        self.assertEqual(compare(results, baseline), [])
+
+
+class SeedDataTest(TransactionTestCase):
+    def setUp(self):
+        # only known once the test database exists, the settings may name a file
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('worker processes cannot see an in-memory database')
+
+    def test_seeds_requested_volumes_with_skew(self):
+        call_command(
+            'seed_data', categories=3, users=20, products=50, orders=300, reviews=200,
+            workers=2, chunk_size=64, stdout=StringIO(), stderr=StringIO(),
+        )
+        self.assertEqual((User.objects.count(), Product.objects.count(), Order.objects.count(), Review.objects.count()), (20, 50, 300, 200))
+        self.assertGreater(OrderItem.objects.count(), 300)
+
+        # zipf: the best seller alone sells far more than an even share
+        top = OrderItem.objects.values('product_id').annotate(lines=Count('id')).order_by('-lines').first()
+        self.assertGreater(top['lines'], 5 * OrderItem.objects.count() / 50)
+        self.assertEqual(Product.objects.order_by('-rating_count').first().rating_count, Review.objects.values('product_id').annotate(total=Count('id')).order_by('-total').first()['total'])
+
+
+class ReplicaSettingsTest(TestCase):
+    @override_settings(DATABASE_REPLICAS=['replica'], CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_process_local_cache_is_refused(self):
+        with self.assertRaises(ImproperlyConfigured):
+            ReplicaMiddleware(lambda request: None)
+
+
+class ReplicaRoutingTest(TransactionTestCase):
+    """ A copy of the SQLite test database stands in for a replica that stopped replicating"""
+
+    def setUp(self):
+        if connection.vendor != 'sqlite' or connection.is_in_memory_db():
+            self.skipTest('the replica is a copy of the SQLite test database file')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        # the sticky flags have to be seen by every worker
+        shared = override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': os.path.join(directory, 'cache')}})
+        shared.enable()
+        self.addCleanup(shared.disable)
+        cache.clear()
+        category = Category.objects.create(name='Replicated')
+        Product.objects.create(name='Old', description='x', price=1, stock=1, category=category)
+        self.user = User.objects.create_user(email='buyer@example.com')
+        self.auth = {'HTTP_AUTHORIZATION': f'JWT {AccessToken.for_user(self.user)}'}
+
+        shutil.copy(connection.settings_dict['NAME'], os.path.join(directory, 'replica.sqlite3'))
+        connections.settings['replica'] = connections.configure_settings({
+            DEFAULT_DB_ALIAS: dict(connection.settings_dict),
+            'replica': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(directory, 'replica.sqlite3')},
+        })['replica']
+        self.addCleanup(self.drop_replica)
+        # the alias only exists from here on, Django's test runner can't know it up front
+        allowed = mock.patch.object(ReplicaRoutingTest, 'databases', {DEFAULT_DB_ALIAS, 'replica'})
+        allowed.start()
+        self.addCleanup(allowed.stop)
+        replicas = override_settings(DATABASE_REPLICAS=['replica'], REPLICA_STICKY_SECONDS=60)
+        replicas.enable()
+        self.addCleanup(replicas.disable)
+        Product.objects.create(name='New', description='x', price=1, stock=1, category=category)
+
+    def drop_replica(self):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+
+    def product_names(self, **headers):
+        return {product['name'] for product in self.client.get('/api/v1/products/', **headers).data['results']}
+
+    def test_reads_go_to_the_replica_and_writes_to_the_primary(self):
+        self.assertEqual(self.product_names(), {'Old'})
+        router = ReplicaRouter()
+        token = use_replica(True)
+        try:
+            self.assertEqual(router.db_for_read(Product), 'replica')
+            with transaction.atomic():
+                self.assertEqual(router.db_for_read(Product), DEFAULT_DB_ALIAS)
+            self.assertEqual(router.db_for_write(Product), DEFAULT_DB_ALIAS)
+            # nothing after a write reads a replica
+            self.assertEqual(router.db_for_read(Product), DEFAULT_DB_ALIAS)
+        finally:
+            reset_replica(token)
+        self.assertEqual(router.db_for_read(Product), DEFAULT_DB_ALIAS)
+
+    def test_writers_read_their_writes(self):
+        cart = self.client.post('/api/v1/carts/', {}, content_type='application/json', **self.auth).data
+        self.assertTrue(Cart.objects.filter(pk=cart['id']).exists())
+        # other users still read the replica, the lagging catalog is not cached
+        self.assertEqual(self.product_names(), {'Old'})
+        self.assertEqual(self.client.get(f"/api/v1/carts/{cart['id']}/", **self.auth).status_code, 200)
+        self.assertEqual(self.product_names(**self.auth), {'Old', 'New'})
+
+        cache.delete(f'replica:sticky:user:{self.user.id}')
+        self.assertEqual(self.client.get(f"/api/v1/carts/{cart['id']}/", **self.auth).status_code, 404)
+
+    async def test_async_mode_keeps_writers_on_the_primary(self):
+        seen = []
+
+        async def view(request):
+            seen.append(reads_from_replica())
+            return HttpResponse(b'ok')
+
+        middleware = ReplicaMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        factory = RequestFactory(**self.auth)
+        await middleware(factory.get('/'))
+        await middleware(factory.post('/'))
+        await middleware(factory.get('/'))
+        await middleware(RequestFactory().get('/'))
+        self.assertEqual(seen, [True, False, False, True])
@@ -1,7 +1,7 @@
 from django.urls import path, include
 from product.views import ProductViewsets, CategoryViewsets, ReviewViewsets, ProductImageViewSet
 from rest_framework_nested import routers
-from order.views import CartViewSets, CartItemViewSets, OrderViewSets, initiate_payment, success_payment, fail_payment, cancel_payment, HasOrderedProduct
+from order.views import CartViewSets, CartItemViewSets, OrderViewSets, initiate_payment, initiate_payment_async, success_payment, fail_payment, cancel_payment, HasOrderedProduct, HasOrderedProducts, SalesReportView
 from product.views import ReviewByUserViewSets
 
 router = routers.DefaultRouter()
@@ -22,13 +22,17 @@ cart_router.register('items', CartItemViewSets, basename='cart-items')
 # urlpatterns = router.urls
 
 urlpatterns = [
+    # before the router, its orders/{pk}/ route would swallow it
+    path('orders/has-ordered/', HasOrderedProducts.as_view(), name='has_ordered_products'),
     path('', include(router.urls)),
     path('', include(product_router.urls)),
     path('', include(cart_router.urls)),
     path('orders/has-ordered/<int:product_id>', HasOrderedProduct.as_view()),
+    path('reports/sales/', SalesReportView.as_view(), name='sales_report'),
     path('auth/', include('djoser.urls')),
     path('auth/', include('djoser.urls.jwt')),
     path('payment/initiate/', initiate_payment, name='initiate_payment'),
+    path('payment/initiate/async/', initiate_payment_async, name='initiate_payment_async'),
     path('payment/success/', success_payment, name='success_payment'),
     path('payment/fail/', fail_payment, name='fail_payment'),
     path('payment/cancel/', cancel_payment, name='cancel_payment'),
@@ -0,0 +1,24 @@
+import time
+
+
+def get_version(cache, key):
+    """
+    Current value of the version counter under `key`, created on first use.
+    Counters start from a timestamp, so losing the key never brings back
+    entries written under an older version.
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(cache, key):
+    """ Move the counter under `key` past every version handed out so far, returns the new one"""
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # key expired or was evicted, start again from a fresh timestamp
+        cache.set(key, time.time_ns(), timeout=None)
+        return cache.get(key)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from order.models import Cart, CartItem, Order, OrderItem
+from order.models import Cart, CartItem, Order, OrderItem, PaymentEvent
 # Register your models here.
 
 @admin.register(Cart)
@@ -14,5 +14,9 @@ class OrderAdmin(admin.ModelAdmin):
 class OrderItemAdmin(admin.ModelAdmin):
     list_display = ['id', 'order', 'product']
 
+@admin.register(PaymentEvent)
+class PaymentEventAdmin(admin.ModelAdmin):
+    list_display = ['tran_id', 'order_id', 'received_at', 'processed_at']
+
     
 admin.site.register(CartItem)
\ No newline at end of file
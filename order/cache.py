@@ -0,0 +1,64 @@
+from django.conf import settings
+from django.core.cache import caches
+from api import versions
+from api.invalidation import invalidation_bus
+from django.db.models import Value, CharField
+from order.models import Order, OrderItem
+from product.models import Review
+
+
+class PurchaseCache:
+    """
+    Per-user sets of purchased and reviewed product ids.
+    - Both sets come from one UNION query, canceled orders don't count as purchases
+    - Each entry remembers the user's version, writers bump the version after
+      commit, so an entry computed while a write was in flight is never served
+    - Version and entry are read in one round trip, a warm lookup never hits the database
+    """
+
+    timeout = 60 * 60
+
+    @property
+    def cache(self):
+        return caches[settings.CATALOG_CACHE_ALIAS]
+
+    def _keys(self, user_id):
+        return f"purchases:{user_id}:version", f"purchases:{user_id}"
+
+    def _load(self, user_id):
+        purchased = (
+            OrderItem.objects.filter(order__user_id=user_id).exclude(order__status=Order.CANCELED)
+            .annotate(kind=Value('ordered', output_field=CharField())).values_list('kind', 'product_id')
+        )
+        reviewed = (
+            Review.objects.filter(user_id=user_id)
+            .annotate(kind=Value('reviewed', output_field=CharField())).values_list('kind', 'product_id')
+        )
+        sets = {'ordered': set(), 'reviewed': set()}
+        for kind, product_id in purchased.order_by().union(reviewed.order_by()):
+            sets[kind].add(product_id)
+        return sets['ordered'], sets['reviewed']
+
+    def get(self, user_id):
+        """ (purchased ids, reviewed ids) of a user"""
+        version_key, entry_key = self._keys(user_id)
+        found = self.cache.get_many([version_key, entry_key])
+        version = found.get(version_key) or versions.get_version(self.cache, version_key)
+        entry = found.get(entry_key)
+        if entry is not None and entry[0] == version:
+            return entry[1], entry[2]
+
+        # the version is read before the query, a write committing meanwhile outdates this entry
+        purchased, reviewed = self._load(user_id)
+        self.cache.set(entry_key, (version, purchased, reviewed), timeout=self.timeout)
+        return purchased, reviewed
+
+    def invalidate(self, user_id):
+        version_key, _ = self._keys(user_id)
+        versions.bump_version(self.cache, version_key)
+
+    def invalidate_on_commit(self, user_id):
+        invalidation_bus.publish_on_commit('purchases', user_id)
+
+
+purchase_cache = PurchaseCache()
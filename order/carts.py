@@ -0,0 +1,208 @@
+import time
+from contextlib import contextmanager
+from uuid import UUID
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from api.invalidation import is_process_local
+from order.models import Cart, CartItem
+from product.models import Product
+
+
+class CartStore:
+    """
+    Cache-backed working carts, used when settings.CART_STORE == 'cache'.
+    - A cart is one entry {'user', 'items': {product_id: quantity}, 'ids': {product_id: item id},
+      'aliases': {provisional id: product_id}, 'provisional', 'version', 'flushed'}, the Cart row itself stays in the database
+    - Every change is written behind: lines reach CartItem when flush() runs, from
+      OrderService.create_order or the flush_carts command
+    - A new line gets a provisional, negative item id until its row is flushed. The API then
+      shows the row id, and the provisional one keeps finding the line
+    - Writers of a cart are serialized by a lock entry, so racing requests never lose quantity.
+      Flushers are serialized by a row lock on the Cart, the entry lock is never held across a transaction
+
+    CART_CACHE_ALIAS has to be a shared backend that doesn't cull carts, and flush_carts
+    has to run periodically: an evicted cart falls back to its last flushed rows.
+    """
+
+    lock_timeout = 5
+
+    @property
+    def enabled(self):
+        if settings.CART_STORE != 'cache':
+            return False
+        if is_process_local(self.cache):
+            # every worker would keep its own copy of a cart, and lose it on restart
+            raise ImproperlyConfigured("CART_STORE = 'cache' needs a shared CART_CACHE_BACKEND")
+        return True
+
+    @property
+    def cache(self):
+        return caches[settings.CART_CACHE_ALIAS]
+
+    def _key(self, cart_id):
+        # url kwargs come as text, one spelling per cart
+        return f'cart:{UUID(str(cart_id))}'
+
+    @contextmanager
+    def _locked(self, cart_id):
+        key = f'{self._key(cart_id)}:lock'
+        # the lock expires by itself, a crashed holder blocks the cart for lock_timeout at most
+        while not self.cache.add(key, 1, timeout=self.lock_timeout):
+            time.sleep(0.005)
+        try:
+            yield
+        finally:
+            self.cache.delete(key)
+
+    def get(self, cart_id):
+        """ The cart entry, loaded from the database on a miss, None when the cart doesn't exist"""
+        state = self.cache.get(self._key(cart_id))
+        if state is not None:
+            return state
+        user_id = Cart.objects.filter(pk=cart_id).values_list('user_id', flat=True).first()
+        if user_id is None:
+            return None
+        rows = CartItem.objects.filter(cart_id=cart_id).order_by('id').values_list('id', 'product_id', 'quantity')
+        state = {
+            'user': user_id,
+            'items': {product_id: quantity for _, product_id, quantity in rows},
+            'ids': {product_id: pk for pk, product_id, _ in rows},
+            'aliases': {},
+            'provisional': 0,
+            'version': 0,
+            'flushed': 0,
+        }
+        self.cache.add(self._key(cart_id), state, timeout=None)
+        return self.cache.get(self._key(cart_id), state)
+
+    def _update(self, cart_id, change):
+        with self._locked(cart_id):
+            state = self.get(cart_id)
+            if state is None:
+                return None
+            change(state)
+            state['version'] += 1
+            self.cache.set(self._key(cart_id), state, timeout=None)
+            return state
+
+    def add(self, cart_id, quantities):
+        """
+        Add {product_id: quantity}, the products have to exist.
+        Returns {product_id: (item id, new quantity)} of those products, None when the cart doesn't exist.
+        """
+        def change(state):
+            items = state['items']
+            for product_id, quantity in quantities.items():
+                items[product_id] = items.get(product_id, 0) + quantity
+                if product_id not in state['ids']:
+                    # counts down from -1, never the id of a CartItem row nor one handed out before
+                    state['provisional'] = state.get('provisional', 0) - 1
+                    state['ids'][product_id] = state['provisional']
+
+        state = self._update(cart_id, change)
+        return None if state is None else {product_id: (state['ids'][product_id], state['items'][product_id]) for product_id in quantities}
+
+    def set_quantity(self, cart_id, product_id, quantity):
+        return self._update(cart_id, lambda state: state['items'].__setitem__(product_id, quantity))
+
+    def remove(self, cart_id, product_id):
+        def change(state):
+            state['items'].pop(product_id, None)
+            state['ids'].pop(product_id, None)
+            aliases = state.get('aliases', {})
+            for pk in [pk for pk, aliased in aliases.items() if aliased == product_id]:
+                del aliases[pk]
+        return self._update(cart_id, change)
+
+    def find(self, state, item_id):
+        """ Product id of the line with this item id, None when the cart has no such line"""
+        for product_id, pk in state['ids'].items():
+            if pk == item_id:
+                return product_id
+        # a provisional id handed out before the line was flushed
+        return state.get('aliases', {}).get(item_id)
+
+    def has_items(self, cart_id):
+        state = self.get(cart_id)
+        return bool(state and state['items'])
+
+    def lines(self, cart_id, state=None, product_ids=None):
+        """ CartItem instances with the cached quantities, the products are loaded in one query"""
+        state = state or self.get(cart_id)
+        if state is None:
+            return []
+        quantities = {product_id: quantity for product_id, quantity in state['items'].items() if product_ids is None or product_id in product_ids}
+        products = Product.objects.only('id', 'name', 'price', 'category_id').in_bulk(list(quantities))
+        cart = Cart(id=cart_id, user_id=state['user'])
+        return [
+            CartItem(id=state['ids'][product_id], cart=cart, product=products[product_id], quantity=quantity)
+            for product_id, quantity in quantities.items()
+            if product_id in products
+        ]
+
+    def attach(self, cart):
+        """ Serve cart.items.all() from the store, CartSerializer renders the cart as usual"""
+        cart._prefetched_objects_cache = {'items': self.lines(cart.pk)}
+        return cart
+
+    def flush(self, cart_id):
+        """ Write the cart lines to CartItem if they changed since the last flush"""
+        with transaction.atomic():
+            # held until commit, a waiting flusher then reads the entry this one flushed
+            if Cart.objects.select_for_update().filter(pk=cart_id).values_list('pk', flat=True).first() is None:
+                return False
+            state = self.cache.get(self._key(cart_id))
+            if state is None or state['version'] == state['flushed']:
+                return False
+            items = state['items']
+            CartItem.objects.filter(cart_id=cart_id).exclude(product_id__in=list(items)).delete()
+            existing = set(Product.objects.filter(pk__in=list(items)).values_list('id', flat=True))
+            rows = CartItem.objects.bulk_create(
+                [CartItem(cart_id=cart_id, product_id=product_id, quantity=quantity) for product_id, quantity in items.items() if product_id in existing],
+                update_conflicts=True, unique_fields=['cart', 'product'], update_fields=['quantity'],
+            )
+        # inside a checkout that rolls back the rows are gone again, only a commit makes the cart clean
+        version = state['version']
+        row_ids = {row.product_id: row.pk for row in rows}
+        transaction.on_commit(lambda: self._mark_flushed(cart_id, version, row_ids))
+        return True
+
+    def _mark_flushed(self, cart_id, version, row_ids):
+        with self._locked(cart_id):
+            state = self.cache.get(self._key(cart_id))
+            if state is None:
+                return
+            aliases = state.setdefault('aliases', {})
+            for product_id, pk in row_ids.items():
+                current = state['ids'].get(product_id)
+                # lines removed since the flush stay removed
+                if current is not None and current < 0:
+                    aliases[current] = product_id
+                    state['ids'][product_id] = pk
+            state['flushed'] = max(state['flushed'], version)
+            self.cache.set(self._key(cart_id), state, timeout=None)
+
+    def flush_all(self, chunk_size=500):
+        """ Flush every cart with unsaved changes, returns how many were written"""
+        flushed = 0
+        cart_ids = Cart.objects.order_by('pk').values_list('pk', flat=True)
+        for start in range(0, cart_ids.count(), chunk_size):
+            chunk = list(cart_ids[start:start + chunk_size])
+            states = self.cache.get_many([self._key(cart_id) for cart_id in chunk])
+            for cart_id in chunk:
+                state = states.get(self._key(cart_id))
+                if state and state['version'] != state['flushed']:
+                    flushed += self.flush(cart_id)
+        return flushed
+
+    def forget(self, cart_id):
+        self.cache.delete(self._key(cart_id))
+
+    def forget_on_commit(self, cart_id):
+        if self.enabled:
+            transaction.on_commit(lambda: self.forget(cart_id))
+
+
+cart_store = CartStore()
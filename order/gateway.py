@@ -0,0 +1,163 @@
+import asyncio
+import json
+import threading
+import time
+import weakref
+from functools import lru_cache
+from urllib.parse import urlencode
+from django.conf import settings
+
+
+class GatewayError(Exception):
+    pass
+
+
+class CircuitOpenError(GatewayError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Closed: calls go through. Open (after `failure_threshold` failures in a row):
+    calls fail right away for `reset_timeout` seconds. Half-open: one trial
+    call decides whether to close again or stay open.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    def end_trial(self):
+        """ Let the next call try again, when a trial call ended without success or failure"""
+        with self._lock:
+            self.trial_running = False
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+
+class SSLCommerzGateway:
+    """
+    Session API client sharing one urllib3 connection pool per process (and one
+    httpx pool per event loop for async views), with connect/read timeouts and
+    a circuit breaker in front of the gateway.
+    """
+
+    def __init__(self, store_id, store_pass, base_url, connect_timeout=3, read_timeout=10, pool_size=10, breaker=None):
+        self.store_id = store_id
+        self.store_pass = store_pass
+        self.session_url = f"{base_url.rstrip('/')}/gwprocess/v4/api.php"
+        self.breaker = breaker or CircuitBreaker()
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_size = pool_size
+        # pooled connections belong to the loop that opened them
+        self._async_clients = weakref.WeakKeyDictionary()
+        # imported with the first gateway, not at startup
+        import urllib3
+        self.http = urllib3.PoolManager(
+            maxsize=pool_size,
+            block=False,
+            retries=False,
+            timeout=urllib3.Timeout(connect=connect_timeout, read=read_timeout),
+        )
+
+    def create_session(self, post_body):
+        if not self.breaker.allow():
+            raise CircuitOpenError('Payment gateway is unavailable, try again later.')
+
+        import urllib3
+        body = dict(post_body, store_id=self.store_id, store_passwd=self.store_pass)
+        try:
+            response = self.http.request(
+                'POST',
+                self.session_url,
+                body=urlencode(body),
+                headers={'Content-Type': 'application/x-www-form-urlencoded'},
+            )
+            if response.status >= 500:
+                raise GatewayError(f'Payment gateway answered {response.status}')
+            data = json.loads(response.data)
+            self.breaker.record_success()
+        except (urllib3.exceptions.HTTPError, ValueError, GatewayError) as error:
+            self.breaker.record_failure()
+            raise GatewayError(str(error)) from error
+        finally:
+            # any other exception would keep the half-open trial taken, and the circuit open for good
+            self.breaker.end_trial()
+        return data
+
+    def async_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            import httpx
+            client = self._async_clients[loop] = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(max_connections=self.pool_size),
+            )
+        return client
+
+    async def acreate_session(self, post_body):
+        if not self.breaker.allow():
+            raise CircuitOpenError('Payment gateway is unavailable, try again later.')
+
+        import httpx
+        body = dict(post_body, store_id=self.store_id, store_passwd=self.store_pass)
+        try:
+            response = await self.async_client().post(self.session_url, data=body)
+            if response.status_code >= 500:
+                raise GatewayError(f'Payment gateway answered {response.status_code}')
+            data = json.loads(response.content)
+            self.breaker.record_success()
+        except (httpx.HTTPError, ValueError, GatewayError) as error:
+            self.breaker.record_failure()
+            raise GatewayError(str(error)) from error
+        finally:
+            self.breaker.end_trial()
+        return data
+
+
+@lru_cache(maxsize=None)
+def get_gateway():
+    """ Built once per process from settings.SSLCOMMERZ"""
+    options = settings.SSLCOMMERZ
+    base_url = options['BASE_URL'] or (
+        'https://sandbox.sslcommerz.com' if options['SANDBOX'] else 'https://securepay.sslcommerz.com'
+    )
+    return SSLCommerzGateway(
+        store_id=options['STORE_ID'],
+        store_pass=options['STORE_PASSWORD'],
+        base_url=base_url,
+        connect_timeout=options['CONNECT_TIMEOUT'],
+        read_timeout=options['READ_TIMEOUT'],
+        pool_size=options['POOL_SIZE'],
+        breaker=CircuitBreaker(options['FAILURE_THRESHOLD'], options['RESET_TIMEOUT']),
+    )
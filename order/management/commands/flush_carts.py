@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from order.carts import cart_store
+
+
+class Command(BaseCommand):
+    help = "Write carts changed in the cart store to CartItem, run it periodically with CART_STORE = 'cache'"
+
+    def handle(self, *args, **options):
+        if not cart_store.enabled:
+            self.stdout.write("CART_STORE is not 'cache', nothing to flush.")
+            return
+        self.stdout.write(self.style.SUCCESS(f'{cart_store.flush_all()} carts flushed'))
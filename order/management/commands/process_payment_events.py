@@ -0,0 +1,25 @@
+import time
+from django.core.management.base import BaseCommand
+from order.services import PaymentEventService
+
+
+class Command(BaseCommand):
+    help = 'Apply queued payment success callbacks to their orders in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new events instead of exiting when the queue is empty')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to wait between polls with --loop')
+
+    def handle(self, *args, **options):
+        total_events = total_orders = 0
+        while True:
+            events, orders = PaymentEventService.process_batch(options['batch_size'])
+            total_events += events
+            total_orders += orders
+            if events:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f'Processed {total_events} payment events, {total_orders} orders marked ready to ship.'))
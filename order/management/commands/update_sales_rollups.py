@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from order.services import SalesRollupService
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily sales rollups for every day touched by orders changed since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute every day, e.g. after orders were deleted')
+
+    def handle(self, *args, **options):
+        days = SalesRollupService.update_rollups(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(f'Recomputed sales rollups for {days} days.'))
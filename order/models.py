@@ -1,7 +1,7 @@
 from django.db import models
 from django.core.validators import MinValueValidator
 from users.models import User
-from product.models import Product
+from product.models import Product, Category
 from uuid import uuid4
 
 # Create your models here.
@@ -46,6 +46,11 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id']),
+        ]
+
     def __str__(self):
         return f"Order {self.id} by {self.user.email} status- {self.status}"
 
@@ -58,4 +63,58 @@ class OrderItem(models.Model):
     total_price = models.DecimalField(max_digits=12, decimal_places=2)
 
     def __str__(self):
-        return f"{self.quantity} × {self.product.name}"
\ No newline at end of file
+        return f"{self.quantity} × {self.product.name}"
+
+
+class PaymentEvent(models.Model):
+    """ Append-only log of gateway callbacks, one row per transaction however often it is retried"""
+    tran_id = models.CharField(max_length=100, unique=True)
+    order_id = models.UUIDField(null=True, blank=True)
+    payload = models.JSONField(default=dict)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    def __str__(self):
+        return f"Payment event {self.tran_id}"
+
+
+class DailyStatusSales(models.Model):
+    """ Orders and their value per creation day and current status"""
+    day = models.DateField()
+    status = models.CharField(max_length=1, choices=Order.STATUS_CHOICES)
+    orders = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = [['day', 'status']]
+
+
+class DailyProductSales(models.Model):
+    """ Units and revenue per day and product, canceled orders left out"""
+    day = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = [['day', 'product']]
+
+
+class DailyCategorySales(models.Model):
+    """ Units and revenue per day and category, canceled orders left out"""
+    day = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = [['day', 'category']]
+
+
+class RollupWatermark(models.Model):
+    """ Order.updated_at up to which a rollup has been recomputed"""
+    name = models.CharField(max_length=50, unique=True)
+    value = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} rolled up to {self.value}"
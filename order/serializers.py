@@ -5,7 +5,8 @@ from rest_framework.serializers import ModelSerializer
 from product.models import Product
 from order.models import Order, OrderItem
 from users.models import User
-from order.services import OrderService
+from order.services import OrderService, CartService
+from product.pricing import pricing, context_rules
 
 class EmptySerializer(serializers.Serializer):
     pass
@@ -24,7 +25,7 @@ class CartItemSerializer(ModelSerializer):
         fields = ['id', 'product', 'quantity', 'total_price']
 
     def get_total_price(self, cart_item: CartItem):
-        return cart_item.quantity * cart_item.product.price
+        return pricing.price_item(cart_item, context_rules(self.context)).total_price
 
 
 class AddCartItemSerializer(ModelSerializer):
@@ -40,21 +41,15 @@ class AddCartItemSerializer(ModelSerializer):
 
         product_id = self.validated_data['product_id']
         quantity = self.validated_data['quantity']
-        try:
-            cart_item = CartItem.objects.get(cart_id=cart_id, product_id=product_id)
-            cart_item.quantity += quantity
-            cart_item.save()
-            self.instance = cart_item
-        except CartItem.DoesNotExist:
-            cart_item = CartItem.objects.create(cart_id=cart_id, **self.validated_data)
-            self.instance = cart_item
+        # product existence is checked by the upsert itself, no extra query here
+        self.instance = CartService.add_items(cart_id, [(product_id, quantity)])[0]
         return self.instance
 
-    def validate_product_id(self, value):
-        if not Product.objects.filter(pk=value).exists():
-            raise serializers.ValidationError(f"Product with id {value} does not exits!")
-        return value
-    
+
+class CartItemInputSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+
 class UpdateCartItemSerializer(ModelSerializer):
     class Meta:
         model = CartItem
@@ -63,13 +58,27 @@ class UpdateCartItemSerializer(ModelSerializer):
 class CartSerializer(ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
     total_price = serializers.SerializerMethodField(method_name='get_total_price')
+    tax = serializers.SerializerMethodField(method_name='get_tax')
+    total_with_tax = serializers.SerializerMethodField(method_name='get_total_with_tax')
     class Meta:
         model = Cart
-        fields = ['id', 'user', 'items', 'total_price']
+        fields = ['id', 'user', 'items', 'total_price', 'tax', 'total_with_tax']
         read_only_fields = ['user']
 
+    def price(self, cart: Cart):
+        # priced once per cart, the same engine prices the checkout
+        if not hasattr(cart, '_priced'):
+            cart._priced = pricing.price_items(cart.items.all(), context_rules(self.context))
+        return cart._priced
+
     def get_total_price(self, cart: Cart):
-        return sum([item.product.price*item.quantity for item in cart.items.all()])
+        return self.price(cart).total_price
+
+    def get_tax(self, cart: Cart):
+        return self.price(cart).tax
+
+    def get_total_with_tax(self, cart: Cart):
+        return self.price(cart).total_with_tax
 
 
 class CreateOrderSerializer(serializers.Serializer):
@@ -79,7 +88,7 @@ class CreateOrderSerializer(serializers.Serializer):
     def validate_cart_id(self, cart_id):
         if not Cart.objects.filter(pk=cart_id).exists():
             raise serializers.ValidationError('No Cart found with this ID.')
-        if not CartItem.objects.filter(cart_id = cart_id).exists():
+        if not CartService.has_items(cart_id):
             raise serializers.ValidationError('Cart is empty')
         return cart_id
     
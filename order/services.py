@@ -1,7 +1,18 @@
-from order.models import Cart, Order, OrderItem
+from datetime import datetime, time, timedelta
+from functools import reduce
+from operator import or_
+from uuid import UUID
+from django.utils import timezone
+from order.models import Cart, CartItem, Order, OrderItem, PaymentEvent, DailyStatusSales, DailyProductSales, DailyCategorySales, RollupWatermark
+from product.models import Product
+from api.invalidation import invalidation_bus
+from product.pricing import pricing
+from order.carts import cart_store
 from users.models import User
-from django.db import transaction
-from rest_framework.exceptions import PermissionDenied
+from django.db import transaction, connections, router
+from django.db.models import Case, Count, F, PositiveIntegerField, Prefetch, Q, Sum, When
+from django.db.models.functions import TruncDate
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
 
 class OrderService:
     @staticmethod
@@ -9,32 +20,67 @@ class OrderService:
         with transaction.atomic():
             user = User.objects.get(pk=user_id)
             cart = Cart.objects.get(pk=cart_id)
-            cart_items = cart.items.select_related('product').all()
-            total_price = sum([item.product.price * item.quantity for item in cart_items])
-            order = Order.objects.create(user=user, total_price=total_price)
+            if cart_store.enabled:
+                # the working cart lives in the cache, bring CartItem up to date first
+                cart_store.flush(cart_id)
+            cart_items = cart.items.select_related('product').order_by('product_id')
+            OrderService.reserve_stock(cart_items)
+            # priced exactly like the cart the user was shown
+            priced = pricing.price_items(cart_items)
+            order = Order.objects.create(user=user, total_price=priced.total_price)
 
             order_items = [
                 OrderItem(
                     order = order,
                     product = item.product,
                     quantity = item.quantity,
-                    price = item.product.price,
-                    total_price = item.product.price * item.quantity
+                    price = priced.lines[item.product_id].unit_price,
+                    total_price = priced.lines[item.product_id].total_price
                 )
                 for item in cart_items
             ]
             # [<OrderItem(1)>, <OrderItem(2),..>]
             OrderItem.objects.bulk_create(order_items)
             cart.delete()
+            cart_store.forget_on_commit(cart_id)
+            transaction.on_commit(lambda: SalesRollupService.record_order(order, order_items), robust=True)
 
             return order
-    
+
+    @staticmethod
+    def reserve_stock(cart_items):
+        """ Take the cart quantities out of Product.stock or raise naming every short item"""
+        quantities = {item.product_id: item.quantity for item in cart_items}
+        product_ids = sorted(quantities)
+        if not product_ids:
+            return
+
+        # lock in pk order, two checkouts with overlapping carts always queue instead of deadlocking
+        list(Product.objects.select_for_update().filter(pk__in=product_ids).order_by('pk').values_list('pk'))
+
+        # single conditional UPDATE, every row has to pass its own stock >= quantity check
+        in_stock = reduce(or_, [Q(pk=pk, stock__gte=quantities[pk]) for pk in product_ids])
+        reserved = Product.objects.filter(in_stock).update(
+            stock=Case(*[When(pk=pk, then=F('stock') - quantities[pk]) for pk in product_ids], default=F('stock'), output_field=PositiveIntegerField())
+        )
+        if reserved != len(product_ids):
+            short = Product.objects.filter(pk__in=product_ids).order_by('pk')
+            errors = [
+                f"{product.name}: requested {quantities[product.pk]}, only {product.stock} left"
+                for product in short
+                if product.stock < quantities[product.pk]
+            ]
+            # raising inside the atomic block rolls back the rows that did pass
+            raise ValidationError({'out_of_stock': errors})
+
+        # stock is part of the cached product payload
+        invalidation_bus.publish_on_commit('product.Product')
 
     @staticmethod
     def cancel_order(order, user):
         if user.is_staff:
-            order.status = Order.CANCELED
-            order.save()
+            OrderService._set_canceled(order)
+            return order
 
         if user != order.user:
             raise PermissionDenied({'detail': 'You can change your own order status'})
@@ -42,8 +88,332 @@ class OrderService:
         if order.status == Order.DELIVERED:
             raise ValueError({'detail': 'Your order already delevered!'})
         
-        order.status = Order.CANCELED
-        order.save()
+        OrderService._set_canceled(order)
         return order
+
+    @staticmethod
+    def _set_canceled(order):
+        with transaction.atomic():
+            # the locked status decides, two racing cancels restock only once
+            previous = Order.objects.select_for_update().values_list('status', flat=True).get(pk=order.pk)
+            order.status = Order.CANCELED
+            order.save()
+            if previous != Order.CANCELED:
+                OrderService.release_stock(order)
+                transaction.on_commit(lambda: SalesRollupService.move_order(order, previous), robust=True)
+
+    @staticmethod
+    def release_stock(order):
+        """ Put the quantities of an order back into Product.stock"""
+        quantities = {}
+        for product_id, quantity in order.items.values_list('product_id', 'quantity'):
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+        product_ids = sorted(quantities)
+        if not product_ids:
+            return
+
+        Product.objects.filter(pk__in=product_ids).update(
+            stock=Case(*[When(pk=pk, then=F('stock') + quantities[pk]) for pk in product_ids], default=F('stock'), output_field=PositiveIntegerField())
+        )
+        invalidation_bus.publish_on_commit('product.Product')
         
-        
\ No newline at end of file
+
+
+class CartService:
+    @staticmethod
+    def add_items(cart_id, items):
+        """
+        Add [(product_id, quantity), ...] to a cart in one statement.
+        Existing lines are incremented in the database, so racing requests never lose quantity.
+        Raises a validation error (and adds nothing) when a product doesn't exist.
+        """
+        quantities = {}
+        for product_id, quantity in items:
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+
+        if cart_store.enabled:
+            return CartService._add_to_store(cart_id, quantities)
+
+        with transaction.atomic():
+            alias = router.db_for_write(CartItem)
+            if connections[alias].vendor in ['postgresql', 'sqlite']:
+                cart_items = CartService._upsert(connections[alias], cart_id, quantities)
+            else:
+                cart_items = CartService._get_or_increment(cart_id, quantities)
+
+            missing = sorted(set(quantities) - {item.product_id for item in cart_items})
+            if missing:
+                raise ValidationError({'product_id': [f"Product with id {product_id} does not exits!" for product_id in missing]})
+        return cart_items
+
+    @staticmethod
+    def _add_to_store(cart_id, quantities):
+        existing = set(Product.objects.filter(pk__in=list(quantities)).values_list('pk', flat=True))
+        missing = sorted(set(quantities) - existing)
+        if missing:
+            raise ValidationError({'product_id': [f"Product with id {product_id} does not exits!" for product_id in missing]})
+        totals = cart_store.add(cart_id, quantities)
+        if totals is None:
+            raise NotFound('No Cart found with this ID.')
+        return [CartItem(id=pk, cart_id=cart_id, product_id=product_id, quantity=quantity) for product_id, (pk, quantity) in totals.items()]
+
+    @staticmethod
+    def has_items(cart_id):
+        if cart_store.enabled:
+            return cart_store.has_items(cart_id)
+        return CartItem.objects.filter(cart_id=cart_id).exists()
+
+    @staticmethod
+    def _upsert(connection, cart_id, quantities):
+        quote = connection.ops.quote_name
+        table = quote(CartItem._meta.db_table)
+        products = quote(Product._meta.db_table)
+        db_cart_id = CartItem._meta.get_field('cart').target_field.get_db_prep_value(cart_id, connection)
+        values = ', '.join(['(%s, %s)'] * len(quantities))
+        params = [value for item in quantities.items() for value in item]
+
+        # the join drops unknown products instead of failing on the foreign key,
+        # "WHERE true" keeps SQLite from reading ON CONFLICT as a join constraint
+        sql = f"""
+            WITH incoming (product_id, quantity) AS (VALUES {values})
+            INSERT INTO {table} (cart_id, product_id, quantity)
+            SELECT %s, p.id, incoming.quantity FROM incoming
+            JOIN {products} AS p ON p.id = incoming.product_id
+            WHERE true
+            ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = {table}.quantity + excluded.quantity
+            RETURNING id, product_id, quantity
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params + [db_cart_id])
+            rows = cursor.fetchall()
+        return [CartItem(id=pk, cart_id=cart_id, product_id=product_id, quantity=quantity) for pk, product_id, quantity in rows]
+
+    @staticmethod
+    def _get_or_increment(cart_id, quantities):
+        existing = set(Product.objects.filter(pk__in=quantities).values_list('pk', flat=True))
+        cart_items = []
+        for product_id in sorted(existing):
+            quantity = quantities[product_id]
+            updated = CartItem.objects.filter(cart_id=cart_id, product_id=product_id).update(quantity=F('quantity') + quantity)
+            if not updated:
+                CartItem.objects.create(cart_id=cart_id, product_id=product_id, quantity=quantity)
+            cart_items.append(CartItem.objects.get(cart_id=cart_id, product_id=product_id))
+        return cart_items
+
+
+
+class PaymentEventService:
+    @staticmethod
+    def record(payload):
+        """ Store a success callback, replays of the same tran_id are dropped by the unique key"""
+        tran_id = payload.get('tran_id')
+        if not tran_id:
+            return False
+        try:
+            order_id = UUID(tran_id.split('_', 1)[1])
+        except (IndexError, ValueError):
+            order_id = None
+        event = PaymentEvent(tran_id=tran_id, order_id=order_id, payload=payload)
+        PaymentEvent.objects.bulk_create([event], ignore_conflicts=True)
+        return True
+
+    @staticmethod
+    def process_batch(batch_size=500):
+        """ Mark the orders of a batch of pending events paid, returns (events, orders updated)"""
+        now = timezone.now()
+        with transaction.atomic():
+            # skip_locked lets several workers share the queue
+            events = list(
+                PaymentEvent.objects.select_for_update(skip_locked=True)
+                .filter(processed_at__isnull=True)
+                .order_by('id')
+                .values_list('id', 'order_id')[:batch_size]
+            )
+            if not events:
+                return 0, 0
+            order_ids = {order_id for _, order_id in events if order_id}
+            # only unpaid orders move, a replayed callback can't pull a shipped order back
+            updated = Order.objects.filter(pk__in=order_ids, status=Order.NOT_PAID).update(
+                status=Order.READY_TO_SHIP, updated_at=now
+            )
+            PaymentEvent.objects.filter(pk__in=[pk for pk, _ in events]).update(processed_at=now)
+        return len(events), updated
+
+
+
+class OrderExportService:
+    CSV_HEADER = [
+        'order_id', 'user_id', 'status', 'order_total', 'created_at', 'updated_at',
+        'item_id', 'product_id', 'product_name', 'quantity', 'price', 'item_total',
+    ]
+
+    @staticmethod
+    def iter_orders(since=None, chunk_size=500):
+        """
+        Orders oldest change first, fetched chunk_size at a time (a server-side cursor on
+        PostgreSQL) with the items of each chunk prefetched in one query.
+        """
+        items = OrderItem.objects.select_related('product').order_by('id')
+        queryset = Order.objects.prefetch_related(Prefetch('items', queryset=items)).order_by('updated_at', 'id')
+        if since is not None:
+            queryset = queryset.filter(updated_at__gte=since)
+        return queryset.iterator(chunk_size=chunk_size)
+
+    @staticmethod
+    def csv_rows(orders):
+        for order in orders:
+            for item in order.items.all():
+                yield [
+                    order.id, order.user_id, order.status, order.total_price,
+                    order.created_at.isoformat(), order.updated_at.isoformat(),
+                    item.id, item.product_id, item.product.name, item.quantity, item.price, item.total_price,
+                ]
+
+
+
+class SalesRollupService:
+    """
+    Daily sales rollups keyed by the day an order was created.
+    - create_order and cancel_order apply their deltas right after commit
+    - update_rollups recomputes every day touched by orders changed since the
+      watermark, which also covers other status changes (payments, admin edits)
+      and repairs anything a delta missed
+    """
+
+    WATERMARK = 'sales'
+    # rescan this far behind the watermark, transactions still open at the last run get picked up
+    overlap = timedelta(minutes=5)
+    days_per_transaction = 31
+
+    @staticmethod
+    def _add(model, key, day, deltas):
+        """ Create missing rows for deltas = {key value: {field: delta}}, then apply them in one UPDATE"""
+        if not deltas:
+            return
+        values = sorted(deltas)
+        model.objects.bulk_create([model(day=day, **{key: value}) for value in values], ignore_conflicts=True)
+        fields = deltas[values[0]].keys()
+        model.objects.filter(day=day, **{f'{key}__in': values}).update(**{
+            field: Case(
+                *[When(**{key: value}, then=F(field) + deltas[value][field]) for value in values],
+                default=F(field),
+                output_field=model._meta.get_field(field),
+            )
+            for field in fields
+        })
+
+    @staticmethod
+    def _apply(order, items, status, sign):
+        day = timezone.localdate(order.created_at)
+        SalesRollupService._add(DailyStatusSales, 'status', day, {status: {'orders': sign, 'revenue': sign * order.total_price}})
+        if status == Order.CANCELED:
+            return
+
+        products, categories = {}, {}
+        for item in items:
+            for deltas, value in [(products, item.product_id), (categories, item.product.category_id)]:
+                delta = deltas.setdefault(value, {'quantity': 0, 'revenue': 0})
+                delta['quantity'] += sign * item.quantity
+                delta['revenue'] += sign * item.total_price
+        SalesRollupService._add(DailyProductSales, 'product_id', day, products)
+        SalesRollupService._add(DailyCategorySales, 'category_id', day, categories)
+
+    @staticmethod
+    def record_order(order, items):
+        with transaction.atomic():
+            SalesRollupService._apply(order, items, order.status, 1)
+
+    @staticmethod
+    def move_order(order, previous_status):
+        """ Move an order from previous_status to its current status"""
+        items = list(order.items.select_related('product'))
+        with transaction.atomic():
+            SalesRollupService._apply(order, items, previous_status, -1)
+            SalesRollupService._apply(order, items, order.status, 1)
+
+    @staticmethod
+    def refresh_days(days):
+        """ Recompute the rollup rows of the given days from the raw orders"""
+        days = sorted(set(days))
+        if not days:
+            return
+        tz = timezone.get_current_timezone()
+        # plain range on created_at first so the index narrows the scan before TruncDate
+        lower = timezone.make_aware(datetime.combine(days[0], time.min), tz)
+        upper = timezone.make_aware(datetime.combine(days[-1] + timedelta(days=1), time.min), tz)
+        orders = (
+            Order.objects.filter(created_at__gte=lower, created_at__lt=upper)
+            .annotate(day=TruncDate('created_at')).filter(day__in=days)
+        )
+        items = (
+            OrderItem.objects.filter(order__created_at__gte=lower, order__created_at__lt=upper)
+            .exclude(order__status=Order.CANCELED)
+            .annotate(day=TruncDate('order__created_at')).filter(day__in=days)
+        )
+
+        with transaction.atomic():
+            for model in [DailyStatusSales, DailyProductSales, DailyCategorySales]:
+                model.objects.filter(day__in=days).delete()
+            DailyStatusSales.objects.bulk_create(
+                DailyStatusSales(**row)
+                for row in orders.values('day', 'status').annotate(orders=Count('id'), revenue=Sum('total_price')).order_by()
+            )
+            DailyProductSales.objects.bulk_create(
+                DailyProductSales(**row)
+                for row in items.values('day', 'product_id').annotate(quantity=Sum('quantity'), revenue=Sum('total_price')).order_by()
+            )
+            DailyCategorySales.objects.bulk_create(
+                DailyCategorySales(day=row['day'], category_id=row['product__category_id'], quantity=row['quantity'], revenue=row['revenue'])
+                for row in items.values('day', 'product__category_id').annotate(quantity=Sum('quantity'), revenue=Sum('total_price')).order_by()
+            )
+
+    @staticmethod
+    def update_rollups(full=False):
+        """ Recompute the days touched since the watermark (every day with full=True), returns how many"""
+        watermark, _ = RollupWatermark.objects.get_or_create(name=SalesRollupService.WATERMARK)
+        started = timezone.now()
+        orders = Order.objects.all()
+        if watermark.value is not None and not full:
+            orders = orders.filter(updated_at__gte=watermark.value - SalesRollupService.overlap)
+        days = sorted(set(orders.annotate(day=TruncDate('created_at')).values_list('day', flat=True).order_by()))
+
+        if full:
+            for model in [DailyStatusSales, DailyProductSales, DailyCategorySales]:
+                model.objects.exclude(day__in=days).delete()
+        step = SalesRollupService.days_per_transaction
+        for index in range(0, len(days), step):
+            SalesRollupService.refresh_days(days[index:index + step])
+
+        watermark.value = started
+        watermark.save(update_fields=['value'])
+        return len(days)
+
+    @staticmethod
+    def report(start, end, group_by='day'):
+        """ Sales between start and end (inclusive dates) answered from the rollups"""
+        sold = ~Q(status=Order.CANCELED)
+        if group_by == 'status':
+            rows = (
+                DailyStatusSales.objects.filter(day__range=(start, end))
+                .values('status').annotate(orders=Sum('orders'), revenue=Sum('revenue')).order_by('status')
+            )
+        elif group_by == 'product':
+            rows = (
+                DailyProductSales.objects.filter(day__range=(start, end))
+                .values('product_id', 'product__name').annotate(quantity=Sum('quantity'), revenue=Sum('revenue')).order_by('-revenue', 'product_id')
+            )
+        elif group_by == 'category':
+            rows = (
+                DailyCategorySales.objects.filter(day__range=(start, end))
+                .values('category_id', 'category__name').annotate(quantity=Sum('quantity'), revenue=Sum('revenue')).order_by('-revenue', 'category_id')
+            )
+        else:
+            rows = (
+                DailyStatusSales.objects.filter(day__range=(start, end)).values('day').annotate(
+                    # canceled goes first, the orders alias below shadows the column
+                    canceled=Sum('orders', filter=~sold),
+                    orders=Sum('orders', filter=sold),
+                    revenue=Sum('revenue', filter=sold),
+                ).order_by('day')
+            )
+        return list(rows)
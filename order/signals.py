@@ -0,0 +1,14 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from api.invalidation import invalidation_bus
+from order.cache import purchase_cache
+from order.models import Order
+
+
+# placing, canceling and deleting an order all change what the user has purchased
+@receiver([post_save, post_delete], sender=Order)
+def invalidate_purchases(sender, instance, **kwargs):
+    purchase_cache.invalidate_on_commit(instance.user_id)
+
+
+invalidation_bus.subscribe('purchases', lambda event: purchase_cache.invalidate(event.pk), backend=purchase_cache.cache)
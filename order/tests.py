@@ -1,3 +1,685 @@
-from django.test import TestCase
+import csv
+import json
+import shutil
+import tempfile
+from datetime import datetime
+from decimal import Decimal
+from io import StringIO
+import threading
+import time
+from unittest import mock
+from uuid import uuid4
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, OperationalError, transaction
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from order.carts import cart_store
+from order.gateway import get_gateway
+from rest_framework.exceptions import ValidationError
+from order.models import Cart, CartItem, Order, OrderItem, PaymentEvent, DailyStatusSales, DailyProductSales, DailyCategorySales
+from order.services import OrderExportService, OrderService
+from product.cache import catalog_cache
+from product.models import Category, PriceRule, Product
+from product.pricing import pricing
+from users.models import User
 
-# Create your tests here.
+
+class ConcurrentCheckoutTest(TransactionTestCase):
+    """ Many buyers race for a small stock, nobody may get more than there is"""
+
+    buyers = 12
+    stock = 5
+
+    def setUp(self):
+        category = Category.objects.create(name='Hot')
+        self.first = Product.objects.create(name='First', description='x', price=10, stock=self.stock, category=category)
+        self.second = Product.objects.create(name='Second', description='x', price=5, stock=self.stock * 10, category=category)
+        self.carts = []
+        for index in range(self.buyers):
+            user = User.objects.create_user(email=f'buyer{index}@example.com')
+            cart = Cart.objects.create(user=user)
+            # half of the carts add the products in the opposite order
+            products = [self.first, self.second] if index % 2 else [self.second, self.first]
+            for product in products:
+                CartItem.objects.create(cart=cart, product=product, quantity=1)
+            self.carts.append((cart.id, user.id))
+
+    def checkout(self, cart_id, user_id):
+        try:
+            OrderService.create_order(cart_id=cart_id, user_id=user_id)
+            return 'ordered'
+        except ValidationError:
+            return 'out_of_stock'
+        except OperationalError:
+            # SQLite has no row locks, a writer that can't get the database lock gives up instead of waiting
+            if connection.vendor != 'sqlite':
+                raise
+            return 'busy'
+        finally:
+            connection.close()
+
+    def test_no_oversell_and_no_deadlock(self):
+        with ThreadPoolExecutor(max_workers=self.buyers) as pool:
+            futures = [pool.submit(self.checkout, cart_id, user_id) for cart_id, user_id in self.carts]
+            results = [future.result(timeout=30) for future in futures]
+
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        ordered = results.count('ordered')
+        self.assertLessEqual(ordered, self.stock)
+        self.assertEqual(self.first.stock, self.stock - ordered)
+        self.assertEqual(self.second.stock, self.stock * 10 - ordered)
+        self.assertEqual(Order.objects.count(), ordered)
+        if connection.vendor != 'sqlite':
+            self.assertEqual(ordered, self.stock)
+
+    def test_out_of_stock_names_items(self):
+        cart_id, user_id = self.carts[0]
+        CartItem.objects.filter(cart_id=cart_id, product=self.first).update(quantity=self.stock + 1)
+
+        with self.assertRaises(ValidationError) as error:
+            OrderService.create_order(cart_id=cart_id, user_id=user_id)
+
+        self.assertIn('First', str(error.exception.detail['out_of_stock'][0]))
+        self.second.refresh_from_db()
+        self.assertEqual(self.second.stock, self.stock * 10)
+
+    def test_cancel_restocks_once(self):
+        cart_id, user_id = self.carts[0]
+        CartItem.objects.filter(cart_id=cart_id, product=self.first).update(quantity=self.stock)
+        order = OrderService.create_order(cart_id=cart_id, user_id=user_id)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.stock, 0)
+
+        version = catalog_cache.get_version()
+        client = APIClient()
+        client.force_authenticate(order.user)
+        for _ in range(2):
+            response = client.post(f'/api/v1/orders/{order.pk}/cancel/')
+            self.assertEqual(response.status_code, 200)
+
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual(self.first.stock, self.stock)
+        self.assertEqual(self.second.stock, self.stock * 10)
+        # the cached product pages showing the old stock are retired
+        self.assertGreater(catalog_cache.get_version(), version)
+
+
+    def test_staff_cancels_another_users_order(self):
+        cart_id, user_id = self.carts[0]
+        order = OrderService.create_order(cart_id=cart_id, user_id=user_id)
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(email='staff@example.com', is_staff=True))
+        response = client.post(f'/api/v1/orders/{order.pk}/cancel/')
+        self.assertEqual(response.status_code, 200)
+
+        order.refresh_from_db()
+        self.first.refresh_from_db()
+        self.assertEqual(order.status, Order.CANCELED)
+        self.assertEqual(self.first.stock, self.stock)
+
+
+class StubGatewayHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        server.requests += 1
+        self.rfile.read(int(self.headers['Content-Length']))
+        if server.mode == 'slow':
+            time.sleep(1)
+        if server.mode == 'error':
+            self.send_response(500)
+            self.end_headers()
+            return
+        body = json.dumps({'status': 'SUCCESS', 'GatewayPageURL': 'https://gateway.test/pay/1'}).encode()
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client already gave up on a slow answer
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+class PaymentInitiationTest(TestCase):
+    """ Both payment initiation endpoints against a local stub gateway"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubGatewayHandler)
+        cls.server.mode = 'success'
+        cls.server.requests = 0
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.mode = 'success'
+        self.server.requests = 0
+        gateway_settings = {
+            'STORE_ID': 'store', 'STORE_PASSWORD': 'secret', 'SANDBOX': True,
+            'BASE_URL': f'http://127.0.0.1:{self.server.server_address[1]}',
+            'CONNECT_TIMEOUT': 1, 'READ_TIMEOUT': 0.3, 'POOL_SIZE': 2,
+            'FAILURE_THRESHOLD': 3, 'RESET_TIMEOUT': 60,
+        }
+        self.settings_override = override_settings(SSLCOMMERZ=gateway_settings)
+        self.settings_override.enable()
+        get_gateway.cache_clear()
+        cache.clear()
+        user = User.objects.create_user(email='payer@example.com')
+        self.auth = {'HTTP_AUTHORIZATION': f'JWT {AccessToken.for_user(user)}'}
+        self.payload = {'amount': 100, 'order_id': 'abc', 'num_items': 1}
+
+    def tearDown(self):
+        get_gateway.cache_clear()
+        self.settings_override.disable()
+
+    def test_sync_and_async_return_gateway_url(self):
+        for url in ['/api/v1/payment/initiate/', '/api/v1/payment/initiate/async/']:
+            response = self.client.post(url, self.payload, content_type='application/json', **self.auth)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), {'payment_url': 'https://gateway.test/pay/1'})
+
+    async def test_async_stack_calls_the_gateway_natively(self):
+        # through the ASGI handler, the middlewares run in async mode
+        response = await self.async_client.post(
+            '/api/v1/payment/initiate/async/', self.payload, content_type='application/json',
+            headers={'Authorization': self.auth['HTTP_AUTHORIZATION']},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'payment_url': 'https://gateway.test/pay/1'})
+        self.assertEqual(len(get_gateway()._async_clients), 1)
+
+    def test_async_requires_authentication(self):
+        response = self.client.post('/api/v1/payment/initiate/async/', self.payload, content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_read_timeout_fails_fast(self):
+        self.server.mode = 'slow'
+        started = time.monotonic()
+        response = self.client.post('/api/v1/payment/initiate/async/', self.payload, content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 400)
+        self.assertLess(time.monotonic() - started, 0.9)
+
+    def test_circuit_opens_after_repeated_errors(self):
+        self.server.mode = 'error'
+        for _ in range(3):
+            response = self.client.post('/api/v1/payment/initiate/async/', self.payload, content_type='application/json', **self.auth)
+            self.assertEqual(response.status_code, 400)
+
+        response = self.client.post('/api/v1/payment/initiate/', self.payload, content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.server.requests, 3)
+
+    def test_unexpected_error_releases_the_trial(self):
+        gateway = get_gateway()
+        gateway.breaker.opened_at = time.monotonic() - gateway.breaker.reset_timeout
+        with mock.patch.object(gateway.http, 'request', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                gateway.create_session({})
+        # the half-open trial is free again, the next call decides
+        self.assertEqual(gateway.create_session({})['status'], 'SUCCESS')
+        self.assertFalse(gateway.breaker.is_open)
+
+
+class PaymentCallbackReplayTest(TestCase):
+    """ A retrying gateway must not turn into repeated order writes"""
+
+    orders = 20
+    replays = 100
+
+    def setUp(self):
+        user = User.objects.create_user(email='replay@example.com')
+        self.order_ids = [Order.objects.create(user=user, total_price=10).id for _ in range(self.orders)]
+
+    def replay(self, order_ids):
+        for _ in range(self.replays):
+            for order_id in order_ids:
+                response = self.client.post('/api/v1/payment/success/', {'tran_id': f'trn_{order_id}', 'status': 'VALID'})
+                self.assertEqual(response.status_code, 302)
+
+    def test_replayed_callbacks_apply_once(self):
+        self.replay(self.order_ids)
+        self.assertEqual(PaymentEvent.objects.count(), self.orders)
+        self.assertEqual(Order.objects.filter(status=Order.NOT_PAID).count(), self.orders)
+
+        call_command('process_payment_events', batch_size=7, stdout=StringIO())
+        self.assertEqual(Order.objects.filter(status=Order.READY_TO_SHIP).count(), self.orders)
+        self.assertFalse(PaymentEvent.objects.filter(processed_at__isnull=True).exists())
+
+    def test_replay_after_shipping_changes_nothing(self):
+        self.replay(self.order_ids[:1])
+        call_command('process_payment_events', stdout=StringIO())
+        Order.objects.filter(pk=self.order_ids[0]).update(status=Order.SHIPPED)
+
+        self.replay(self.order_ids[:1])
+        call_command('process_payment_events', stdout=StringIO())
+        self.assertEqual(Order.objects.get(pk=self.order_ids[0]).status, Order.SHIPPED)
+
+
+class SalesRollupTest(TestCase):
+    """ Live deltas and the recompute command must agree with the raw orders"""
+
+    def setUp(self):
+        cache.clear()
+        self.staff = User.objects.create_user(email='staff@example.com', is_staff=True)
+        self.buyer = User.objects.create_user(email='rollup@example.com')
+        self.phones = Category.objects.create(name='Phones')
+        self.books = Category.objects.create(name='Books')
+        self.phone = Product.objects.create(name='Phone', description='x', price=100, stock=50, category=self.phones)
+        self.book = Product.objects.create(name='Book', description='x', price=7, stock=50, category=self.books)
+
+    def checkout(self, quantities):
+        cart = Cart.objects.create(user=self.buyer)
+        for product, quantity in quantities:
+            CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+        with self.captureOnCommitCallbacks(execute=True):
+            return OrderService.create_order(cart_id=cart.id, user_id=self.buyer.id)
+
+    def snapshot(self):
+        return (
+            sorted(DailyStatusSales.objects.values_list('day', 'status', 'orders', 'revenue')),
+            sorted(DailyProductSales.objects.values_list('day', 'product_id', 'quantity', 'revenue')),
+            sorted(DailyCategorySales.objects.values_list('day', 'category_id', 'quantity', 'revenue')),
+        )
+
+    def test_live_deltas_match_recompute(self):
+        self.checkout([(self.phone, 1), (self.book, 3)])
+        self.checkout([(self.book, 2)])
+        canceled = self.checkout([(self.phone, 2)])
+        with self.captureOnCommitCallbacks(execute=True):
+            OrderService.cancel_order(canceled, self.buyer)
+
+        live = self.snapshot()
+        self.assertEqual(DailyProductSales.objects.get(product=self.phone).quantity, 1)
+        self.assertEqual(DailyCategorySales.objects.get(category=self.books).revenue, 35)
+        self.assertEqual(DailyStatusSales.objects.get(status=Order.CANCELED).orders, 1)
+
+        call_command('update_sales_rollups', full=True, stdout=StringIO())
+        self.assertEqual(self.snapshot(), live)
+
+    def test_command_picks_up_status_changes(self):
+        order = self.checkout([(self.book, 1)])
+        call_command('update_sales_rollups', stdout=StringIO())
+        Order.objects.filter(pk=order.pk).update(status=Order.READY_TO_SHIP, updated_at=timezone.now())
+
+        call_command('update_sales_rollups', stdout=StringIO())
+        self.assertEqual(list(DailyStatusSales.objects.values_list('status', 'orders')), [(Order.READY_TO_SHIP, 1)])
+
+    def test_report_endpoint(self):
+        self.checkout([(self.phone, 1), (self.book, 3)])
+        auth = {'HTTP_AUTHORIZATION': f'JWT {AccessToken.for_user(self.staff)}'}
+
+        response = self.client.get('/api/v1/reports/sales/?group_by=category', **auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(row['category__name'], row['quantity']) for row in response.data['results']], [('Phones', 1), ('Books', 3)])
+
+        response = self.client.get('/api/v1/reports/sales/', **auth)
+        self.assertEqual(response.data['results'][0]['revenue'], 121)
+        self.assertEqual(self.client.get('/api/v1/reports/sales/?start=2024-02-30', **auth).status_code, 400)
+
+        buyer = {'HTTP_AUTHORIZATION': f'JWT {AccessToken.for_user(self.buyer)}'}
+        self.assertEqual(self.client.get('/api/v1/reports/sales/', **buyer).status_code, 403)
+
+
+class PurchaseLookupTest(TestCase):
+    """ One call answers a whole product grid, warm calls don't touch the purchase tables"""
+
+    def setUp(self):
+        # ids come back after each test's rollback, entries of an earlier test must not answer
+        cache.clear()
+        self.buyer = User.objects.create_user(email='grid@example.com')
+        category = Category.objects.create(name='Grid')
+        self.products = [
+            Product.objects.create(name=f'Item {index}', description='x', price=5, stock=10, category=category)
+            for index in range(3)
+        ]
+        self.auth = {'HTTP_AUTHORIZATION': f'JWT {AccessToken.for_user(self.buyer)}'}
+        self.url = '/api/v1/orders/has-ordered/?product_ids=' + ','.join(str(product.id) for product in self.products)
+
+    def checkout(self, product):
+        cart = Cart.objects.create(user=self.buyer)
+        CartItem.objects.create(cart=cart, product=product, quantity=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            return OrderService.create_order(cart_id=cart.id, user_id=self.buyer.id)
+
+    def flags(self):
+        data = self.client.get(self.url, **self.auth).data
+        return [(data[str(product.id)]['hasOrdered'], data[str(product.id)]['hasReviewed']) for product in self.products]
+
+    def test_flags_follow_orders_and_reviews(self):
+        first, second, _ = self.products
+        order = self.checkout(first)
+        self.checkout(second)
+        self.assertEqual(self.flags(), [(True, False), (True, False), (False, False)])
+
+        # only the user, the authentication cache is off on the local-memory test cache
+        with self.assertNumQueries(1):
+            self.flags()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/api/v1/products/{first.id}/reviews/', {'ratings': 5, 'comment': 'ok'}, **self.auth)
+        self.assertEqual(response.status_code, 201)
+        with self.captureOnCommitCallbacks(execute=True):
+            OrderService.cancel_order(order, self.buyer)
+        self.assertEqual(self.flags(), [(False, True), (True, False), (False, False)])
+
+        response = self.client.get(f'/api/v1/orders/has-ordered/{second.id}', **self.auth)
+        self.assertEqual(response.data, {'hasOrdered': True})
+
+    def test_rejects_bad_ids(self):
+        response = self.client.get('/api/v1/orders/has-ordered/?product_ids=1,x', **self.auth)
+        self.assertEqual(response.status_code, 400)
+
+
+class OrderExportTest(TestCase):
+    """ /orders/export/ streams every order changed since ?since= as NDJSON or CSV, admins only"""
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user(email='exporter@example.com', is_staff=True)
+        self.buyer = User.objects.create_user(email='exported@example.com')
+        category = Category.objects.create(name='Exports')
+        product = Product.objects.create(name='Crate, wooden', description='x', price=7, stock=20, category=category)
+        self.orders = []
+        for day, quantities in [(1, [1]), (5, [2, 3]), (9, [4])]:
+            order = Order.objects.create(user=self.buyer, total_price=7 * sum(quantities))
+            OrderItem.objects.bulk_create(
+                OrderItem(order=order, product=product, quantity=quantity, price=7, total_price=7 * quantity) for quantity in quantities
+            )
+            Order.objects.filter(pk=order.pk).update(updated_at=timezone.make_aware(datetime(2026, 3, day, 12)))
+            self.orders.append(str(order.pk))
+
+    def export(self, query, user=None):
+        user = user or self.admin
+        return self.client.get(f'/api/v1/orders/export/?{query}', HTTP_AUTHORIZATION=f'JWT {AccessToken.for_user(user)}')
+
+    def test_ndjson(self):
+        response = self.export('format=ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertIn('orders.ndjson', response['Content-Disposition'])
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        # oldest change first
+        self.assertEqual([row['id'] for row in rows], self.orders)
+        self.assertEqual([len(row['items']) for row in rows], [1, 2, 1])
+
+    def test_csv(self):
+        response = self.export('format=csv&since=2026-03-05')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0], OrderExportService.CSV_HEADER)
+        # one row per item, the comma in the name is quoted
+        self.assertEqual([(row[0], row[8], row[9]) for row in rows[1:]], [
+            (self.orders[1], 'Crate, wooden', '2'), (self.orders[1], 'Crate, wooden', '3'), (self.orders[2], 'Crate, wooden', '4'),
+        ])
+
+    def test_since(self):
+        def exported(since):
+            response = self.export(f'format=ndjson&since={since}')
+            self.assertEqual(response.status_code, 200)
+            return [json.loads(line)['id'] for line in b''.join(response.streaming_content).decode().splitlines()]
+
+        self.assertEqual(exported('2026-03-05T12:00:00%2B00:00'), self.orders[1:])
+        self.assertEqual(exported('2026-03-05T12:00:01Z'), self.orders[2:])
+        self.assertEqual(exported('2026-03-10'), [])
+        for since in ['last-week', '2024-13-01', '2024-02-30T10:00']:
+            response = self.export(f'format=ndjson&since={since}')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('since', response.data)
+
+    def test_admin_only(self):
+        self.assertEqual(self.export('format=ndjson', user=self.buyer).status_code, 403)
+        self.assertEqual(self.client.get('/api/v1/orders/export/?format=ndjson').status_code, 401)
+
+
+class CartItemAddTest(TestCase):
+    """ Adds merge into one line per product, unknown products add nothing"""
+
+    def setUp(self):
+        self.buyer = User.objects.create_user(email='adder@example.com')
+        category = Category.objects.create(name='Adds')
+        self.first = Product.objects.create(name='First', description='x', price=10, stock=20, category=category)
+        self.second = Product.objects.create(name='Second', description='x', price=4, stock=20, category=category)
+        self.auth = {'HTTP_AUTHORIZATION': f'JWT {AccessToken.for_user(self.buyer)}'}
+        self.cart_id = self.client.post('/api/v1/carts/', **self.auth).data['id']
+        self.items_url = f'/api/v1/carts/{self.cart_id}/items/'
+
+    def add(self, product_id, quantity):
+        return self.client.post(self.items_url, {'product_id': product_id, 'quantity': quantity}, content_type='application/json', **self.auth)
+
+    def batch(self, items):
+        return self.client.post(self.items_url + 'batch/', items, content_type='application/json', **self.auth)
+
+    def lines(self):
+        return sorted(CartItem.objects.filter(cart_id=self.cart_id).values_list('product_id', 'quantity'))
+
+    def test_repeated_adds_merge(self):
+        first = self.add(self.first.id, 2)
+        self.assertEqual(first.status_code, 201)
+        again = self.add(self.first.id, 3)
+        self.assertEqual(again.status_code, 201)
+        self.assertEqual(again.data, {'id': first.data['id'], 'product_id': self.first.id, 'quantity': 5})
+        self.assertEqual(self.lines(), [(self.first.id, 5)])
+
+    def test_batch(self):
+        self.add(self.first.id, 1)
+        response = self.batch([
+            {'product_id': self.first.id, 'quantity': 1},
+            {'product_id': self.second.id, 'quantity': 2},
+            {'product_id': self.first.id, 'quantity': 1},
+        ])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(sorted((item['product_id'], item['quantity']) for item in response.data), [(self.first.id, 3), (self.second.id, 2)])
+        self.assertEqual(self.lines(), [(self.first.id, 3), (self.second.id, 2)])
+
+        for items in [[], [{'product_id': self.first.id, 'quantity': 0}], {'product_id': self.first.id, 'quantity': 1}]:
+            self.assertEqual(self.batch(items).status_code, 400)
+        self.assertEqual(self.lines(), [(self.first.id, 3), (self.second.id, 2)])
+
+    def test_unknown_product_adds_nothing(self):
+        missing = self.second.id + 1000
+        response = self.add(missing, 1)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(missing), str(response.data['product_id']))
+
+        response = self.batch([{'product_id': self.first.id, 'quantity': 1}, {'product_id': missing, 'quantity': 1}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.lines(), [])
+
+    def test_other_users_cart(self):
+        other = {'HTTP_AUTHORIZATION': f"JWT {AccessToken.for_user(User.objects.create_user(email='other@example.com'))}"}
+        response = self.client.post(self.items_url + 'batch/', [{'product_id': self.first.id, 'quantity': 1}], content_type='application/json', **other)
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post(self.items_url, {'product_id': self.first.id, 'quantity': 1}, content_type='application/json', **other)
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.lines(), [])
+
+        for cart_id in [uuid4(), 'not-a-uuid']:
+            response = self.client.post(f'/api/v1/carts/{cart_id}/items/batch/', [{'product_id': self.first.id, 'quantity': 1}], content_type='application/json', **self.auth)
+            self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CART_STORE='cache')
+class CartStoreTest(TestCase):
+    """ Cart lines in the cache answer like CartItem rows and reach the database at checkout or flush"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        shared = override_settings(CACHES=dict(
+            settings.CACHES, carts={'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory},
+        ))
+        shared.enable()
+        self.addCleanup(shared.disable)
+        cache.clear()
+        self.buyer = User.objects.create_user(email='store@example.com')
+        category = Category.objects.create(name='Store')
+        self.first = Product.objects.create(name='First', description='x', price=10, stock=20, category=category)
+        self.second = Product.objects.create(name='Second', description='x', price=4, stock=20, category=category)
+        self.auth = {'HTTP_AUTHORIZATION': f'JWT {AccessToken.for_user(self.buyer)}'}
+        self.cart_id = self.client.post('/api/v1/carts/', **self.auth).data['id']
+        self.items_url = f'/api/v1/carts/{self.cart_id}/items/'
+
+    def add(self, product, quantity):
+        return self.client.post(self.items_url, {'product_id': product.id, 'quantity': quantity}, content_type='application/json', **self.auth)
+
+    def test_lines_stay_in_the_cache(self):
+        first = self.add(self.first, 2).data
+        # nothing is written before a flush, new lines get provisional ids
+        first_id = first['id']
+        self.assertLess(first_id, 0)
+        self.assertEqual(first, {'id': first_id, 'product_id': self.first.id, 'quantity': 2})
+        self.assertEqual(self.add(self.first, 1).data, {'id': first_id, 'product_id': self.first.id, 'quantity': 3})
+        response = self.client.post(self.items_url + 'batch/', [{'product_id': self.second.id, 'quantity': 5}], content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 201)
+        second_id = response.data[0]['id']
+        self.assertLess(second_id, first_id)
+        self.assertEqual(self.add(Product(id=999999), 1).status_code, 400)
+
+        response = self.client.patch(f'{self.items_url}{second_id}/', {'quantity': 1}, content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(CartItem.objects.exists())
+
+        cart = self.client.get(f'/api/v1/carts/{self.cart_id}/', **self.auth).data
+        self.assertEqual(cart['total_price'], 34)
+        self.assertEqual(
+            [(item['id'], item['product']['name'], item['quantity'], item['total_price']) for item in cart['items']],
+            [(first_id, 'First', 3, 30), (second_id, 'Second', 1, 4)],
+        )
+        self.assertEqual(self.client.get(f'{self.items_url}{second_id}/', **self.auth).data['total_price'], 4)
+
+        self.assertEqual(self.client.delete(f'{self.items_url}{second_id}/', **self.auth).status_code, 204)
+        self.assertEqual(self.client.get(f'{self.items_url}{second_id}/', **self.auth).status_code, 404)
+        self.assertEqual([item['id'] for item in self.client.get(self.items_url, **self.auth).data], [first_id])
+        # added again, the line gets a new id, the removed one stays gone
+        self.assertNotIn(self.add(self.second, 2).data['id'], [first_id, second_id])
+
+        other = {'HTTP_AUTHORIZATION': f"JWT {AccessToken.for_user(User.objects.create_user(email='other@example.com'))}"}
+        self.assertEqual(self.client.get(f'{self.items_url}{first_id}/', **other).status_code, 403)
+
+    def test_flush_swaps_in_the_row_ids(self):
+        provisional = self.add(self.first, 2).data['id']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(cart_store.flush(self.cart_id))
+        row = CartItem.objects.get()
+        self.assertEqual((row.product_id, row.quantity), (self.first.id, 2))
+        self.assertEqual([item['id'] for item in self.client.get(self.items_url, **self.auth).data], [row.id])
+        self.assertEqual(self.add(self.first, 1).data['id'], row.id)
+        # a client still holding the provisional id reaches the same line
+        response = self.client.patch(f'{self.items_url}{provisional}/', {'quantity': 5}, content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(f'{self.items_url}{row.id}/', **self.auth).data['quantity'], 5)
+
+        # a flush rolled back with its checkout leaves the cart dirty, ids unchanged
+        self.add(self.second, 1)
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            cart_store.flush(self.cart_id)
+            raise RuntimeError
+        state = cart_store.get(self.cart_id)
+        self.assertLess(state['ids'][self.second.id], 0)
+        self.assertNotEqual(state['version'], state['flushed'])
+
+    def test_process_local_cache_is_refused(self):
+        with override_settings(CACHES=dict(settings.CACHES, carts={'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'})):
+            with self.assertRaises(ImproperlyConfigured):
+                cart_store.enabled
+
+    def test_checkout_writes_the_lines(self):
+        self.add(self.first, 2)
+        self.add(self.second, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/v1/orders/', {'cart_id': self.cart_id}, content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get(user=self.buyer)
+        self.assertEqual(sorted(order.items.values_list('product_id', 'quantity')), [(self.first.id, 2), (self.second.id, 1)])
+        self.assertEqual(order.total_price, 24)
+        self.assertFalse(Cart.objects.filter(pk=self.cart_id).exists())
+        self.assertIsNone(cart_store.cache.get(f'cart:{self.cart_id}'))
+
+    def test_empty_cart_is_rejected(self):
+        response = self.client.post('/api/v1/orders/', {'cart_id': self.cart_id}, content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 400)
+
+    def test_flush_carts_command(self):
+        self.add(self.first, 2)
+        second_id = self.add(self.second, 3).data['id']
+        self.client.delete(f'{self.items_url}{second_id}/', **self.auth)
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('flush_carts', stdout=out)
+        self.assertIn('1 carts flushed', out.getvalue())
+        self.assertEqual(list(CartItem.objects.values_list('product_id', 'quantity')), [(self.first.id, 2)])
+
+        # clean carts are skipped, and an evicted cart comes back from its rows
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('flush_carts', stdout=StringIO())
+        cart_store.cache.clear()
+        self.assertEqual(self.add(self.first, 1).data['quantity'], 3)
+
+
+class PricingTest(TestCase):
+    """ Cart, product and checkout prices come from the same rules, rounded half-up per line"""
+
+    def setUp(self):
+        cache.clear()
+        # the rolled back rules must not stay loaded in this process
+        self.addCleanup(pricing.bump_version)
+        self.buyer = User.objects.create_user(email='pricing@example.com')
+        self.taxed = Category.objects.create(name='Reduced')
+        plain = Category.objects.create(name='Plain')
+        with self.captureOnCommitCallbacks(execute=True):
+            PriceRule.objects.create(kind=PriceRule.TAX, category=self.taxed, rate='0.05')
+            self.discount = PriceRule.objects.create(kind=PriceRule.DISCOUNT, category=self.taxed, rate='0.10')
+        self.first = Product.objects.create(name='First', description='x', price='19.99', stock=10, category=self.taxed)
+        self.second = Product.objects.create(name='Second', description='x', price='0.05', stock=10, category=plain)
+        self.auth = {'HTTP_AUTHORIZATION': f'JWT {AccessToken.for_user(self.buyer)}'}
+        self.cart_id = self.client.post('/api/v1/carts/', **self.auth).data['id']
+        for product, quantity in [(self.first, 3), (self.second, 1)]:
+            self.client.post(f'/api/v1/carts/{self.cart_id}/items/', {'product_id': product.id, 'quantity': quantity}, **self.auth)
+
+    def cart(self):
+        return self.client.get(f'/api/v1/carts/{self.cart_id}/', **self.auth).data
+
+    def test_cart_and_checkout_agree(self):
+        cart = self.cart()
+        # 19.99 - 10% = 17.991 -> 17.99 a unit, 5% tax on 53.97 = 2.6985 -> 2.70, 10% default tax on 0.05 -> 0.01
+        self.assertEqual([item['total_price'] for item in cart['items']], [Decimal('53.97'), Decimal('0.05')])
+        self.assertEqual((cart['total_price'], cart['tax'], cart['total_with_tax']), (Decimal('54.02'), Decimal('2.71'), Decimal('56.73')))
+        product = self.client.get(f'/api/v1/products/{self.first.id}/').data
+        self.assertEqual(product['price_with_tax'], Decimal('18.89'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            OrderService.create_order(cart_id=self.cart_id, user_id=self.buyer.id)
+        order = Order.objects.get(user=self.buyer)
+        self.assertEqual(order.total_price, cart['total_price'])
+        self.assertEqual(order.items.get(product=self.first).price, Decimal('17.99'))
+
+    def test_rules_are_loaded_once(self):
+        pricing.get_rules()
+        with self.assertNumQueries(0):
+            pricing.get_rules()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.discount.is_active = False
+            self.discount.save()
+        self.assertEqual(self.cart()['total_price'], Decimal('60.02'))
@@ -1,19 +1,32 @@
+from django.core.exceptions import ValidationError
 from django.shortcuts import redirect
 from rest_framework.viewsets import GenericViewSet, ModelViewSet
-from order.serializers import CartSerializer, CartItemSerializer, AddCartItemSerializer, UpdateCartItemSerializer, OrderSerializer, CreateOrderSerializer, UpdateOrderSerializer, EmptySerializer
-from order.models import Cart, CartItem, Order, OrderItem
+from order.serializers import CartSerializer, CartItemSerializer, AddCartItemSerializer, UpdateCartItemSerializer, OrderSerializer, CreateOrderSerializer, UpdateOrderSerializer, EmptySerializer, CartItemInputSerializer
+from order.models import Cart, CartItem, Order
 from rest_framework.mixins import CreateModelMixin, RetrieveModelMixin, DestroyModelMixin
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from order.permissions import IsCartOwnerUser
 from rest_framework.decorators import action
-from order.services import OrderService
+from order.cache import purchase_cache
+from order.carts import cart_store
+from order.services import OrderService, CartService, PaymentEventService, OrderExportService, SalesRollupService
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.decorators import api_view
-from sslcommerz_lib import SSLCOMMERZ 
 from django.conf import settings as django_settings
-from decouple import config
 from rest_framework.views import APIView
+from rest_framework.exceptions import APIException
+from users.authentication import CachedJWTAuthentication
+from asgiref.sync import sync_to_async
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from api.renderers import NDJSONRenderer, CSVRenderer, ndjson_stream, csv_stream
+from datetime import datetime, time, timedelta
+from django.views.decorators.csrf import csrf_exempt
+from order.gateway import get_gateway, GatewayError, CircuitOpenError
+import json
+from product.paginations import OptionalKeysetPagination
 
 
 # not inherite ListModelMixins
@@ -24,6 +37,10 @@ class CartViewSets(CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, Gene
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    def perform_destroy(self, instance):
+        instance.delete()
+        cart_store.forget_on_commit(instance.pk)
+
     def create(self, request, *args, **kwargs):
         existing_cart = Cart.objects.filter(user=request.user).first()
         if existing_cart:
@@ -35,16 +52,95 @@ class CartViewSets(CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, Gene
         if getattr(self, 'swagger_fake_view', False):
             return Cart.objects.none()
 
+        if cart_store.enabled:
+            return Cart.objects.filter(user=self.request.user)
         return Cart.objects.prefetch_related('items__product').filter(user=self.request.user)
 
+    def get_serializer(self, *args, **kwargs):
+        # with the cache store the lines come from the cart entry, not CartItem
+        if cart_store.enabled and args and isinstance(args[0], Cart):
+            cart_store.attach(args[0])
+        return super().get_serializer(*args, **kwargs)
+
 class CartItemViewSets(ModelViewSet):
+    """
+    Lines of a cart. With CART_STORE = 'cache' they are read from and written to
+    the cart store, the responses and item ids stay the same.
+    """
     http_method_names = ['get', 'post', 'patch', 'delete']
     permission_classes = [IsCartOwnerUser]
 
     def get_queryset(self):
         return CartItem.objects.select_related('product').filter(cart_id=self.kwargs.get('cart_pk'))
 
+    def list(self, request, *args, **kwargs):
+        if not cart_store.enabled:
+            return super().list(request, *args, **kwargs)
+        return Response(self.get_serializer(cart_store.lines(self.kwargs.get('cart_pk')), many=True).data)
+
+    def get_object(self):
+        if not cart_store.enabled:
+            return super().get_object()
+        cart_id = self.kwargs.get('cart_pk')
+        state = cart_store.get(cart_id)
+        try:
+            product_id = state and cart_store.find(state, int(self.kwargs.get('pk')))
+        except ValueError:
+            raise Http404
+        if product_id is None:
+            raise Http404
+        item = cart_store.lines(cart_id, state, product_ids={product_id})[0]
+        if item.cart.user_id == self.request.user.pk:
+            # saves IsCartOwnerUser a query for the owner
+            item.cart.user = self.request.user
+        self.check_object_permissions(self.request, item)
+        return item
+
+    def check_cart_owner(self):
+        """ Adds only reach the owner's cart, there is no CartItem yet for has_object_permission"""
+        cart_id = self.kwargs.get('cart_pk')
+        try:
+            if cart_store.enabled:
+                state = cart_store.get(cart_id)
+                user_id = state and state['user']
+            else:
+                user_id = Cart.objects.filter(pk=cart_id).values_list('user_id', flat=True).first()
+        except (ValueError, ValidationError):
+            raise Http404
+        if user_id is None:
+            raise Http404
+        if user_id != self.request.user.pk:
+            self.permission_denied(self.request)
+
+    def perform_create(self, serializer):
+        self.check_cart_owner()
+        serializer.save()
+
+    def perform_update(self, serializer):
+        if not cart_store.enabled:
+            return super().perform_update(serializer)
+        item = serializer.instance
+        item.quantity = serializer.validated_data.get('quantity', item.quantity)
+        cart_store.set_quantity(item.cart_id, item.product_id, item.quantity)
+
+    def perform_destroy(self, instance):
+        if not cart_store.enabled:
+            return super().perform_destroy(instance)
+        cart_store.remove(instance.cart_id, instance.product_id)
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request, cart_pk=None):
+        """ Add a list of {product_id, quantity} to the cart in one statement"""
+        serializer = CartItemInputSerializer(data=request.data, many=True, allow_empty=False)
+        serializer.is_valid(raise_exception=True)
+        self.check_cart_owner()
+        items = [(item['product_id'], item['quantity']) for item in serializer.validated_data]
+        cart_items = CartService.add_items(cart_pk, items)
+        return Response(AddCartItemSerializer(cart_items, many=True).data, status=status.HTTP_201_CREATED)
+
     def get_serializer_class(self):
+        if self.action == 'batch':
+            return CartItemInputSerializer
         if self.request.method == 'POST':
             return AddCartItemSerializer
         elif self.request.method == 'PATCH':
@@ -57,6 +153,8 @@ class CartItemViewSets(ModelViewSet):
 
 class OrderViewSets(ModelViewSet):
     http_method_names = ['get', 'post', 'delete', 'patch', 'head', 'options']
+    pagination_class = OptionalKeysetPagination
+    export_chunk_size = 500
 
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
@@ -64,6 +162,30 @@ class OrderViewSets(ModelViewSet):
         OrderService.cancel_order(order=order, user=request.user)
         return Response({'status': 'Order canceled'})
 
+    @action(detail=False, methods=['get'], renderer_classes=[NDJSONRenderer, CSVRenderer], filter_backends=[], pagination_class=None)
+    def export(self, request):
+        """ Stream every order (changed since ?since=) as ?format=ndjson or csv, only for admin"""
+        since = request.query_params.get('since')
+        if since:
+            try:
+                # well-formed but impossible values (2024-13-01) raise instead of returning None
+                since = parse_datetime(since) or (parse_date(since) and datetime.combine(parse_date(since), time.min))
+            except ValueError:
+                since = None
+            if not since:
+                return Response({'since': 'Use an ISO date or datetime.'}, status=status.HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+
+        orders = OrderExportService.iter_orders(since=since, chunk_size=self.export_chunk_size)
+        if request.accepted_renderer.format == 'csv':
+            stream = csv_stream(OrderExportService.CSV_HEADER, OrderExportService.csv_rows(orders))
+        else:
+            stream = ndjson_stream(OrderSerializer(order).data for order in orders)
+        response = StreamingHttpResponse(stream, content_type=request.accepted_renderer.media_type)
+        response['Content-Disposition'] = f'attachment; filename="orders.{request.accepted_renderer.format}"'
+        return response
+
     def get_serializer_class(self):
         if self.action == 'cancel':
             return EmptySerializer
@@ -74,7 +196,7 @@ class OrderViewSets(ModelViewSet):
         return OrderSerializer
     
     def get_permissions(self):
-        if self.action in ['partial_update', 'destroy']:
+        if self.action in ['partial_update', 'destroy', 'export']:
             return [IsAdminUser(),]
         return [IsAuthenticated()]
 
@@ -83,8 +205,8 @@ class OrderViewSets(ModelViewSet):
             return Order.objects.none()
 
         if self.request.user.is_staff:
-            return Order.objects.prefetch_related('items__product').all()
-        return Order.objects.prefetch_related('items__product').filter(user=self.request.user)
+            return Order.objects.prefetch_related('items__product').order_by('-created_at')
+        return Order.objects.prefetch_related('items__product').filter(user=self.request.user).order_by('-created_at')
     
     def get_serializer_context(self):
         return {'user_id':self.request.user.id, 'user':self.request.user}
@@ -92,16 +214,7 @@ class OrderViewSets(ModelViewSet):
     
     
 # payment gateway
-@api_view(['POST'])
-def initiate_payment(request):
-    user = request.user
-    amount = request.data.get('amount')
-    order_id = request.data.get('order_id')
-    num_itmes = request.data.get('num_items')
-    
-    settings = { 'store_id': {config('STORE_NAME')}, 'store_pass': {config('STORE_PASSWORD')}, 'issandbox': True }
-    
-    sslcz = SSLCOMMERZ(settings)
+def payment_post_body(user, amount, order_id, num_items):
     post_body = {}
     post_body['total_amount'] = amount
     post_body['currency'] = "BDT"
@@ -118,26 +231,80 @@ def initiate_payment(request):
     post_body['cus_country'] = "Bangladesh"
     post_body['shipping_method'] = "NO"
     post_body['multi_card_name'] = ""
-    post_body['num_of_item'] = num_itmes
+    post_body['num_of_item'] = num_items
     post_body['product_name'] = "E-comarce Product"
     post_body['product_category'] = "General"
     post_body['product_profile'] = "general"
+    return post_body
 
 
-    response = sslcz.createSession(post_body) # API response
-    
+def payment_result(response):
     # Need to redirect user to response['GatewayPageURL']
     if response.get('status') == 'SUCCESS':
-        return Response({'payment_url': response['GatewayPageURL']})
-    return Response({'error': 'Payment initiation failed!'}, status=status.HTTP_400_BAD_REQUEST)
+        return {'payment_url': response['GatewayPageURL']}, status.HTTP_200_OK
+    return {'error': 'Payment initiation failed!'}, status.HTTP_400_BAD_REQUEST
+
+
+@api_view(['POST'])
+def initiate_payment(request):
+    user = request.user
+    amount = request.data.get('amount')
+    order_id = request.data.get('order_id')
+    num_itmes = request.data.get('num_items')
+
+    try:
+        response = get_gateway().create_session(payment_post_body(user, amount, order_id, num_itmes)) # API response
+    except CircuitOpenError as e:
+        return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    except GatewayError:
+        return Response({'error': 'Payment initiation failed!'}, status=status.HTTP_400_BAD_REQUEST)
+
+    data, status_code = payment_result(response)
+    return Response(data, status=status_code)
+
+
+@csrf_exempt
+async def initiate_payment_async(request):
+    """
+    ASGI version of initiate_payment, the gateway is called with the pooled httpx
+    async client, so a waiting request holds neither the event loop nor a thread.
+    Same JWT auth, request body and responses as the sync endpoint.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    try:
+        auth = await sync_to_async(CachedJWTAuthentication().authenticate)(request)
+    except APIException as e:
+        return JsonResponse({'detail': str(e.detail)}, status=e.status_code)
+    if auth is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=status.HTTP_401_UNAUTHORIZED)
+    user = auth[0]
+
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({'detail': 'JSON parse error.'}, status=status.HTTP_400_BAD_REQUEST)
+    else:
+        data = request.POST
+
+    post_body = payment_post_body(user, data.get('amount'), data.get('order_id'), data.get('num_items'))
+    try:
+        response = await get_gateway().acreate_session(post_body)
+    except CircuitOpenError as e:
+        return JsonResponse({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    except GatewayError:
+        return JsonResponse({'error': 'Payment initiation failed!'}, status=status.HTTP_400_BAD_REQUEST)
+
+    data, status_code = payment_result(response)
+    return JsonResponse(data, status=status_code)
 
 
 @api_view(['POST'])
 def success_payment(request):
-    order_id = request.data.get('tran_id').split('_')[1]
-    order = Order.objects.get(id=order_id)
-    order.status = 'R'
-    order.save()
+    # acknowledge right away, process_payment_events applies it to the order
+    payload = request.data.dict() if hasattr(request.data, 'dict') else dict(request.data)
+    PaymentEventService.record(payload)
     return redirect(f"{django_settings.FRONT_END_HOST}dashboard/orders/")
 
 @api_view(['POST'])
@@ -153,5 +320,51 @@ class HasOrderedProduct(APIView):
     permission_classes = [IsAuthenticated]
     
     def get(self, request, product_id):
-        has_ordered = OrderItem.objects.filter(order__user = request.user, product_id = product_id).exists()
-        return Response({'hasOrdered':has_ordered})
+        purchased, _ = purchase_cache.get(request.user.id)
+        return Response({'hasOrdered': product_id in purchased})
+
+
+class HasOrderedProducts(APIView):
+    """ ?product_ids=1,2,3 -> {"1": {"hasOrdered": true, "hasReviewed": false}, ...}"""
+    permission_classes = [IsAuthenticated]
+    max_ids = 100
+
+    def get(self, request):
+        try:
+            product_ids = [int(value) for value in request.query_params.get('product_ids', '').split(',') if value.strip()]
+        except ValueError:
+            return Response({'product_ids': 'Use comma separated product ids.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(product_ids) > self.max_ids:
+            return Response({'product_ids': f'At most {self.max_ids} ids per request.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        purchased, reviewed = purchase_cache.get(request.user.id)
+        return Response({
+            str(product_id): {'hasOrdered': product_id in purchased, 'hasReviewed': product_id in reviewed}
+            for product_id in product_ids
+        })
+
+
+class SalesReportView(APIView):
+    """ Sales per day, status, product or category between ?start= and ?end= (last 30 days by default)"""
+    permission_classes = [IsAdminUser]
+    group_by_choices = ['day', 'status', 'product', 'category']
+
+    def get(self, request):
+        try:
+            end = parse_date(request.query_params.get('end') or timezone.localdate().isoformat())
+            start = parse_date(request.query_params.get('start') or (end - timedelta(days=29)).isoformat())
+        except (TypeError, ValueError):
+            start = end = None
+        group_by = request.query_params.get('group_by', 'day')
+
+        if not start or not end or start > end:
+            return Response({'detail': 'Use ISO dates with start <= end.'}, status=status.HTTP_400_BAD_REQUEST)
+        if group_by not in self.group_by_choices:
+            return Response({'group_by': f"Choose one of {', '.join(self.group_by_choices)}."}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'start': start,
+            'end': end,
+            'group_by': group_by,
+            'results': SalesRollupService.report(start, end, group_by),
+        })
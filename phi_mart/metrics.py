@@ -0,0 +1,112 @@
+import threading
+from bisect import bisect_left
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    return ','.join(f'{name}="{escape(value)}"' for name, value in labels)
+
+
+class Histogram:
+    """ Cumulative bucket counts plus sum, the layout Prometheus expects"""
+
+    __slots__ = ['bounds', 'counts', 'sum']
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{format_labels(labels + [("le", bound)])}}} {cumulative}'
+        cumulative += self.counts[-1]
+        yield f'{name}_bucket{{{format_labels(labels + [("le", "+Inf")])}}} {cumulative}'
+        yield f'{name}_sum{{{format_labels(labels)}}} {self.sum}'
+        yield f'{name}_count{{{format_labels(labels)}}} {cumulative}'
+
+
+class RouteMetrics:
+    __slots__ = ['responses', 'latency', 'queries', 'sql_seconds', 'response_bytes']
+
+    def __init__(self, registry):
+        self.responses = {}
+        self.latency = Histogram(registry.latency_buckets)
+        self.queries = Histogram(registry.query_buckets)
+        self.sql_seconds = 0.0
+        self.response_bytes = 0
+
+
+class MetricsRegistry:
+    """
+    Per-process request metrics keyed by route name.
+    - Recording a request is a few additions under a lock, the text format is
+      only built when someone scrapes
+    - Memory is bounded: fixed buckets per route and at most `max_routes` routes,
+      anything beyond is folded into the "other" route
+    """
+
+    latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    query_buckets = (0, 1, 2, 5, 10, 20, 50, 100)
+    max_routes = 200
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def record(self, route, method, status_code, seconds, queries, sql_seconds, response_bytes):
+        with self._lock:
+            metrics = self._routes.get(route)
+            if metrics is None:
+                if len(self._routes) >= self.max_routes:
+                    route = 'other'
+                metrics = self._routes.setdefault(route, RouteMetrics(self))
+            key = (method, status_code)
+            metrics.responses[key] = metrics.responses.get(key, 0) + 1
+            metrics.latency.observe(seconds)
+            metrics.queries.observe(queries)
+            metrics.sql_seconds += sql_seconds
+            metrics.response_bytes += response_bytes
+
+    def reset(self):
+        with self._lock:
+            self._routes = {}
+
+    def render(self):
+        """ Prometheus text exposition format"""
+        with self._lock:
+            routes = sorted(self._routes.items())
+            lines = ['# HELP phimart_requests_total Responses by route, method and status code.', '# TYPE phimart_requests_total counter']
+            for route, metrics in routes:
+                for (method, status_code), count in sorted(metrics.responses.items()):
+                    labels = format_labels([('route', route), ('method', method), ('status', status_code)])
+                    lines.append(f'phimart_requests_total{{{labels}}} {count}')
+
+            lines += ['# HELP phimart_request_duration_seconds Time spent in the view stack.', '# TYPE phimart_request_duration_seconds histogram']
+            for route, metrics in routes:
+                lines.extend(metrics.latency.lines('phimart_request_duration_seconds', [('route', route)]))
+
+            lines += ['# HELP phimart_request_queries SQL queries per request.', '# TYPE phimart_request_queries histogram']
+            for route, metrics in routes:
+                lines.extend(metrics.queries.lines('phimart_request_queries', [('route', route)]))
+
+            for name, attr, help_text in [
+                ('phimart_sql_seconds_total', 'sql_seconds', 'Time spent executing SQL.'),
+                ('phimart_response_bytes_total', 'response_bytes', 'Bytes of non-streaming response bodies.'),
+            ]:
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+                for route, metrics in routes:
+                    lines.append(f'{name}{{{format_labels([("route", route)])}}} {round(getattr(metrics, attr), 6)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
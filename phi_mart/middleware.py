@@ -0,0 +1,170 @@
+import hashlib
+import time
+from contextlib import ExitStack
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from api.invalidation import invalidation_bus, is_process_local
+from phi_mart.metrics import registry
+from phi_mart.routers import reset_replica, use_replica
+
+
+class QueryTimer:
+    """ execute_wrapper counting queries and the time spent in them"""
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.seconds += time.perf_counter() - start
+
+
+class AsyncCapableMiddleware:
+    """
+    Base for middlewares serving both WSGI and ASGI: Django hands over a
+    coroutine get_response under ASGI, __call__ then returns __acall__'s coroutine.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.handle(request)
+
+    def handle(self, request):
+        raise NotImplementedError
+
+    async def __acall__(self, request):
+        raise NotImplementedError
+
+
+class MetricsMiddleware(AsyncCapableMiddleware):
+    """ Record latency, SQL and response size of every request under its route name"""
+
+    @staticmethod
+    def wrap_connections(stack, timer):
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(timer))
+
+    def handle(self, request):
+        timer = QueryTimer()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            self.wrap_connections(stack, timer)
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - start, timer)
+        return response
+
+    async def __acall__(self, request):
+        timer = QueryTimer()
+        start = time.perf_counter()
+        stack = ExitStack()
+        # connections are per thread: wrap the ones of the thread running this request's ORM calls
+        await sync_to_async(self.wrap_connections)(stack, timer)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        self.record(request, response, time.perf_counter() - start, timer)
+        return response
+
+    @staticmethod
+    def record(request, response, elapsed, timer):
+        match = request.resolver_match
+        route = (match.view_name or match.url_name or 'unnamed') if match else 'unmatched'
+        size = 0 if response.streaming else len(response.content)
+        registry.record(route, request.method, response.status_code, elapsed, timer.queries, timer.seconds, size)
+
+
+class InvalidationMiddleware(AsyncCapableMiddleware):
+    """ Apply the cache invalidations other processes published before serving a request"""
+
+    def handle(self, request):
+        invalidation_bus.poll_if_due()
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        await sync_to_async(invalidation_bus.poll_if_due)()
+        return await self.get_response(request)
+
+
+class ReplicaMiddleware(AsyncCapableMiddleware):
+    """
+    Let safe-method requests read from the replicas (phi_mart.routers).
+    After a user sends a write, their reads stay on the primary for
+    REPLICA_STICKY_SECONDS, so they see their own changes while the replicas
+    catch up. Users are told apart by the JWT user id, or the session cookie.
+    The flag lives in the default cache, which every worker has to share.
+    """
+
+    safe_methods = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.jwt = JWTAuthentication()
+        if settings.DATABASE_REPLICAS and is_process_local(caches[DEFAULT_CACHE_ALIAS]):
+            # another worker would not know the user just wrote and read a lagging replica
+            raise ImproperlyConfigured('DATABASE_REPLICAS needs a shared CACHE_BACKEND to keep writers on the primary')
+
+    def sticky_key(self, request):
+        header = self.jwt.get_header(request)
+        raw_token = self.jwt.get_raw_token(header) if header else None
+        if raw_token is not None:
+            try:
+                # signature and expiry only, the user itself is looked up by the authentication class
+                return f'replica:sticky:user:{self.jwt.get_validated_token(raw_token)[jwt_settings.USER_ID_CLAIM]}'
+            except (InvalidToken, KeyError):
+                return None
+        session = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        if session:
+            return f'replica:sticky:session:{hashlib.md5(session.encode()).hexdigest()}'
+        return None
+
+    def handle(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+
+        key = self.sticky_key(request)
+        safe = request.method in self.safe_methods
+        token = use_replica(safe and not (key and cache.get(key)))
+        try:
+            response = self.get_response(request)
+        finally:
+            reset_replica(token)
+        if not safe and key:
+            cache.set(key, True, timeout=settings.REPLICA_STICKY_SECONDS)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return await self.get_response(request)
+
+        key = self.sticky_key(request)
+        safe = request.method in self.safe_methods
+        token = use_replica(safe and not (key and await cache.aget(key)))
+        try:
+            response = await self.get_response(request)
+        finally:
+            reset_replica(token)
+        if not safe and key:
+            await cache.aset(key, True, timeout=settings.REPLICA_STICKY_SECONDS)
+        return response
@@ -0,0 +1,60 @@
+from functools import lru_cache
+from pathlib import Path
+from django.conf import settings
+from django.http import HttpResponse
+
+
+@lru_cache(maxsize=None)
+def get_schema_view(url=None):
+    """
+    drf_yasg's schema view, built on the first documentation request instead of at startup.
+    The document names the host of url, of the request without it, and no host with url=''.
+    """
+    from drf_yasg import openapi
+    from drf_yasg.views import get_schema_view as yasg_schema_view
+    from rest_framework import permissions
+
+    return yasg_schema_view(
+       openapi.Info(
+          title="PhiMart E-Comarce API",
+          default_version='v1',
+          description="Phimart e-comarce project api documentation",
+          terms_of_service="https://www.google.com/policies/terms/",
+          contact=openapi.Contact(email="phimart@example.com"),
+          license=openapi.License(name="BSD License"),
+       ),
+       url=url,
+       public=True,
+       permission_classes=(permissions.AllowAny,),
+    )
+
+
+@lru_cache(maxsize=None)
+def ui_view(renderer, url=None):
+    return get_schema_view(url).with_ui(renderer, cache_timeout=0)
+
+
+@lru_cache(maxsize=None)
+def prebuilt_schema(path):
+    """ The document written by `manage.py build_openapi`, None when it wasn't built"""
+    path = Path(path)
+    return path.read_bytes() if path.is_file() else None
+
+
+def documentation_view(renderer):
+    """
+    Swagger/ReDoc page. The document they load (?format=openapi) comes from
+    settings.OPENAPI_SCHEMA_PATH when it was built, the schema is only generated
+    here without it.
+    """
+    def view(request, *args, **kwargs):
+        if request.GET.get('format') == 'openapi':
+            schema = prebuilt_schema(settings.OPENAPI_SCHEMA_PATH)
+            if schema is not None:
+                return HttpResponse(schema, content_type='application/openapi+json; charset=utf-8')
+        return ui_view(renderer)(request, *args, **kwargs)
+    return view
+
+
+swagger_view = documentation_view('swagger')
+redoc_view = documentation_view('redoc')
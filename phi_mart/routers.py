@@ -0,0 +1,48 @@
+import random
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# switched on per request by ReplicaMiddleware, commands, workers and the shell always read the primary
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+def use_replica(enabled):
+    """ Allow or forbid replica reads in the current context, returns a token for reset_replica()"""
+    return _replica_reads.set(enabled)
+
+
+def reset_replica(token):
+    _replica_reads.reset(token)
+
+
+def reads_from_replica():
+    return _replica_reads.get() and bool(settings.DATABASE_REPLICAS)
+
+
+class ReplicaRouter:
+    """
+    Primary/replica routing for settings.DATABASE_REPLICAS.
+    - Reads go to a random replica, but only where ReplicaMiddleware allowed it
+    - Reads inside transaction.atomic, and every read after the first write of a
+      request, go to the primary, so a request always sees its own writes
+    - Writes and migrations only ever touch the primary
+    """
+
+    def db_for_read(self, model, **hints):
+        if not reads_from_replica():
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        _replica_reads.set(False)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -1,7 +1,8 @@
+import tempfile
+from decimal import Decimal
 from pathlib import Path
 from datetime import timedelta
-from decouple import config
-import cloudinary
+from decouple import config, Csv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -14,7 +15,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = 'django-insecure-=z+r))-e%ep)a!r0k6iqoe_jqhoa=^(u*3ao5avy@jy92=5#xz'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = False
+DEBUG = config('DEBUG', default=False, cast=bool)
 
 ALLOWED_HOSTS = ['.vercel.app', '127.0.0.1']
 # ALLOWED_HOSTS = ['*']
@@ -38,13 +39,14 @@ INSTALLED_APPS = [
     'users',
     'product',
     'order',
-    'debug_toolbar',
     'django_filters',
 ]
 
 MIDDLEWARE = [
+    'phi_mart.middleware.MetricsMiddleware',
+    'phi_mart.middleware.InvalidationMiddleware',
+    'phi_mart.middleware.ReplicaMiddleware',
     "corsheaders.middleware.CorsMiddleware",
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
     'django.middleware.security.SecurityMiddleware',
     "whitenoise.middleware.WhiteNoiseMiddleware",
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -74,6 +76,11 @@ TEMPLATES = [
 ]
 
 
+# the toolbar is a good part of a cold start, production never loads it
+if DEBUG:
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.insert(MIDDLEWARE.index("corsheaders.middleware.CorsMiddleware") + 1, "debug_toolbar.middleware.DebugToolbarMiddleware")
+
 INTERNAL_IPS = [
     # ...
     "127.0.0.1",
@@ -115,6 +122,61 @@ DATABASES = {
     }
 }
 
+# Read replicas: hosts sharing the primary's credentials, safe-method requests
+# read from them (phi_mart/routers.py). In tests they mirror the primary.
+# They need a shared CACHE_BACKEND, it tells every worker who wrote recently.
+for index, replica_host in enumerate(config('DATABASE_REPLICA_HOSTS', default='', cast=Csv())):
+    DATABASES[f'replica_{index}'] = dict(DATABASES['default'], HOST=replica_host, TEST={'MIRROR': 'default'})
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['phi_mart.routers.ReplicaRouter']
+
+# seconds a user's reads stay on the primary after they wrote something
+REPLICA_STICKY_SECONDS = config('REPLICA_STICKY_SECONDS', default=10, cast=int)
+
+
+# Cache
+# Local-memory by default, point CACHE_BACKEND/CACHE_LOCATION to a shared
+# backend (e.g. django.core.cache.backends.redis.RedisCache) when running many workers
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='phimart'),
+    }
+}
+
+CATALOG_CACHE_ALIAS = 'default'
+CATALOG_CACHE_TIMEOUT = config('CATALOG_CACHE_TIMEOUT', default=300, cast=int)
+
+# Cache invalidations reach the other processes through this transport (api/invalidation.py).
+# DatabaseTransport reaches every worker, each polls it every INVALIDATION_POLL_INTERVAL seconds;
+# run `manage.py prune_invalidation_events` periodically. api.invalidation.MemoryTransport
+# stays inside one process, only use it with a single worker
+INVALIDATION_TRANSPORT = config('INVALIDATION_TRANSPORT', default='api.invalidation.DatabaseTransport')
+INVALIDATION_POLL_INTERVAL = config('INVALIDATION_POLL_INTERVAL', default=1.0, cast=float)
+
+# 'database' (CartItem rows) or 'cache': working carts live in CART_CACHE_ALIAS and are
+# written to CartItem at checkout or by `manage.py flush_carts` (run it periodically).
+# The cart cache has to be shared by every worker and must not evict carts: point
+# CART_CACHE_BACKEND to a redis/memcached server without eviction, or to
+# django.core.cache.backends.db.DatabaseCache (`manage.py createcachetable`)
+CART_STORE = config('CART_STORE', default='database')
+CART_CACHE_ALIAS = 'carts'
+CACHES[CART_CACHE_ALIAS] = {
+    'BACKEND': config('CART_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+    'LOCATION': config('CART_CACHE_LOCATION', default='phimart_carts'),
+    'TIMEOUT': None,
+}
+if not CACHES[CART_CACHE_ALIAS]['BACKEND'].startswith(('django.core.cache.backends.redis', 'django.core.cache.backends.memcached')):
+    # the local-memory, file and database backends cull past MAX_ENTRIES (300 by default)
+    CACHES[CART_CACHE_ALIAS]['OPTIONS'] = {'MAX_ENTRIES': config('CART_CACHE_MAX_ENTRIES', default=1000000, cast=int)}
+
+# PostgreSQL text search configuration used for the product search index
+PRODUCT_SEARCH_CONFIG = config('PRODUCT_SEARCH_CONFIG', default='english')
+
+# tax rate of categories without a PriceRule, product.pricing applies the rules
+PRICING_DEFAULT_TAX_RATE = config('PRICING_DEFAULT_TAX_RATE', default='0.10', cast=Decimal)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -148,16 +210,28 @@ USE_TZ = True
 
 
 # Configarations for Cloudnary media file
-cloudinary.config( 
-    cloud_name = config('cloud_name'), 
-    api_key = config('cloudinary_api_key'), 
-    api_secret = config('api_secret'), # Click 'View API Keys' above to copy your API secret
-    secure=True
-)
-
+# cloudinary is configured from CLOUDINARY_STORAGE on first use (product.images), not at startup
 # media storage settings
 DEFAULT_FILE_STORAGE = 'couldinary_storage.storage.MediaCloudinaryStorage'
 
+CLOUDINARY_STORAGE = {
+    'CLOUD_NAME': config('cloud_name'),
+    'API_KEY': config('cloudinary_api_key'),
+    'API_SECRET': config('api_secret'),
+}
+
+# Product images: uploads are streamed to the staging directory (cut off past
+# the max size) and a worker pool pushes the processed files to the storage.
+# PRODUCT_IMAGE_WORKERS=0 processes them inside the request instead.
+PRODUCT_IMAGE_STORAGE = config('PRODUCT_IMAGE_STORAGE', default='cloudinary_storage.storage.MediaCloudinaryStorage')
+PRODUCT_IMAGE_STAGING_DIR = config('PRODUCT_IMAGE_STAGING_DIR', default=str(Path(tempfile.gettempdir()) / 'phimart-images'))
+# 50 KB as validate_file_size always allowed, raise it with PRODUCT_IMAGE_MAX_UPLOAD_SIZE (bytes)
+PRODUCT_IMAGE_MAX_UPLOAD_SIZE = config('PRODUCT_IMAGE_MAX_UPLOAD_SIZE', default=50 * 1024, cast=int)
+PRODUCT_IMAGE_WORKERS = config('PRODUCT_IMAGE_WORKERS', default=2, cast=int)
+# the pool dies with its process: run process_product_images periodically, it retries
+# uploads still pending this many seconds after staging
+PRODUCT_IMAGE_STALE_AFTER = config('PRODUCT_IMAGE_STALE_AFTER', default=300, cast=int)
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/5.1/howto/static-files/
 
@@ -182,9 +256,20 @@ REST_FRAMEWORK = {
     # 'PAGE_SIZE':10, # declare this one another page to ignore terminal error
 
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
     ),
 
+    # orjson backed, same output as the stdlib JSONRenderer/JSONParser
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+
     # 'DEFAULT_PERMISSION_CLASSES': [
     #     'rest_framework.permissions.IsAuthenticated',
     # ]
@@ -195,6 +280,11 @@ SIMPLE_JWT = {
    "ACCESS_TOKEN_LIFETIME": timedelta(days=1),
 }
 
+# seconds a resolved user is served from the cache, saves invalidate it right away.
+# Needs a shared CACHE_BACKEND: with the local-memory default other workers would not
+# see a deactivation or password change, so every request loads the user from the database
+AUTH_USER_CACHE_TIMEOUT = config('AUTH_USER_CACHE_TIMEOUT', default=60, cast=int)
+
 DJOSER = {
     'EMAIL_FRONTEND_PROTOCOL': config('EMAIL_FRONTEND_PROTOCOL'),
     'EMAIL_FRONTEND_DOMAIN': config('EMAIL_FRONTEND_DOMAIN'),
@@ -208,6 +298,9 @@ DJOSER = {
     }
 }
 
+# written by `manage.py build_openapi` and committed, /swagger/?format=openapi serves it as is
+OPENAPI_SCHEMA_PATH = config('OPENAPI_SCHEMA_PATH', default=str(BASE_DIR / 'phi_mart' / 'openapi.json'))
+
 SWAGGER_SETTINGS = {
    'SECURITY_DEFINITIONS': {
       'Bearer': {
@@ -230,4 +323,17 @@ EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD')
 
 # for ssl
 FRONT_END_HOST = config('FRONT_END_HOST')
-BACK_END_HOST = config('BACK_END_HOST')
\ No newline at end of file
+BACK_END_HOST = config('BACK_END_HOST')
+
+# read once per process, BASE_URL overrides the sandbox/live host (e.g. a local stub gateway)
+SSLCOMMERZ = {
+    'STORE_ID': config('STORE_NAME', default=''),
+    'STORE_PASSWORD': config('STORE_PASSWORD', default=''),
+    'SANDBOX': config('SSLCOMMERZ_SANDBOX', default=True, cast=bool),
+    'BASE_URL': config('SSLCOMMERZ_BASE_URL', default=''),
+    'CONNECT_TIMEOUT': config('SSLCOMMERZ_CONNECT_TIMEOUT', default=3.0, cast=float),
+    'READ_TIMEOUT': config('SSLCOMMERZ_READ_TIMEOUT', default=10.0, cast=float),
+    'POOL_SIZE': 10,
+    'FAILURE_THRESHOLD': 5,
+    'RESET_TIMEOUT': 30,
+}
\ No newline at end of file
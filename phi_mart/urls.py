@@ -1,34 +1,24 @@
 from django.contrib import admin
 from django.urls import path, include
-from debug_toolbar.toolbar import debug_toolbar_urls
-from .views import api_root_view
+from .views import api_root_view, MetricsView
+from .openapi import swagger_view, redoc_view
 from django.conf import settings
 from django.conf.urls.static import static
-from rest_framework import permissions
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
-
-schema_view = get_schema_view(
-   openapi.Info(
-      title="PhiMart E-Comarce API",
-      default_version='v1',
-      description="Phimart e-comarce project api documentation",
-      terms_of_service="https://www.google.com/policies/terms/",
-      contact=openapi.Contact(email="phimart@example.com"),
-      license=openapi.License(name="BSD License"),
-   ),
-   public=True,
-   permission_classes=(permissions.AllowAny,),
-)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', api_root_view),
     path('api-auth/', include('rest_framework.urls')),
     path('api/v1/', include('api.urls'), name='api-root'),
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
+    # drf_yasg is imported on the first hit, not at startup
+    path('swagger/', swagger_view, name='schema-swagger-ui'),
+    path('redoc/', redoc_view, name='schema-redoc'),
     
-] + debug_toolbar_urls()
+]
+
+if 'debug_toolbar' in settings.INSTALLED_APPS:
+    from debug_toolbar.toolbar import debug_toolbar_urls
+    urlpatterns += debug_toolbar_urls()
 
 urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
@@ -1,4 +1,16 @@
+from django.http import HttpResponse
 from django.shortcuts import redirect
+from rest_framework.permissions import IsAdminUser
+from rest_framework.views import APIView
+from phi_mart.metrics import registry
 
 def api_root_view(request):
-    return redirect('api-root')
\ No newline at end of file
+    return redirect('api-root')
+
+
+class MetricsView(APIView):
+    """ Request metrics of this process in Prometheus text format, only for admin"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,8 +1,8 @@
 from django.contrib import admin
-from product.models import Product, Category, Review
+from product.models import Product, Category, Review, PriceRule
 # Register your models here.
 
 admin.site.register(Product)
 admin.site.register(Category)
 admin.site.register(Review)
-
+admin.site.register(PriceRule)
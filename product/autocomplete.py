@@ -0,0 +1,148 @@
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count
+from product.models import Product, Category
+
+
+def normalize(text):
+    return ' '.join(text.lower().split())
+
+
+class PrefixIndex:
+    """
+    In-process sorted array of (term, kind, id) for prefix lookups.
+    - Every word of a name starts a term, so "phone" finds "Smart Phone"
+    - Loaded lazily on the first lookup, kept up to date by the invalidation bus
+    - A rebuild anywhere bumps a version in the shared cache, other processes
+      notice it within `check_interval` seconds and reload themselves
+    """
+
+    VERSION_KEY = 'autocomplete:version'
+    check_interval = 5
+    memo_size = 1024
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._keys = []
+        self._docs = {}
+        self._memo = {}
+        self._loaded = False
+        self._version = None
+        self._checked_at = 0
+
+    @property
+    def cache(self):
+        return caches[settings.CATALOG_CACHE_ALIAS]
+
+    def _terms(self, label):
+        words = normalize(label).split(' ')
+        return {' '.join(words[i:]) for i in range(len(words)) if words[i]}
+
+    def _add(self, kind, pk, label, popularity):
+        terms = self._terms(label)
+        self._docs[(kind, pk)] = {'type': kind, 'id': pk, 'name': label, 'popularity': popularity, 'terms': terms}
+        for term in terms:
+            insort(self._keys, (term, kind, pk))
+
+    def _remove(self, kind, pk):
+        doc = self._docs.pop((kind, pk), None)
+        if doc is None:
+            return None
+        for term in doc['terms']:
+            position = bisect_left(self._keys, (term, kind, pk))
+            if position < len(self._keys) and self._keys[position] == (term, kind, pk):
+                del self._keys[position]
+        return doc
+
+    def rebuild(self):
+        products = Product.objects.annotate(popularity=Count('orderitem')).values_list('id', 'name', 'popularity')
+        categories = Category.objects.annotate(popularity=Count('products')).values_list('id', 'name', 'popularity')
+        docs = {}
+        keys = []
+        for kind, rows in [('product', products), ('category', categories)]:
+            for pk, label, popularity in rows.iterator():
+                terms = self._terms(label)
+                docs[(kind, pk)] = {'type': kind, 'id': pk, 'name': label, 'popularity': popularity, 'terms': terms}
+                keys.extend((term, kind, pk) for term in terms)
+        keys.sort()
+        with self._lock:
+            self._keys, self._docs, self._memo = keys, docs, {}
+            self._loaded = True
+            self._version = self.cache.get(self.VERSION_KEY)
+            self._checked_at = time.monotonic()
+        return len(docs)
+
+    def publish_rebuild(self):
+        """ Rebuild here and tell the other processes to do the same"""
+        self.cache.set(self.VERSION_KEY, time.time_ns(), timeout=None)
+        return self.rebuild()
+
+    def ensure_loaded(self):
+        if self._loaded and time.monotonic() - self._checked_at > self.check_interval:
+            self._checked_at = time.monotonic()
+            if self.cache.get(self.VERSION_KEY) != self._version:
+                self._loaded = False
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.rebuild()
+
+    def upsert(self, kind, pk, label):
+        if not self._loaded:
+            return
+        with self._lock:
+            previous = self._remove(kind, pk)
+            self._add(kind, pk, label, previous['popularity'] if previous else 0)
+            self._memo = {}
+
+    def refresh(self, kind, pk):
+        """ Re-read the name of one product or category, it is dropped when the row is gone"""
+        if not self._loaded:
+            return
+        model = Product if kind == 'product' else Category
+        label = model.objects.filter(pk=pk).values_list('name', flat=True).first()
+        if label is None:
+            self.remove(kind, pk)
+        else:
+            self.upsert(kind, pk, label)
+
+    def remove(self, kind, pk):
+        if not self._loaded:
+            return
+        with self._lock:
+            self._remove(kind, pk)
+            self._memo = {}
+
+    def search(self, query, limit=10):
+        self.ensure_loaded()
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        memo_key = (prefix, limit)
+        results = self._memo.get(memo_key)
+        if results is not None:
+            return results
+
+        with self._lock:
+            keys, docs = self._keys, self._docs
+            matches = set()
+            position = bisect_left(keys, (prefix,))
+            while position < len(keys) and keys[position][0].startswith(prefix):
+                matches.add(keys[position][1:])
+                position += 1
+            ranked = heapq.nlargest(limit, matches, key=lambda key: (docs[key]['popularity'], -len(docs[key]['name'])))
+            results = [
+                {'type': docs[key]['type'], 'id': docs[key]['id'], 'name': docs[key]['name']}
+                for key in ranked
+            ]
+            if len(self._memo) >= self.memo_size:
+                self._memo = {}
+            self._memo[memo_key] = results
+        return results
+
+
+autocomplete_index = PrefixIndex()
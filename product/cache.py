@@ -0,0 +1,139 @@
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+from rest_framework import status
+from api import versions
+from api.mixins import ConditionalGetMixin
+from phi_mart.routers import reads_from_replica
+
+
+class CatalogCache:
+    """
+    Read-through cache for catalog responses.
+    - Every key carries the current catalog version, so bumping the version
+      retires all cached pages at once without deleting anything
+    - The version is an api.versions counter, losing its key never brings
+      back pages cached under an older version
+    - Hit and miss counters live in the same backend, so a shared backend
+      reports numbers for all workers
+    """
+
+    VERSION_KEY = 'catalog:version'
+    MODIFIED_KEY = 'catalog:modified'
+    HITS_KEY = 'catalog:hits'
+    MISSES_KEY = 'catalog:misses'
+
+    @property
+    def cache(self):
+        return caches[settings.CATALOG_CACHE_ALIAS]
+
+    def get_version(self):
+        return versions.get_version(self.cache, self.VERSION_KEY)
+
+    def bump_version(self):
+        self.cache.set(self.MODIFIED_KEY, time.time(), timeout=None)
+        return versions.bump_version(self.cache, self.VERSION_KEY)
+
+    def get_last_modified(self):
+        """ Epoch seconds of the last bump, an unknown time counts as now"""
+        modified = self.cache.get(self.MODIFIED_KEY)
+        if modified is None:
+            self.cache.add(self.MODIFIED_KEY, time.time(), timeout=None)
+            modified = self.cache.get(self.MODIFIED_KEY)
+        return modified
+
+    def replicas_may_lag(self):
+        """ True while a replica read may still miss the last catalog change, nothing read then is cached"""
+        return reads_from_replica() and time.time() - self.get_last_modified() < settings.REPLICA_STICKY_SECONDS
+
+    def make_key(self, request, params):
+        parts = [request.get_host(), request.path]
+        parts += [f"{name}={value}" for name, value in sorted(params.items())]
+        digest = hashlib.md5('&'.join(parts).encode()).hexdigest()
+        return f"catalog:{self.get_version()}:{digest}"
+
+    def get(self, key):
+        data = self.cache.get(key)
+        self._count(self.MISSES_KEY if data is None else self.HITS_KEY)
+        return data
+
+    def set(self, key, data):
+        self.cache.set(key, data, timeout=settings.CATALOG_CACHE_TIMEOUT)
+
+    def _count(self, key):
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            if not self.cache.add(key, 1, timeout=None):
+                self.cache.incr(key)
+
+    def stats(self):
+        counters = self.cache.get_many([self.HITS_KEY, self.MISSES_KEY])
+        hits = counters.get(self.HITS_KEY, 0)
+        misses = counters.get(self.MISSES_KEY, 0)
+        total = hits + misses
+        return {
+            'version': self.get_version(),
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / total, 4) if total else 0.0,
+            'miss_rate': round(misses / total, 4) if total else 0.0,
+        }
+
+    def reset_stats(self):
+        self.cache.delete_many([self.HITS_KEY, self.MISSES_KEY])
+
+
+catalog_cache = CatalogCache()
+
+
+class CachedCatalogMixin:
+    """
+    Serve list and retrieve responses from the catalog cache.
+    Only the query params understood by the view's filter backends and
+    paginator are part of the key, unknown params can't blow up the keyspace.
+    """
+
+    pagination_params = ['page_query_param', 'page_size_query_param', 'cursor_query_param', 'count_query_param']
+
+    def get_cache_params(self, request):
+        names = set()
+        filterset_class = getattr(self, 'filterset_class', None)
+        if filterset_class is not None:
+            names.update(filterset_class.base_filters.keys())
+        for backend in self.filter_backends:
+            for attr in ['search_param', 'ordering_param']:
+                if getattr(backend, attr, None):
+                    names.add(getattr(backend, attr))
+        if self.paginator is not None:
+            for attr in self.pagination_params:
+                if getattr(self.paginator, attr, None):
+                    names.add(getattr(self.paginator, attr))
+        return {name: request.query_params.get(name) for name in names if name in request.query_params}
+
+    def cached_response(self, request, render):
+        key = catalog_cache.make_key(request, self.get_cache_params(request))
+        data = catalog_cache.get(key)
+        if data is not None:
+            return Response(data)
+        response = render()
+        if response.status_code == status.HTTP_200_OK and not catalog_cache.replicas_may_lag():
+            catalog_cache.set(key, response.data)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(CachedCatalogMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(CachedCatalogMixin, self).retrieve(request, *args, **kwargs))
+
+
+class CatalogConditionalMixin(ConditionalGetMixin):
+    """ Conditional GET validated by the catalog version, answers without touching the database"""
+
+    def get_validators(self, request):
+        if catalog_cache.replicas_may_lag():
+            return None
+        return catalog_cache.get_version(), catalog_cache.get_last_modified()
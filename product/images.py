@@ -0,0 +1,225 @@
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import timedelta
+from functools import lru_cache
+from io import BytesIO
+from pathlib import Path
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.uploadhandler import StopUpload, TemporaryFileUploadHandler
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from api.invalidation import invalidation_bus
+from product.models import ProductImage
+
+
+@lru_cache(maxsize=None)
+def _load_storage(path):
+    return import_string(path)()
+
+
+def get_image_storage():
+    """ Storage the processed images are pushed to, settings.PRODUCT_IMAGE_STORAGE (Cloudinary in production)"""
+    return _load_storage(settings.PRODUCT_IMAGE_STORAGE)
+
+
+@lru_cache(maxsize=None)
+def configure_cloudinary():
+    """ Credentials from settings.CLOUDINARY_STORAGE, set on first use instead of at startup"""
+    import cloudinary
+    options = settings.CLOUDINARY_STORAGE
+    cloudinary.config(cloud_name=options['CLOUD_NAME'], api_key=options['API_KEY'], api_secret=options['API_SECRET'], secure=True)
+
+
+def legacy_image_url(value):
+    """ URL of a ProductImage.image uploaded straight to Cloudinary before the image pipeline"""
+    from cloudinary.models import CloudinaryField
+    configure_cloudinary()
+    return CloudinaryField('image').to_python(value).url
+
+
+class LimitedUploadHandler(TemporaryFileUploadHandler):
+    """
+    Streams a multipart upload to a temporary file and stops reading the body as
+    soon as it passes settings.PRODUCT_IMAGE_MAX_UPLOAD_SIZE, a too large file
+    is never received in full.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.max_size = settings.PRODUCT_IMAGE_MAX_UPLOAD_SIZE
+        self.received = 0
+        self.too_large = False
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.max_size:
+            self.too_large = True
+            raise StopUpload(connection_reset=True)
+        return super().receive_data_chunk(raw_data, start)
+
+
+def limit_upload(request):
+    """ Install a LimitedUploadHandler before the body is parsed, None when Content-Length is already over the limit"""
+    # multipart boundaries and headers come on top of the file itself
+    if int(request.META.get('CONTENT_LENGTH') or 0) > settings.PRODUCT_IMAGE_MAX_UPLOAD_SIZE + 64 * 1024:
+        return None
+    handler = LimitedUploadHandler(request._request)
+    request._request.upload_handlers = [handler]
+    return handler
+
+
+class ImagePipeline:
+    """
+    Background processing of staged product image uploads.
+    - The request only moves the upload to the staging directory and saves a
+      pending ProductImage, the worker pool takes it from there after commit
+    - Workers decode and normalize with Pillow (EXIF orientation, RGB, bounded
+      size), render the derivatives and push everything to the image storage
+    - Pillow releases the GIL while decoding, resizing and encoding, so a
+      thread pool keeps several images going at once
+    - The pending row is the queue: an image whose worker died with its
+      process (a restart, a reclaimed serverless instance) stays pending, and
+      process_stale() picks it up again from the process_product_images command
+    """
+
+    max_size = (1600, 1600)
+    thumbnail_size = (300, 300)  # cropped to exactly this size
+    webp_size = (800, 800)  # fitted inside, keeps the aspect ratio
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._futures = set()
+
+    @property
+    def staging_dir(self):
+        path = Path(settings.PRODUCT_IMAGE_STAGING_DIR)
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def stage(self, upload):
+        """ Move an uploaded file to the staging directory, returns its path"""
+        path = self.staging_dir / f'{uuid.uuid4().hex}{Path(upload.name).suffix.lower()[:10]}'
+        if hasattr(upload, 'temporary_file_path'):
+            shutil.move(upload.temporary_file_path(), path)
+        else:
+            with open(path, 'wb') as file:
+                for chunk in upload.chunks():
+                    file.write(chunk)
+        return str(path)
+
+    def submit(self, image_id):
+        if settings.PRODUCT_IMAGE_WORKERS <= 0:
+            self.process(image_id)
+            return None
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=settings.PRODUCT_IMAGE_WORKERS, thread_name_prefix='product-images')
+            future = self._executor.submit(self._run, image_id)
+            self._futures.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self._futures.discard(future)
+
+    def _run(self, image_id):
+        try:
+            return self.process(image_id)
+        finally:
+            connections.close_all()
+
+    def wait(self, timeout=None):
+        """ Block until every submitted image is processed"""
+        with self._lock:
+            futures = list(self._futures)
+        wait(futures, timeout=timeout)
+
+    def process_stale(self, older_than):
+        """ Process the images staged more than `older_than` seconds ago and still pending, returns {status: count}"""
+        cutoff = timezone.now() - timedelta(seconds=older_than)
+        stale = ProductImage.objects.filter(status=ProductImage.PENDING).filter(Q(staged_at__lt=cutoff) | Q(staged_at__isnull=True))
+        counts = {}
+        for image_id in stale.order_by('pk').values_list('id', flat=True).iterator():
+            result = self.process(image_id)
+            counts[result] = counts.get(result, 0) + 1
+        return counts
+
+    def process(self, image_id):
+        """ Render and push one pending image, returns its new status (None when it is gone or not pending)"""
+        image = ProductImage.objects.filter(pk=image_id, status=ProductImage.PENDING).first()
+        if image is None:
+            return None
+        storage = get_image_storage()
+        prefix = f'products/{image.product_id}/{image.pk}-{uuid.uuid4().hex[:8]}'
+        names = {}
+        try:
+            for field, (content, extension) in self.render(image.source).items():
+                names[field] = storage.save(f'{prefix}/{field}.{extension}', ContentFile(content))
+        except Exception as error:
+            self.delete_files(names.values())
+            changes = {'status': ProductImage.FAILED, 'error': str(error)[:255] or error.__class__.__name__}
+        else:
+            changes = dict(names, status=ProductImage.READY, error='')
+        finally:
+            if image.source and os.path.exists(image.source):
+                os.remove(image.source)
+
+        # deleted or replaced by a newer upload meanwhile, don't leave its files behind
+        if not ProductImage.objects.filter(pk=image.pk, status=ProductImage.PENDING, source=image.source).update(source='', **changes):
+            self.delete_files(names.values())
+            return None
+        # a queryset update sends no post_save, the product pages nest their images
+        invalidation_bus.publish('product.ProductImage', image.pk)
+        return changes['status']
+
+    def render(self, path):
+        """ {field: (bytes, extension)} for the normalized original and each derivative"""
+        # Pillow loads with the first image, not at startup
+        from PIL import Image, ImageOps
+        with Image.open(path) as source:
+            # JPEGs decode straight at a reduced scale when they are much larger than needed
+            source.draft('RGB', self.max_size)
+            image = self.normalize(ImageOps.exif_transpose(source))
+
+        webp = image.copy()
+        webp.thumbnail(self.webp_size, Image.LANCZOS)
+        return {
+            'original': (self._encode(image, 'JPEG', quality=85, optimize=True, progressive=True), 'jpg'),
+            'thumbnail': (self._encode(ImageOps.fit(image, self.thumbnail_size, Image.LANCZOS), 'JPEG', quality=80, optimize=True), 'jpg'),
+            'webp': (self._encode(webp, 'WEBP', quality=80, method=4), 'webp'),
+        }
+
+    def normalize(self, image):
+        from PIL import Image
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            # JPEG has no alpha, flatten transparent pixels onto white
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.thumbnail(self.max_size, Image.LANCZOS)
+        return image
+
+    def _encode(self, image, format, **options):
+        buffer = BytesIO()
+        image.save(buffer, format, **options)
+        return buffer.getvalue()
+
+    def delete_files(self, names):
+        storage = get_image_storage()
+        for name in names:
+            if name:
+                storage.delete(name)
+
+
+image_pipeline = ImagePipeline()
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from api.renderers import csv_stream, ndjson_stream
+from product.services import ProductImportService
+
+
+class Command(BaseCommand):
+    help = 'Write the whole catalog as CSV or NDJSON with the columns import_products reads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=['csv', 'ndjson'], default='csv')
+        parser.add_argument('--output', help='File to write, stdout by default')
+
+    def handle(self, *args, **options):
+        rows = ProductImportService.export_rows()
+        if options['format'] == 'csv':
+            fields = ProductImportService.FIELDS
+            chunks = csv_stream(fields, ([row[field] for field in fields] for row in rows))
+        else:
+            chunks = ndjson_stream(rows)
+
+        if not options['output']:
+            for chunk in chunks:
+                self.stdout.write(chunk.decode(), ending='')
+            return
+        with open(options['output'], 'wb') as file:
+            for chunk in chunks:
+                file.write(chunk)
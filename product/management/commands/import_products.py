@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from api.parsers import get_row_reader
+from product.services import ProductImportService
+
+
+class Command(BaseCommand):
+    help = 'Upsert products from a CSV or NDJSON file (id, name, description, price, stock, category), rows with an id update that product'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help='Defaults to the file extension')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        reader = get_row_reader(options['format'] or options['path'])
+        if reader is None:
+            raise CommandError('Cannot tell the format from the file name, pass --format.')
+        with open(options['path'], 'rb') as file:
+            report = ProductImportService.import_rows(reader(file), chunk_size=options['chunk_size'])
+
+        for error in report['errors']:
+            self.stderr.write(f"row {error['row']}: {error['errors']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['created']} created, {report['updated']} updated, {report['failed']} failed."
+        ))
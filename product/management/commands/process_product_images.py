@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from product.images import image_pipeline
+from product.models import ProductImage
+
+
+class Command(BaseCommand):
+    help = 'Process product images left pending, e.g. when the worker that had them was restarted'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than', type=int, default=None,
+            help='Only images staged at least this many seconds ago, PRODUCT_IMAGE_STALE_AFTER by default. 0 takes every pending image',
+        )
+
+    def handle(self, *args, **options):
+        older_than = options['older_than']
+        counts = image_pipeline.process_stale(settings.PRODUCT_IMAGE_STALE_AFTER if older_than is None else older_than)
+        self.stdout.write(self.style.SUCCESS(
+            f"{counts.get(ProductImage.READY, 0)} ready, {counts.get(ProductImage.FAILED, 0)} failed"
+        ))
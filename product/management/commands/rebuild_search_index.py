@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from product.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text product search index (after bulk imports or raw SQL updates)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        backend = get_search_backend(connections[options['database']])
+        if backend is None:
+            raise CommandError('No search backend for this database, search falls back to icontains.')
+        with transaction.atomic(using=options['database']):
+            backend.rebuild()
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt.'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from product.services import RatingService
+
+
+class Command(BaseCommand):
+    help = 'Recompute rating_avg, rating_count and the star histogram of every product from Review'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        updated = RatingService.reconcile(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Reconciled ratings of {updated} products.'))
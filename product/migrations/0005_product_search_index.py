@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.db import migrations
+
+# The index as product.search built it when this migration was written. Plain SQL
+# against the historical tables, later changes to the app code don't change it.
+
+
+def install_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    products = connection.ops.quote_name(apps.get_model('product', 'Product')._meta.db_table)
+    categories = connection.ops.quote_name(apps.get_model('product', 'Category')._meta.db_table)
+    if connection.vendor == 'postgresql':
+        config = settings.PRODUCT_SEARCH_CONFIG
+        schema_editor.execute(f"ALTER TABLE {products} ADD COLUMN IF NOT EXISTS search_vector tsvector")
+        schema_editor.execute(f"CREATE INDEX IF NOT EXISTS product_search_vector_gin ON {products} USING GIN (search_vector)")
+        schema_editor.execute(
+            f"""
+            UPDATE {products} AS p SET search_vector =
+                setweight(to_tsvector(%s::regconfig, coalesce(p.name, '')), 'A') ||
+                setweight(to_tsvector(%s::regconfig, coalesce(p.description, '')), 'B') ||
+                setweight(to_tsvector(%s::regconfig, coalesce(c.name, '')), 'C')
+            FROM {categories} AS c
+            WHERE c.id = p.category_id
+            """,
+            [config, config, config],
+        )
+    elif connection.vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS product_search "
+            "USING fts5(name, description, category_name, tokenize='unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute("DELETE FROM product_search")
+        schema_editor.execute(
+            "INSERT INTO product_search (rowid, name, description, category_name) "
+            f"SELECT p.id, p.name, p.description, c.name FROM {products} AS p "
+            f"JOIN {categories} AS c ON c.id = p.category_id"
+        )
+
+
+def uninstall_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        products = connection.ops.quote_name(apps.get_model('product', 'Product')._meta.db_table)
+        schema_editor.execute("DROP INDEX IF EXISTS product_search_vector_gin")
+        schema_editor.execute(f"ALTER TABLE {products} DROP COLUMN IF EXISTS search_vector")
+    elif connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS product_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0004_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.1.7 on 2026-10-18 10:14
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_ratings(apps, schema_editor):
+    Product = apps.get_model('product', 'Product')
+    Review = apps.get_model('product', 'Review')
+    products = {}
+    rows = Review.objects.values_list('product_id', 'ratings').annotate(total=Count('id')).order_by()
+    for product_id, rating, total in rows:
+        products.setdefault(product_id, {})[rating] = total
+    for product_id, histogram in products.items():
+        count = sum(histogram.values())
+        fields = {f'rating_{star}': total for star, total in histogram.items()}
+        fields['rating_count'] = count
+        fields['rating_avg'] = round(Decimal(sum(star * total for star, total in histogram.items())) / count, 2)
+        Product.objects.filter(pk=product_id).update(**fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0005_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0, help_text='Number of 1 star reviews'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0, help_text='Number of 2 star reviews'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0, help_text='Number of 3 star reviews'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0, help_text='Number of 4 star reviews'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0, help_text='Number of 5 star reviews'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_avg',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=3),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+    ]
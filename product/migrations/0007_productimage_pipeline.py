@@ -0,0 +1,54 @@
+import cloudinary.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0006_product_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=cloudinary.models.CloudinaryField(blank=True, max_length=255, null=True, verbose_name='image'),
+        ),
+        # images uploaded before the pipeline are already processed
+        migrations.AddField(
+            model_name='productimage',
+            name='status',
+            field=models.CharField(choices=[('P', 'Pending'), ('R', 'Ready'), ('F', 'Failed')], default='R', max_length=1),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='status',
+            field=models.CharField(choices=[('P', 'Pending'), ('R', 'Ready'), ('F', 'Failed')], default='P', max_length=1),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='source',
+            field=models.CharField(blank=True, help_text='Staged upload waiting for the image pipeline', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='original',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='thumbnail',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='webp',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='error',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.7 on 2026-10-18 10:57
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0007_productimage_pipeline'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('T', 'Tax'), ('D', 'Discount')], max_length=1)),
+                ('rate', models.DecimalField(decimal_places=4, help_text='0.1000 is 10%', max_digits=5, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(1)])),
+                ('is_active', models.BooleanField(default=True)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='price_rules', to='product.category')),
+            ],
+        ),
+    ]
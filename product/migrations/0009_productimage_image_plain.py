@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-18 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0008_pricerule'),
+    ]
+
+    operations = [
+        # still the varchar(255) CloudinaryField wrote, only the model field class changes
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 12:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0009_productimage_image_plain'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='staged_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -2,7 +2,6 @@ from django.db import models
 from django.conf import settings
 from django.core.validators import MinValueValidator, MaxValueValidator
 from product.validators import validate_file_size
-from cloudinary.models import CloudinaryField
 
 # Create your models here.
 class Category(models.Model):
@@ -20,16 +19,64 @@ class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
     created_at = models.DateTimeField(auto_now_add=True, help_text='It will automatically record product creation datetime') # help_text for swagger
     updated_at = models.DateTimeField(auto_now=True)
+    # denormalized from Review, maintained by RatingService
+    rating_avg = models.DecimalField(max_digits=3, decimal_places=2, default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_1 = models.PositiveIntegerField(default=0, help_text='Number of 1 star reviews')
+    rating_2 = models.PositiveIntegerField(default=0, help_text='Number of 2 star reviews')
+    rating_3 = models.PositiveIntegerField(default=0, help_text='Number of 3 star reviews')
+    rating_4 = models.PositiveIntegerField(default=0, help_text='Number of 4 star reviews')
+    rating_5 = models.PositiveIntegerField(default=0, help_text='Number of 5 star reviews')
 
     def __str__(self):
         return self.name
     
     class Meta:
         ordering = ['-id',]
+        # keyset pagination on the ordering_fields, id is the tie-breaker
+        indexes = [
+            models.Index(fields=['price', 'id']),
+            models.Index(fields=['updated_at', 'id']),
+        ]
 
 class ProductImage(models.Model):
+    PENDING = 'P'
+    READY = 'R'
+    FAILED = 'F'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (READY, 'Ready'),
+        (FAILED, 'Failed'),
+    )
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
-    image = CloudinaryField('image')
+    # Cloudinary resource of an upload made before the image pipeline, new ones fill original/thumbnail/webp instead.
+    # A plain column, so cloudinary is only imported when such an image is shown (product.images.legacy_image_url)
+    image = models.CharField(max_length=255, null=True, blank=True)
+    status = models.CharField(max_length=1, choices=STATUS_CHOICES, default=PENDING)
+    source = models.CharField(max_length=255, blank=True, help_text='Staged upload waiting for the image pipeline')
+    # when the upload was staged, process_product_images retries the pending images nobody finished
+    staged_at = models.DateTimeField(null=True, blank=True)
+    # names in the PRODUCT_IMAGE_STORAGE
+    original = models.CharField(max_length=255, blank=True)
+    thumbnail = models.CharField(max_length=255, blank=True)
+    webp = models.CharField(max_length=255, blank=True)
+    error = models.CharField(max_length=255, blank=True)
+
+class PriceRule(models.Model):
+    """ Tax or discount rate for a category, a rule without category covers every other category"""
+    TAX = 'T'
+    DISCOUNT = 'D'
+    KIND_CHOICES = (
+        (TAX, 'Tax'),
+        (DISCOUNT, 'Discount'),
+    )
+    kind = models.CharField(max_length=1, choices=KIND_CHOICES)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True, related_name='price_rules')
+    rate = models.DecimalField(max_digits=5, decimal_places=4, validators=[MinValueValidator(0), MaxValueValidator(1)], help_text='0.1000 is 10%')
+    is_active = models.BooleanField(default=True)
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.rate:%} on {self.category or 'every category'}"
 
 class Review(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='review')
@@ -1,4 +1,197 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import datetime
+import json
+from decimal import Decimal
+from uuid import UUID
+from functools import reduce
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F, Q
+from django.db.models.expressions import OrderBy
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 class CustomPageNumberPagination(PageNumberPagination):
-    page_size = 10
\ No newline at end of file
+    page_size = 10
+
+
+def encode_cursor_value(value):
+    # full precision, DjangoJSONEncoder would cut datetimes down to milliseconds
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (Decimal, UUID)):
+        return str(value)
+    raise TypeError(f"Can't encode {type(value).__name__} in a cursor")
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on the queryset's own ordering with pk as tie-breaker.
+    - Page N filters on the last seen row instead of OFFSET, so it costs the same as page 1
+    - Total count is only computed for ?count=true
+    """
+
+    page_size = 10
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    ordering = ('-pk',)
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.count = queryset.count() if self.wants_count(request) else None
+
+        ordering = self.get_ordering(queryset)
+        values, reverse = self.decode_cursor(request, ordering)
+        if reverse:
+            ordering = [(name, not descending) for name, descending in ordering]
+
+        queryset = queryset.order_by(*[f"-{name}" if descending else name for name, descending in ordering])
+        if values is not None:
+            queryset = queryset.filter(self.keyset_filter(ordering, values))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            ordering = [(name, not descending) for name, descending in ordering]
+
+        self.ordering_used = ordering
+        self.has_next = bool(rows) and (has_more if not reverse else True)
+        self.has_previous = bool(rows) and (has_more if reverse else values is not None)
+        self.page = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        payload = {}
+        if self.count is not None:
+            payload['count'] = self.count
+        payload['next'] = self.get_next_link()
+        payload['previous'] = self.get_previous_link()
+        payload['results'] = data
+        return Response(payload)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.build_link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.build_link(self.page[0], reverse=True)
+
+    def wants_count(self, request):
+        return request.query_params.get(self.count_query_param, '').lower() in ['1', 'true', 'yes']
+
+    def get_ordering(self, queryset):
+        terms = queryset.query.order_by
+        if not terms and queryset.query.default_ordering:
+            terms = queryset.model._meta.ordering
+        terms = terms or self.ordering
+
+        ordering = []
+        for term in terms:
+            if isinstance(term, OrderBy) and isinstance(term.expression, F):
+                ordering.append((term.expression.name, term.descending))
+            elif isinstance(term, str) and term != '?':
+                ordering.append((term.lstrip('-'), term.startswith('-')))
+            else:
+                raise ValueError(f"Keyset pagination can't order by {term!r}")
+
+        pk_name = queryset.model._meta.pk.name
+        if not any(name in ['pk', pk_name] for name, _ in ordering):
+            ordering.append(('pk', ordering[0][1] if ordering else True))
+        self.model = queryset.model
+        return ordering
+
+    def keyset_filter(self, ordering, values):
+        # (a > x) OR (a = x AND b > y) OR (a = x AND b = y AND c > z) ...
+        condition = Q()
+        equal = Q()
+        for (name, descending), value in zip(ordering, values):
+            lookup = 'lt' if descending else 'gt'
+            condition |= equal & Q(**{f"{name}__{lookup}": value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def build_link(self, row, reverse):
+        values = [reduce(getattr, name.split('__'), row) for name, _ in self.ordering_used]
+        token = json.dumps({'v': values, 'r': reverse}, default=encode_cursor_value, separators=(',', ':'))
+        token = base64.urlsafe_b64encode(token.encode()).decode().rstrip('=')
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request, ordering):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None, False
+        try:
+            token += '=' * (-len(token) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(token.encode()))
+            values = payload['v']
+            if len(values) != len(ordering):
+                raise ValueError
+            values = [self.to_python(name, value) for (name, _), value in zip(ordering, values)]
+            return values, bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def to_python(self, name, value):
+        # annotations (e.g. a search rank) are not model fields and go through as they are
+        model = self.model
+        try:
+            for part in name.split('__'):
+                field = model._meta.pk if part == 'pk' else model._meta.get_field(part)
+                model = field.related_model or model
+        except FieldDoesNotExist:
+            return value
+        return field.to_python(value)
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'The pagination cursor value, send it empty for the first page.',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.count_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Set to true to include the total count.',
+                'schema': {'type': 'boolean'},
+            },
+        ]
+
+
+class OptionalKeysetPagination(KeysetPagination):
+    """
+    Opt-in keyset pagination: only used when the request carries ?cursor=,
+    otherwise falls back to `fallback_class` (or no pagination at all).
+    """
+
+    fallback_class = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.fallback = None
+        if self.cursor_query_param in request.query_params:
+            return super().paginate_queryset(queryset, request, view)
+        if self.fallback_class is None:
+            return None
+        self.fallback = self.fallback_class()
+        return self.fallback.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.fallback is not None:
+            return self.fallback.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class KeysetOrPageNumberPagination(OptionalKeysetPagination):
+    fallback_class = CustomPageNumberPagination
+    page_query_param = CustomPageNumberPagination.page_query_param
@@ -0,0 +1,144 @@
+import threading
+from dataclasses import dataclass
+from decimal import Decimal, ROUND_HALF_UP
+from django.conf import settings
+from django.core.cache import caches
+from api import versions
+from product.models import PriceRule
+
+CENT = Decimal('0.01')
+
+
+def to_cents(amount):
+    return amount.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+@dataclass(frozen=True)
+class PriceRules:
+    """ Active rates by category id, the None key holds the rate of every other category"""
+    version: int
+    tax: dict
+    discount: dict
+
+    def tax_rate(self, category_id):
+        return self.tax.get(category_id, self.tax[None])
+
+    def discount_rate(self, category_id):
+        return self.discount.get(category_id, self.discount[None])
+
+
+@dataclass(frozen=True)
+class PricedLine:
+    product_id: int
+    quantity: int
+    price: Decimal  # list price
+    unit_price: Decimal  # after the discount
+    total_price: Decimal  # unit_price * quantity, before tax
+    tax: Decimal
+
+    @property
+    def total_with_tax(self):
+        return self.total_price + self.tax
+
+
+@dataclass(frozen=True)
+class PricedCart:
+    lines: dict  # {product_id: PricedLine}
+    total_price: Decimal
+    discount: Decimal
+    tax: Decimal
+
+    @property
+    def total_with_tax(self):
+        return self.total_price + self.tax
+
+
+class PricingEngine:
+    """
+    The one place cart, product and order prices are computed.
+    - Amounts stay Decimal and every rounding is half-up to the cent, per line,
+      so a cart total is always the sum of the line totals shown with it
+    - The discount is taken off the unit price first, tax is charged on the
+      discounted line total
+    - PriceRule rows are loaded once per process and reloaded only when the
+      shared pricing version moves, which saving or deleting a rule does
+    """
+
+    VERSION_KEY = 'pricing:version'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rules = None
+
+    @property
+    def cache(self):
+        return caches[settings.CATALOG_CACHE_ALIAS]
+
+    def get_version(self):
+        return versions.get_version(self.cache, self.VERSION_KEY)
+
+    def bump_version(self):
+        return versions.bump_version(self.cache, self.VERSION_KEY)
+
+    def get_rules(self):
+        version = self.get_version()
+        rules = self._rules
+        if rules is None or rules.version != version:
+            with self._lock:
+                if self._rules is None or self._rules.version != version:
+                    self._rules = self.load_rules(version)
+                rules = self._rules
+        return rules
+
+    def load_rules(self, version):
+        tax = {None: settings.PRICING_DEFAULT_TAX_RATE}
+        discount = {None: Decimal(0)}
+        # the newest active rule wins when a category has more than one of a kind
+        for kind, category_id, rate in PriceRule.objects.filter(is_active=True).order_by('pk').values_list('kind', 'category_id', 'rate'):
+            (tax if kind == PriceRule.TAX else discount)[category_id] = rate
+        return PriceRules(version=version, tax=tax, discount=discount)
+
+    def price_line(self, product_id, category_id, price, quantity, rules=None):
+        rules = rules or self.get_rules()
+        unit_price = to_cents(price * (1 - rules.discount_rate(category_id)))
+        total_price = unit_price * quantity
+        return PricedLine(
+            product_id=product_id,
+            quantity=quantity,
+            price=price,
+            unit_price=unit_price,
+            total_price=total_price,
+            tax=to_cents(total_price * rules.tax_rate(category_id)),
+        )
+
+    def price_product(self, product, rules=None):
+        """ One unit of a product"""
+        return self.price_line(product.pk, product.category_id, product.price, 1, rules)
+
+    def price_item(self, item, rules=None):
+        """ A CartItem, its product must be loaded"""
+        return self.price_line(item.product_id, item.product.category_id, item.product.price, item.quantity, rules)
+
+    def price_items(self, items, rules=None):
+        """ Price a whole cart in one pass"""
+        rules = rules or self.get_rules()
+        lines = {}
+        for item in items:
+            line = self.price_item(item, rules)
+            lines[line.product_id] = line
+        return PricedCart(
+            lines=lines,
+            total_price=sum((line.total_price for line in lines.values()), Decimal(0)),
+            discount=sum(((line.price - line.unit_price) * line.quantity for line in lines.values()), Decimal(0)),
+            tax=sum((line.tax for line in lines.values()), Decimal(0)),
+        )
+
+
+pricing = PricingEngine()
+
+
+def context_rules(context):
+    """ Price rules for one serialization, the pricing version is read once however many objects are priced"""
+    if 'pricing_rules' not in context:
+        context['pricing_rules'] = pricing.get_rules()
+    return context['pricing_rules']
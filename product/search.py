@@ -0,0 +1,184 @@
+import re
+from django.conf import settings
+from django.db import connections
+from django.db.models import BooleanField, FloatField
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import SearchFilter
+from rest_framework.settings import api_settings
+from product.models import Product, Category
+
+
+def tokenize(term):
+    return re.findall(r'\w+', term.lower())
+
+
+class PostgresSearchBackend:
+    """
+    Weighted tsvector column on the product table with a GIN index.
+    name > description > category name, every token is prefix matched.
+    """
+
+    column = 'search_vector'
+    index = 'product_search_vector_gin'
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.quote = connection.ops.quote_name
+        self.products = self.quote(Product._meta.db_table)
+        self.categories = self.quote(Category._meta.db_table)
+
+    def install(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE {self.products} ADD COLUMN IF NOT EXISTS {self.column} tsvector")
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {self.index} ON {self.products} USING GIN ({self.column})")
+
+    def uninstall(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DROP INDEX IF EXISTS {self.index}")
+            cursor.execute(f"ALTER TABLE {self.products} DROP COLUMN IF EXISTS {self.column}")
+
+    def _update(self, where, params):
+        sql = f"""
+            UPDATE {self.products} AS p SET {self.column} =
+                setweight(to_tsvector(%s::regconfig, coalesce(p.name, '')), 'A') ||
+                setweight(to_tsvector(%s::regconfig, coalesce(p.description, '')), 'B') ||
+                setweight(to_tsvector(%s::regconfig, coalesce(c.name, '')), 'C')
+            FROM {self.categories} AS c
+            WHERE c.id = p.category_id {where}
+        """
+        config = settings.PRODUCT_SEARCH_CONFIG
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, [config, config, config, *params])
+
+    def index_products(self, product_ids):
+        self._update('AND p.id = ANY(%s)', [list(product_ids)])
+
+    def index_category(self, category_id):
+        self._update('AND p.category_id = %s', [category_id])
+
+    def remove_products(self, product_ids):
+        # the vector lives on the product row and goes away with it
+        pass
+
+    def rebuild(self):
+        self._update('', [])
+
+    def search(self, queryset, term):
+        query = ' & '.join(f"{token}:*" for token in tokenize(term))
+        config = settings.PRODUCT_SEARCH_CONFIG
+        column = f"{self.products}.{self.column}"
+        return queryset.filter(
+            RawSQL(f"{column} @@ to_tsquery(%s::regconfig, %s)", (config, query), output_field=BooleanField())
+        ).annotate(
+            search_rank=RawSQL(f"ts_rank({column}, to_tsquery(%s::regconfig, %s))::float8", (config, query), output_field=FloatField())
+        )
+
+
+class SqliteSearchBackend:
+    """
+    FTS5 table keyed by product id for tests and local development.
+    """
+
+    table = 'product_search'
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.quote = connection.ops.quote_name
+        self.products = self.quote(Product._meta.db_table)
+        self.categories = self.quote(Category._meta.db_table)
+
+    def install(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} "
+                "USING fts5(name, description, category_name, tokenize='unicode61 remove_diacritics 2')"
+            )
+
+    def uninstall(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {self.table}")
+
+    def _insert(self, where, params):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {self.table} (rowid, name, description, category_name) "
+                f"SELECT p.id, p.name, p.description, c.name FROM {self.products} AS p "
+                f"JOIN {self.categories} AS c ON c.id = p.category_id {where}",
+                params,
+            )
+
+    def index_products(self, product_ids):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        self.remove_products(product_ids)
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        self._insert(f"WHERE p.id IN ({placeholders})", product_ids)
+
+    def index_category(self, category_id):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {self.table} WHERE rowid IN (SELECT id FROM {self.products} WHERE category_id = %s)",
+                [category_id],
+            )
+        self._insert('WHERE p.category_id = %s', [category_id])
+
+    def remove_products(self, product_ids):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE rowid IN ({placeholders})", product_ids)
+
+    def rebuild(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+        self._insert('', [])
+
+    def search(self, queryset, term):
+        query = ' '.join(f'"{token}"*' for token in tokenize(term))
+        # bm25 is lower for better matches, negate it so both backends rank descending
+        return queryset.filter(
+            RawSQL(f"{self.products}.id IN (SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s)", (query,), output_field=BooleanField())
+        ).annotate(
+            search_rank=RawSQL(
+                f"(SELECT -bm25({self.table}, 10.0, 4.0, 2.0) FROM {self.table} WHERE {self.table} MATCH %s AND rowid = {self.products}.id)",
+                (query,),
+                output_field=FloatField(),
+            )
+        )
+
+
+SEARCH_BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SqliteSearchBackend,
+}
+
+
+def get_search_backend(connection=None):
+    connection = connection or connections['default']
+    backend_class = SEARCH_BACKENDS.get(connection.vendor)
+    return backend_class(connection) if backend_class else None
+
+
+class ProductSearchFilter(SearchFilter):
+    """
+    Same ?search= param as SearchFilter, answered from the full-text index and
+    ranked by relevance unless the client asks for an explicit ?ordering=.
+    Databases without a backend fall back to the plain icontains search.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        backend = get_search_backend(connections[queryset.db])
+        if not terms or backend is None:
+            return super().filter_queryset(request, queryset, view)
+
+        term = ' '.join(terms)
+        if not tokenize(term):
+            return queryset.none()
+        queryset = backend.search(queryset, term)
+        if not request.query_params.get(api_settings.ORDERING_PARAM):
+            queryset = queryset.order_by('-search_rank', '-pk')
+        return queryset
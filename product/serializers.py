@@ -1,7 +1,9 @@
 from rest_framework import serializers
-from decimal import Decimal
 from product.models import Product,Category, Review, ProductImage
 from django.contrib.auth import get_user_model
+from product.images import get_image_storage, legacy_image_url
+from product.pricing import pricing, context_rules
+from product.validators import validate_file_size
 
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
@@ -13,22 +15,59 @@ class CategorySerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         return super().create(validated_data)
 
+class ImageURLField(serializers.ReadOnlyField):
+    """ URL of a name in the product image storage"""
+
+    def to_representation(self, name):
+        return get_image_storage().url(name) if name else None
+
+
 class ProductImageSerializer(serializers.ModelSerializer):
-    image = serializers.ImageField()
+    # only the header is read here, the image pipeline decodes it later
+    image = serializers.FileField(write_only=True, validators=[validate_file_size])
+    thumbnail = ImageURLField()
+    webp = ImageURLField()
     class Meta:
         model = ProductImage
-        fields = ['image']
+        fields = ['id', 'image', 'status', 'thumbnail', 'webp']
+        read_only_fields = ['status']
+
+    def validate_image(self, file):
+        from PIL import Image
+        try:
+            with Image.open(file) as image:
+                image_format = image.format
+        except (OSError, Image.DecompressionBombError):
+            raise serializers.ValidationError('Upload a valid image.')
+        file.seek(0)
+        if image_format not in ('JPEG', 'PNG', 'WEBP', 'GIF'):
+            raise serializers.ValidationError('Use a JPEG, PNG, WEBP or GIF image.')
+        return file
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if instance.original:
+            data['image'] = get_image_storage().url(instance.original)
+        else:
+            # uploaded to Cloudinary before the pipeline existed
+            data['image'] = legacy_image_url(instance.image) if instance.image else None
+        return data
 
 class ProductSerializer(serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
     class Meta:
         model = Product
-        fields = ['id', 'name', 'description', 'price', 'price_with_tax','stock', 'category','created_at', 'updated_at', 'images']
+        fields = ['id', 'name', 'description', 'price', 'price_with_tax','stock', 'category','created_at', 'updated_at', 'images', 'rating_avg', 'rating_count', 'rating_histogram']
+        read_only_fields = ['rating_avg', 'rating_count']
 
     price_with_tax = serializers.SerializerMethodField(method_name='calculate_tax')
+    rating_histogram = serializers.SerializerMethodField(method_name='get_rating_histogram')
+
+    def get_rating_histogram(self, product):
+        return {str(star): getattr(product, f'rating_{star}') for star in range(1, 6)}
 
     def calculate_tax(self, product):
-        return round(product.price * Decimal(1.1), 2)
+        return pricing.price_product(product, context_rules(self.context)).total_with_tax
     # field lavel validation: validate_<field name>
     def validate_price(self, price):
         if price < 0 :
@@ -36,6 +75,14 @@ class ProductSerializer(serializers.ModelSerializer):
         else:
             return price
 
+class ProductImportSerializer(ProductSerializer):
+    """ One row of a bulk import, same rules as ProductSerializer but the category is checked per chunk"""
+    id = serializers.IntegerField(required=False, min_value=1)
+    category = serializers.IntegerField(min_value=1)
+
+    class Meta(ProductSerializer.Meta):
+        fields = ['id', 'name', 'description', 'price', 'stock', 'category']
+
 class SimpleUserSerializer(serializers.ModelSerializer):
     name = serializers.SerializerMethodField(method_name='get_current_user_name')
     class Meta:
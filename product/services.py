@@ -0,0 +1,188 @@
+from decimal import Decimal
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Count, F, FloatField, Value
+from django.db.models.functions import Cast, Coalesce, NullIf
+from product.models import Category, Product, Review
+from product.serializers import ProductImportSerializer
+from product.search import get_search_backend
+from product.autocomplete import autocomplete_index
+from api.invalidation import invalidation_bus
+
+STARS = range(1, 6)
+
+
+class RatingService:
+    @staticmethod
+    def add_rating(product_id, rating):
+        RatingService._apply(product_id, added=rating)
+
+    @staticmethod
+    def remove_rating(product_id, rating):
+        RatingService._apply(product_id, removed=rating)
+
+    @staticmethod
+    def change_rating(product_id, old_rating, new_rating):
+        if old_rating != new_rating:
+            RatingService._apply(product_id, added=new_rating, removed=old_rating)
+
+    @staticmethod
+    def _apply(product_id, added=None, removed=None):
+        # one UPDATE, every expression on the right side sees the old row
+        count_delta = (added is not None) - (removed is not None)
+        sum_delta = (added or 0) - (removed or 0)
+        changes = {}
+        if added is not None:
+            changes[f'rating_{added}'] = F(f'rating_{added}') + 1
+        if removed is not None:
+            changes[f'rating_{removed}'] = F(f'rating_{removed}') - 1
+        if count_delta:
+            changes['rating_count'] = F('rating_count') + count_delta
+
+        weighted_sum = sum(F(f'rating_{star}') * star for star in STARS) + sum_delta
+        changes['rating_avg'] = Coalesce(
+            Cast(weighted_sum, FloatField()) / NullIf(F('rating_count') + count_delta, 0),
+            Value(0.0),
+        )
+        Product.objects.filter(pk=product_id).update(**changes)
+        # ratings are part of the product payload
+        invalidation_bus.publish_on_commit('product.Product')
+
+    @staticmethod
+    def reconcile(chunk_size=2000):
+        """ Recompute every product's aggregates from Review, one GROUP BY per chunk of products"""
+        updated = 0
+        product_ids = Product.objects.order_by('pk').values_list('pk', flat=True)
+        chunk = []
+        for product_id in product_ids.iterator(chunk_size=chunk_size):
+            chunk.append(product_id)
+            if len(chunk) == chunk_size:
+                updated += RatingService._reconcile_chunk(chunk)
+                chunk = []
+        if chunk:
+            updated += RatingService._reconcile_chunk(chunk)
+        invalidation_bus.publish_on_commit('product.Product')
+        return updated
+
+    @staticmethod
+    def _reconcile_chunk(product_ids):
+        histograms = {product_id: dict.fromkeys(STARS, 0) for product_id in product_ids}
+        rows = (
+            Review.objects.filter(product_id__in=product_ids)
+            .values_list('product_id', 'ratings')
+            .annotate(total=Count('id'))
+            .order_by()
+        )
+        for product_id, rating, total in rows:
+            histograms[product_id][rating] = total
+
+        products = []
+        for product_id, histogram in histograms.items():
+            count = sum(histogram.values())
+            weighted_sum = sum(star * total for star, total in histogram.items())
+            product = Product(pk=product_id, rating_count=count)
+            product.rating_avg = round(Decimal(weighted_sum) / count, 2) if count else Decimal('0')
+            for star, total in histogram.items():
+                setattr(product, f'rating_{star}', total)
+            products.append(product)
+
+        fields = ['rating_avg', 'rating_count'] + [f'rating_{star}' for star in STARS]
+        Product.objects.bulk_update(products, fields)
+        return len(products)
+
+
+class ProductImportService:
+    """
+    Catalog sync in chunks: rows are validated with ProductSerializer's rules,
+    categories are checked with one query per chunk, and every chunk is written
+    with two bulk statements (an upsert for rows with an id, an insert for the rest).
+    """
+
+    FIELDS = ['id', 'name', 'description', 'price', 'stock', 'category']
+    UPDATE_FIELDS = ['name', 'description', 'price', 'stock', 'category', 'updated_at']
+
+    @staticmethod
+    def import_rows(rows, chunk_size=1000, max_errors=1000):
+        """
+        rows: (row number, dict, parse error) tuples as produced by api.parsers.
+        Returns counts and the errors of the first max_errors failing rows.
+        """
+        report = {'created': 0, 'updated': 0, 'failed': 0, 'errors': []}
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                ProductImportService._import_chunk(chunk, report, max_errors)
+                chunk = []
+        if chunk:
+            ProductImportService._import_chunk(chunk, report, max_errors)
+
+        if report['created'] or report['updated']:
+            # rows may carry explicit ids, keep the PostgreSQL sequence ahead of them
+            with connection.cursor() as cursor:
+                for statement in connection.ops.sequence_reset_sql(no_style(), [Product]):
+                    cursor.execute(statement)
+            # bulk writes send no signals, refresh what the signal handlers would have
+            invalidation_bus.publish('product.Product')
+            autocomplete_index.publish_rebuild()
+        return report
+
+    @staticmethod
+    def _fail(report, max_errors, number, errors):
+        report['failed'] += 1
+        if len(report['errors']) < max_errors:
+            report['errors'].append({'row': number, 'errors': errors})
+
+    @staticmethod
+    def _import_chunk(chunk, report, max_errors):
+        valid = {}
+        for number, data, error in chunk:
+            if error:
+                ProductImportService._fail(report, max_errors, number, {'non_field_errors': [error]})
+                continue
+            data = {key: value for key, value in data.items() if key in ProductImportService.FIELDS}
+            if data.get('id') in ('', None):
+                data.pop('id', None)
+            serializer = ProductImportSerializer(data=data)
+            if not serializer.is_valid():
+                ProductImportService._fail(report, max_errors, number, serializer.errors)
+                continue
+            product_id = serializer.validated_data.get('id')
+            if product_id in valid:
+                # ON CONFLICT can't touch a row twice in one statement, the later row wins
+                ProductImportService._fail(report, max_errors, valid[product_id][0], {'id': ['A later row has the same id.']})
+            valid[product_id if product_id is not None else ('new', number)] = (number, serializer.validated_data)
+
+        category_ids = {values['category'] for _, values in valid.values()}
+        categories = set(Category.objects.filter(pk__in=category_ids).values_list('pk', flat=True))
+        with_id, without_id = [], []
+        for number, values in sorted(valid.values(), key=lambda item: item[0]):
+            if values['category'] not in categories:
+                ProductImportService._fail(report, max_errors, number, {'category': [f'Invalid pk "{values["category"]}" - object does not exist.']})
+                continue
+            product = Product(**{field: value for field, value in values.items() if field != 'category'}, category_id=values['category'])
+            (with_id if product.pk else without_id).append(product)
+        if not with_id and not without_id:
+            return
+
+        with transaction.atomic():
+            existing = set(Product.objects.filter(pk__in=[product.pk for product in with_id]).values_list('pk', flat=True))
+            if with_id:
+                Product.objects.bulk_create(
+                    with_id, update_conflicts=True, unique_fields=['id'], update_fields=ProductImportService.UPDATE_FIELDS
+                )
+            if without_id:
+                Product.objects.bulk_create(without_id)
+            backend = get_search_backend()
+            if backend:
+                backend.index_products([product.pk for product in with_id + without_id])
+
+        report['updated'] += len(existing)
+        report['created'] += len(with_id) + len(without_id) - len(existing)
+
+    @staticmethod
+    def export_rows(chunk_size=2000):
+        """ Every product as a dict with the import columns, read chunk_size rows at a time"""
+        columns = ['id', 'name', 'description', 'price', 'stock', 'category_id']
+        for values in Product.objects.order_by('pk').values_list(*columns).iterator(chunk_size=chunk_size):
+            yield dict(zip(ProductImportService.FIELDS, values))
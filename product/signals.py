@@ -0,0 +1,71 @@
+from django.db import connections
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from api.invalidation import invalidation_bus
+from order.cache import purchase_cache
+from product.models import Product, ProductImage, Category, PriceRule, Review
+from product.cache import catalog_cache
+from product.pricing import pricing
+from product.search import get_search_backend
+from product.autocomplete import autocomplete_index
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductImage)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=PriceRule)
+def publish_catalog_change(sender, instance, **kwargs):
+    # publish after commit, otherwise a concurrent read could cache the old rows under the new version
+    invalidation_bus.publish_on_commit(sender._meta.label, instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Review)
+def publish_review_change(sender, instance, **kwargs):
+    purchase_cache.invalidate_on_commit(instance.user_id)
+
+
+def bump_catalog(event):
+    catalog_cache.bump_version()
+
+
+def reprice(event):
+    # every process reloads its rules on the next price, then the cached pages showing the old prices retire
+    pricing.bump_version()
+    catalog_cache.bump_version()
+
+
+def refresh_autocomplete(kind):
+    def handler(event):
+        # no pk: stock and rating updates in bulk, names don't change there
+        if event.pk is not None:
+            autocomplete_index.refresh(kind, int(event.pk))
+    return handler
+
+
+for model in [Product, ProductImage, Category]:
+    invalidation_bus.subscribe(model._meta.label, bump_catalog, backend=catalog_cache.cache)
+invalidation_bus.subscribe(PriceRule._meta.label, reprice, backend=catalog_cache.cache)
+invalidation_bus.subscribe(Product._meta.label, refresh_autocomplete('product'))
+invalidation_bus.subscribe(Category._meta.label, refresh_autocomplete('category'))
+
+
+# search index is written in the same transaction as the row itself
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, using, **kwargs):
+    backend = get_search_backend(connections[using])
+    if backend:
+        backend.index_products([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, using, **kwargs):
+    backend = get_search_backend(connections[using])
+    if backend:
+        backend.remove_products([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def index_category(sender, instance, created, using, **kwargs):
+    backend = get_search_backend(connections[using])
+    if backend and not created:
+        backend.index_category(instance.pk)
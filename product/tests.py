@@ -1,3 +1,502 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+from io import BytesIO, StringIO
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+from rest_framework_simplejwt.tokens import AccessToken
+from order.models import Order, OrderItem
+from product.autocomplete import autocomplete_index
+from product.cache import catalog_cache
+from product.images import get_image_storage, image_pipeline
+from product.models import Category, Product, ProductImage, Review
+from product.search import PostgresSearchBackend, SqliteSearchBackend, get_search_backend
+from users.models import User
 
-# Create your tests here.
+
+class CatalogCacheTest(TestCase):
+    """ Warm catalog reads skip the database, a version bump retires every cached page"""
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Garden')
+        self.product = Product.objects.create(name='Hose', description='x', price=8, stock=3, category=self.category)
+        self.staff = {'HTTP_AUTHORIZATION': f"JWT {AccessToken.for_user(User.objects.create_user(email='gardener@example.com', is_staff=True))}"}
+
+    def test_hits_and_misses_are_counted(self):
+        for url in ['/api/v1/products/', '/api/v1/products/', f'/api/v1/products/{self.product.id}/', '/api/v1/products/?ordering=price']:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        with self.assertNumQueries(0):
+            self.client.get(f'/api/v1/products/{self.product.id}/')
+        # params the view doesn't understand share the entry
+        self.client.get('/api/v1/products/?utm_source=mail')
+
+        stats = self.client.get('/api/v1/products/cache-stats/', **self.staff).data
+        self.assertEqual((stats['hits'], stats['misses'], stats['hit_rate']), (3, 3, 0.5))
+        self.assertEqual(self.client.get('/api/v1/products/cache-stats/').status_code, 401)
+
+    def test_version_bump_retires_cached_pages(self):
+        self.client.get(f'/api/v1/products/{self.product.id}/')
+        Product.objects.filter(pk=self.product.pk).update(name='Garden Hose')
+        # a write that skips the signals leaves the cached page in place
+        self.assertEqual(self.client.get(f'/api/v1/products/{self.product.id}/').data['name'], 'Hose')
+
+        version = catalog_cache.get_version()
+        catalog_cache.bump_version()
+        self.assertGreater(catalog_cache.get_version(), version)
+        self.assertEqual(self.client.get(f'/api/v1/products/{self.product.id}/').data['name'], 'Garden Hose')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/v1/products/{self.product.id}/', {'price': 9}, content_type='application/json', **self.staff)
+        self.assertEqual(self.client.get('/api/v1/products/').data['results'][0]['price'], 9)
+
+
+class ProductSearchTest(TestCase):
+    """ Full-text search of the database's backend (FTS5 on SQLite, tsvector on PostgreSQL)"""
+
+    def setUp(self):
+        cache.clear()
+        self.gear = Category.objects.create(name='Wireless Gear')
+        self.desk = Category.objects.create(name='Desk')
+        # one match per field, name > description > category name
+        self.by_category = Product.objects.create(name='Charging Dock', description='keeps things tidy', price=30, stock=1, category=self.gear)
+        self.by_description = Product.objects.create(name='Desk Lamp', description='wireless charging base', price=20, stock=1, category=self.desk)
+        self.by_name = Product.objects.create(name='Wireless Mouse', description='quiet buttons', price=10, stock=1, category=self.desk)
+        Product.objects.create(name='Paper Notebook', description='lined pages', price=5, stock=1, category=self.desk)
+
+    def search(self, query):
+        response = self.client.get(f'/api/v1/products/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return [product['name'] for product in response.data['results']]
+
+    def test_backend_matches_the_database(self):
+        expected = {'sqlite': SqliteSearchBackend, 'postgresql': PostgresSearchBackend}.get(connection.vendor)
+        backend = get_search_backend(connection)
+        self.assertEqual(type(backend) if backend else None, expected)
+
+    def test_ranked_by_field_weight(self):
+        self.assertEqual(self.search('search=wireless'), ['Wireless Mouse', 'Desk Lamp', 'Charging Dock'])
+        # every token is a prefix, all of them have to match
+        self.assertEqual(self.search('search=wire'), ['Wireless Mouse', 'Desk Lamp', 'Charging Dock'])
+        self.assertEqual(self.search('search=wireless+charging'), ['Desk Lamp', 'Charging Dock'])
+        self.assertEqual(self.search('search=%21%21'), [])
+
+    def test_combined_with_filters_and_ordering(self):
+        self.assertEqual(self.search(f'search=wireless&category_id={self.desk.id}'), ['Wireless Mouse', 'Desk Lamp'])
+        self.assertEqual(self.search('search=wireless&price__gt=15'), ['Desk Lamp', 'Charging Dock'])
+        self.assertEqual(self.search('search=wireless&price__lt=25&price__gt=5'), ['Wireless Mouse', 'Desk Lamp'])
+        # an explicit ordering wins over the rank
+        self.assertEqual(self.search('search=wireless&ordering=-price'), ['Charging Dock', 'Desk Lamp', 'Wireless Mouse'])
+
+    def test_index_follows_writes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.by_name.name = 'Silent Mouse'
+            self.by_name.save()
+            self.gear.name = 'Docks'
+            self.gear.save()
+            self.by_description.delete()
+        self.assertEqual(self.search('search=wireless'), [])
+        self.assertEqual(self.search('search=docks'), ['Charging Dock'])
+
+        # raw writes skip the signals, the command catches up
+        Product.objects.filter(pk=self.by_name.pk).update(name='Wireless Mouse')
+        call_command('rebuild_search_index', stdout=StringIO())
+        cache.clear()
+        self.assertEqual(self.search('search=wireless'), ['Wireless Mouse'])
+
+
+class AutocompleteTest(TestCase):
+    def setUp(self):
+        gadgets = Category.objects.create(name='Gadgets')
+        self.stands = Category.objects.create(name='Phone Stands')
+        self.phone = Product.objects.create(name='Smart Phone', price=100, stock=5, category=gadgets)
+        self.case = Product.objects.create(name='Phone Case', price=10, stock=5, category=gadgets)
+        self.phonograph = Product.objects.create(name='Phonograph', price=50, stock=5, category=gadgets)
+        Product.objects.bulk_create(Product(name=f'Widget {i}', price=1, stock=1, category=gadgets) for i in range(25))
+
+        buyer = User.objects.create_user(email='buyer@example.com', password='pass1234')
+        order = Order.objects.create(user=buyer, total_price=0)
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, product=product, quantity=1, price=product.price, total_price=product.price)
+            for product in [self.phone, self.phone, self.case]
+        )
+        autocomplete_index.rebuild()
+
+    def suggest(self, query):
+        response = self.client.get(f'/api/v1/products/autocomplete/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return [(result['type'], result['name']) for result in response.data['results']]
+
+    def test_prefix_of_any_word(self):
+        # most ordered first, then the shorter name
+        self.assertEqual(self.suggest('q=PHO'), [
+            ('product', 'Smart Phone'), ('product', 'Phone Case'), ('product', 'Phonograph'), ('category', 'Phone Stands'),
+        ])
+        self.assertEqual(self.suggest('q=smart++ph'), [('product', 'Smart Phone')])
+        self.assertEqual(self.suggest('q=case'), [('product', 'Phone Case')])
+        self.assertEqual(self.suggest('q=hone'), [])
+        self.assertEqual(self.suggest('q=+'), [])
+
+    def test_limit(self):
+        self.assertEqual(len(self.suggest('q=widget')), 10)
+        self.assertEqual(len(self.suggest('q=widget&limit=3')), 3)
+        self.assertEqual(len(self.suggest('q=widget&limit=abc')), 10)
+        self.assertEqual(len(self.suggest('q=widget&limit=50')), 20)
+        self.assertEqual(len(self.suggest('q=widget&limit=0')), 1)
+
+    def test_follows_catalog_changes(self):
+        self.assertEqual(len(self.suggest('q=pho')), 4)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.phonograph.name = 'Gramophone'
+            self.phonograph.save()
+            self.case.delete()
+            self.stands.name = 'Tablet Stands'
+            self.stands.save()
+            Category.objects.create(name='Phonetics')
+        self.assertEqual(self.suggest('q=pho'), [('product', 'Smart Phone'), ('category', 'Phonetics')])
+        self.assertEqual(self.suggest('q=gram'), [('product', 'Gramophone')])
+        self.assertEqual(self.suggest('q=stands'), [('category', 'Tablet Stands')])
+
+
+class RatingAggregateTest(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Kitchen')
+        self.product = Product.objects.create(name='Kettle', price=25, stock=5, category=category)
+        self.users = [User.objects.create_user(email=f'reviewer{i}@example.com', password='pass1234') for i in range(3)]
+        self.url = f'/api/v1/products/{self.product.id}/reviews/'
+
+    def auth(self, user):
+        return {'HTTP_AUTHORIZATION': f'JWT {AccessToken.for_user(user)}'}
+
+    def review(self, user, ratings):
+        response = self.client.post(self.url, {'ratings': ratings, 'comment': 'ok'}, content_type='application/json', **self.auth(user))
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def assertRatings(self, avg, histogram):
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_avg, Decimal(avg))
+        self.assertEqual(self.product.rating_count, sum(histogram))
+        self.assertEqual([getattr(self.product, f'rating_{star}') for star in range(1, 6)], histogram)
+
+    def test_review_writes_update_the_aggregates(self):
+        first = self.review(self.users[0], 5)
+        self.review(self.users[1], 4)
+        self.review(self.users[2], 1)
+        self.assertRatings('3.33', [1, 0, 0, 1, 1])
+
+        response = self.client.patch(f'{self.url}{first}/', {'ratings': 2}, content_type='application/json', **self.auth(self.users[0]))
+        self.assertEqual(response.status_code, 200)
+        self.assertRatings('2.33', [1, 1, 0, 1, 0])
+
+        # same stars, nothing moves
+        response = self.client.patch(f'{self.url}{first}/', {'comment': 'better'}, content_type='application/json', **self.auth(self.users[0]))
+        self.assertEqual(response.status_code, 200)
+        self.assertRatings('2.33', [1, 1, 0, 1, 0])
+
+        # someone else's review can't be changed
+        response = self.client.patch(f'{self.url}{first}/', {'ratings': 5}, content_type='application/json', **self.auth(self.users[1]))
+        self.assertEqual(response.status_code, 403)
+        self.assertRatings('2.33', [1, 1, 0, 1, 0])
+
+        response = self.client.delete(f'{self.url}{first}/', **self.auth(self.users[0]))
+        self.assertEqual(response.status_code, 204)
+        self.assertRatings('2.50', [1, 0, 0, 1, 0])
+
+        response = self.client.get(f'/api/v1/products/{self.product.id}/')
+        self.assertEqual(response.data['rating_count'], 2)
+        self.assertEqual(response.data['rating_histogram'], {'1': 1, '2': 0, '3': 0, '4': 1, '5': 0})
+
+    def test_reconcile_ratings(self):
+        for user, ratings in zip(self.users, [5, 5, 2]):
+            Review.objects.create(product=self.product, user=user, ratings=ratings, comment='imported')
+        untouched = Product.objects.create(name='Toaster', price=30, stock=1, category=self.product.category, rating_count=7, rating_avg=4)
+
+        out = StringIO()
+        call_command('reconcile_ratings', '--chunk-size', '1', stdout=out)
+        self.assertIn('Reconciled ratings of 2 products', out.getvalue())
+        self.assertRatings('4.00', [0, 1, 0, 0, 2])
+        untouched.refresh_from_db()
+        self.assertEqual((untouched.rating_count, untouched.rating_avg), (0, Decimal('0')))
+
+
+class KeysetPaginationTest(TestCase):
+    """ Walking the cursor forward and back visits every row once, in the order of the page-number listing"""
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Kitchen')
+        # few distinct prices, the pk tie-breaker decides inside a price
+        for index in range(23):
+            name = f'Pot {index}' if index % 5 == 0 else f'Pan {index}'
+            description = 'steel pan' if index % 3 else 'steel pot'
+            Product.objects.create(name=name, description=description, price=[5, 10, 10, 20][index % 4], stock=1, category=self.category)
+
+    def ids(self, response):
+        return [product['id'] for product in response.data['results']]
+
+    def walk(self, url):
+        """ Ids of every page following next, then of every page following previous back from the last one"""
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append(self.ids(response))
+            url, previous = response.data['next'], response.data['previous']
+        forward = [pk for page in pages for pk in page]
+
+        backward = []
+        while previous:
+            response = self.client.get(previous)
+            backward = self.ids(response) + backward
+            previous = response.data['previous']
+        return forward, backward + pages[-1]
+
+    def page_numbers(self, query):
+        ids, page = [], 1
+        while True:
+            response = self.client.get(f'/api/v1/products/?{query}&page={page}')
+            ids += self.ids(response)
+            if not response.data['next']:
+                return ids
+            page += 1
+
+    def test_orderings_with_duplicate_values(self):
+        for ordering, tie_breaker in [('price', 'pk'), ('-price', '-pk'), ('updated_at', 'pk'), ('-updated_at', '-pk')]:
+            with self.subTest(ordering=ordering):
+                expected = list(Product.objects.order_by(ordering, tie_breaker).values_list('pk', flat=True))
+                forward, backward = self.walk(f'/api/v1/products/?cursor=&ordering={ordering}')
+                self.assertEqual(forward, expected)
+                self.assertEqual(backward, expected)
+
+    def test_default_ordering_and_count(self):
+        response = self.client.get('/api/v1/products/?cursor=&count=true')
+        self.assertEqual(response.data['count'], 23)
+        self.assertIsNone(response.data['previous'])
+        forward, backward = self.walk('/api/v1/products/?cursor=')
+        self.assertEqual(forward, list(Product.objects.order_by('-pk').values_list('pk', flat=True)))
+        self.assertEqual(backward, forward)
+
+    def test_search_rank_cursor(self):
+        expected = self.page_numbers('search=pot')
+        # a match in the name outranks one in the description
+        self.assertEqual(len(expected), 11)
+        self.assertTrue(Product.objects.get(pk=expected[0]).name.startswith('Pot'))
+        forward, backward = self.walk('/api/v1/products/?cursor=&search=pot')
+        self.assertEqual(forward, expected)
+        self.assertEqual(backward, expected)
+        # ranks tie across all matches of "steel", pk orders them
+        forward, _ = self.walk('/api/v1/products/?cursor=&search=steel')
+        self.assertEqual(forward, self.page_numbers('search=steel'))
+
+    def test_reviews_and_bad_cursors(self):
+        product = Product.objects.first()
+        for index in range(3):
+            user = User.objects.create_user(email=f'reviewer{index}@example.com')
+            product.review.create(user=user, ratings=4, comment='ok')
+        url = f'/api/v1/products/{product.id}/reviews/'
+        self.assertEqual(len(self.client.get(url).data), 3)
+        self.assertEqual(len(self.client.get(url + '?cursor=').data['results']), 3)
+
+        self.assertEqual(self.client.get('/api/v1/products/?cursor=not-a-cursor').status_code, 404)
+        self.assertEqual(self.client.get('/api/v1/products/?cursor=W10').status_code, 404)
+
+
+class ProductImportExportTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Audio')
+        self.existing = Product.objects.create(name='Old Speaker', description='x', price=10, stock=1, category=self.category)
+        staff = User.objects.create_user(email='erp@example.com', is_staff=True)
+        self.auth = {'HTTP_AUTHORIZATION': f'JWT {AccessToken.for_user(staff)}'}
+
+    def post(self, body, content_type):
+        return self.client.post('/api/v1/products/import/', body, content_type=content_type, **self.auth)
+
+    def test_csv_import_upserts_and_reports_bad_rows(self):
+        body = (
+            'id,name,description,price,stock,category\n'
+            f'{self.existing.id},Loud Speaker,new text,12.50,7,{self.category.id}\n'
+            f',Studio Headphones,closed back,99,3,{self.category.id}\n'
+            f',Broken,x,-1,3,{self.category.id}\n'
+            ',Orphan,x,5,3,999\n'
+        )
+        response = self.post(body, 'text/csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['updated'], response.data['failed']), (1, 1, 2))
+        self.assertEqual([error['row'] for error in response.data['errors']], [3, 4])
+        self.assertIn('price', response.data['errors'][0]['errors'])
+
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.name, self.existing.stock), ('Loud Speaker', 7))
+        # the search index follows bulk writes too
+        results = self.client.get('/api/v1/products/?search=headphones').data['results']
+        self.assertEqual([product['name'] for product in results], ['Studio Headphones'])
+
+    def test_ndjson_import_and_export_round_trip(self):
+        lines = [json.dumps({'name': f'Cable {index}', 'description': 'x', 'price': index + 1, 'stock': 5, 'category': self.category.id}) for index in range(3)]
+        response = self.post('\n'.join(lines + ['not json']), 'application/x-ndjson')
+        self.assertEqual((response.data['created'], response.data['failed']), (3, 1))
+
+        response = self.client.get('/api/v1/products/export/?format=ndjson', **self.auth)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['name'] for row in rows], ['Old Speaker', 'Cable 0', 'Cable 1', 'Cable 2'])
+
+        response = self.client.get('/api/v1/products/export/?format=csv', **self.auth)
+        exported = b''.join(response.streaming_content)
+        Product.objects.filter(name__startswith='Cable').update(stock=0)
+        self.assertEqual(self.post(exported, 'text/csv').data['updated'], 4)
+        self.assertEqual(Product.objects.filter(stock=5).count(), 3)
+
+    def test_command_and_permissions(self):
+        self.assertEqual(self.client.post('/api/v1/products/import/', 'x', content_type='text/csv').status_code, 401)
+        output = StringIO()
+        call_command('export_products', format='csv', stdout=output)
+        self.assertTrue(output.getvalue().startswith('id,name,description,price,stock,category'))
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Books')
+        self.product = Product.objects.create(name='Novel', description='x', price=10, stock=5, category=self.category)
+        self.staff = {'HTTP_AUTHORIZATION': f"JWT {AccessToken.for_user(User.objects.create_user(email='editor@example.com', is_staff=True))}"}
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_catalog_endpoints_answer_304_without_queries(self):
+        for url in ['/api/v1/products/', f'/api/v1/products/{self.product.id}/', '/api/v1/categories/']:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('Last-Modified', response)
+            with self.assertNumQueries(0):
+                self.assertEqual(self.revalidate(url, response).status_code, 304)
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(response.status_code, 304)
+
+    def test_writes_bust_the_validators(self):
+        url = f'/api/v1/products/{self.product.id}/'
+        response = self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(url, {'stock': 9}, content_type='application/json', **self.staff)
+        fresh = self.revalidate(url, response)
+        self.assertEqual(fresh.status_code, 200)
+        self.assertEqual(fresh.data['stock'], 9)
+
+        categories = self.client.get('/api/v1/categories/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.delete()
+        self.assertEqual(self.revalidate('/api/v1/categories/', categories).status_code, 200)
+
+    def test_review_list(self):
+        url = f'/api/v1/products/{self.product.id}/reviews/'
+        response = self.client.get(url)
+        self.assertEqual(self.revalidate(url, response).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, {'ratings': 4, 'comment': 'fine'}, content_type='application/json', **self.staff)
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+
+class ProductImagePipelineTest(TransactionTestCase):
+    """ Real worker threads, the local filesystem storage stands in for Cloudinary"""
+
+    def setUp(self):
+        cache.clear()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        settings = override_settings(
+            PRODUCT_IMAGE_STORAGE='django.core.files.storage.FileSystemStorage',
+            MEDIA_ROOT=os.path.join(root, 'media'),
+            PRODUCT_IMAGE_STAGING_DIR=os.path.join(root, 'staging'),
+            PRODUCT_IMAGE_MAX_UPLOAD_SIZE=200 * 1024,
+            PRODUCT_IMAGE_WORKERS=2,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.staging = os.path.join(root, 'staging')
+        category = Category.objects.create(name='Photo')
+        self.product = Product.objects.create(name='Camera', description='x', price=10, stock=5, category=category)
+        self.url = f'/api/v1/products/{self.product.id}/images/'
+        staff = User.objects.create_user(email='catalog@example.com', is_staff=True)
+        self.auth = {'HTTP_AUTHORIZATION': f'JWT {AccessToken.for_user(staff)}'}
+
+    def upload(self, content, name='photo.png'):
+        return self.client.post(self.url, {'image': SimpleUploadedFile(name, content)}, **self.auth)
+
+    def picture(self, size=(1200, 900), mode='RGBA', format='PNG'):
+        buffer = BytesIO()
+        Image.new(mode, size, (200, 30, 30, 128)[:len(mode)]).save(buffer, format)
+        return buffer.getvalue()
+
+    def test_upload_is_processed_in_the_background(self):
+        response = self.upload(self.picture())
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], ProductImage.PENDING)
+        self.assertIsNone(response.data['thumbnail'])
+        image_pipeline.wait(timeout=30)
+
+        image = ProductImage.objects.get(pk=response.data['id'])
+        self.assertEqual(image.status, ProductImage.READY)
+        self.assertEqual(os.listdir(self.staging), [])
+        storage = get_image_storage()
+        with storage.open(image.thumbnail) as file, Image.open(file) as thumbnail:
+            self.assertEqual((thumbnail.size, thumbnail.format), ((300, 300), 'JPEG'))
+        with storage.open(image.webp) as file, Image.open(file) as webp:
+            self.assertEqual((webp.size, webp.format), ((800, 600), 'WEBP'))
+
+        data = self.client.get(f'/api/v1/products/{self.product.id}/').data['images'][0]
+        self.assertEqual(data['status'], ProductImage.READY)
+        self.assertEqual([data['image'], data['thumbnail'], data['webp']], [storage.url(image.original), storage.url(image.thumbnail), storage.url(image.webp)])
+
+        self.client.delete(f"{self.url}{image.id}/", **self.auth)
+        self.assertFalse(storage.exists(image.thumbnail))
+
+    def test_lost_uploads_are_picked_up_again(self):
+        # the process died before its pool got to the images
+        with mock.patch.object(image_pipeline, 'submit'):
+            lost = self.upload(self.picture()).data['id']
+            gone = self.upload(self.picture()).data['id']
+        os.remove(ProductImage.objects.get(pk=gone).source)
+
+        out = StringIO()
+        call_command('process_product_images', stdout=out)
+        # still fresh, a live worker may have them
+        self.assertIn('0 ready, 0 failed', out.getvalue())
+        self.assertEqual(ProductImage.objects.filter(status=ProductImage.PENDING).count(), 2)
+
+        ProductImage.objects.update(staged_at=timezone.now() - timedelta(seconds=settings.PRODUCT_IMAGE_STALE_AFTER + 1))
+        out = StringIO()
+        call_command('process_product_images', stdout=out)
+        self.assertIn('1 ready, 1 failed', out.getvalue())
+        self.assertEqual(ProductImage.objects.get(pk=lost).status, ProductImage.READY)
+        self.assertEqual(ProductImage.objects.get(pk=gone).status, ProductImage.FAILED)
+        self.assertEqual(os.listdir(self.staging), [])
+
+    def test_bad_and_oversized_uploads(self):
+        self.assertEqual(self.upload(b'not an image', 'notes.png').status_code, 400)
+        # refused from Content-Length alone, then while streaming (under the multipart allowance)
+        for size in [(2000, 2000), (300, 260)]:
+            response = self.upload(self.picture(size=size, mode='RGB', format='BMP'), 'huge.bmp')
+            self.assertEqual(response.status_code, 413)
+        self.assertFalse(ProductImage.objects.exists())
+
+        # passes the header check, fails when the worker decodes it
+        jpeg = self.picture(mode='RGB', format='JPEG')
+        truncated = jpeg[:jpeg.index(b'\xff\xda') + 20]
+        response = self.upload(truncated, 'broken.jpg')
+        self.assertEqual(response.status_code, 202)
+        image_pipeline.wait(timeout=30)
+        image = ProductImage.objects.get(pk=response.data['id'])
+        self.assertEqual(image.status, ProductImage.FAILED)
+        self.assertTrue(image.error)
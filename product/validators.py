@@ -1,9 +1,9 @@
+from django.conf import settings
 from django.core.exceptions import ValidationError
 
 def validate_file_size(file):
-    max_size = 50
-    max_size_in_kb = max_size * 1024
+    max_size_in_kb = settings.PRODUCT_IMAGE_MAX_UPLOAD_SIZE // 1024
 
-    if file.size > max_size_in_kb:
-        raise ValidationError(f"Your file size is {file.size} KB. But, it can't be more than 50 KB")
+    if file.size > settings.PRODUCT_IMAGE_MAX_UPLOAD_SIZE:
+        raise ValidationError(f"Your file size is {file.size // 1024} KB. But, it can't be more than {max_size_in_kb} KB")
     
\ No newline at end of file
@@ -1,35 +1,54 @@
 from product.models import Product, Category, Review, ProductImage
-from django.db.models import Count
+from django.db.models import Count, Max
+from django.db import transaction
 from product.serializers import ProductSerializer, CategorySerializer, ReviewSerializer, ProductImageSerializer
 from rest_framework.viewsets import ModelViewSet
 from django_filters.rest_framework import DjangoFilterBackend
 from product.filters import ProductFilter
-from rest_framework.filters import SearchFilter, OrderingFilter
-from product.paginations import CustomPageNumberPagination
+from rest_framework.filters import OrderingFilter
+from product.search import ProductSearchFilter
+from product.paginations import KeysetOrPageNumberPagination, OptionalKeysetPagination
 from rest_framework.permissions import DjangoModelPermissionsOrAnonReadOnly
 from api.permissions import IsAdminOrReadonly
 from product.permissions import IsReviewAuthorOrReadonly
 from drf_yasg.utils import swagger_auto_schema
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from product.cache import CachedCatalogMixin, CatalogConditionalMixin, catalog_cache
+from api.mixins import ConditionalGetMixin
+from product.autocomplete import autocomplete_index
+from product.images import image_pipeline, limit_upload
+from django.conf import settings
+from django.utils import timezone
+from product.services import RatingService, ProductImportService
+from django.http import StreamingHttpResponse
+from rest_framework import status
+from rest_framework.parsers import MultiPartParser
+from api.parsers import get_row_reader
+from api.renderers import NDJSONRenderer, CSVRenderer, ndjson_stream, csv_stream
 
 
 
-class ProductViewsets(ModelViewSet):
+class ProductViewsets(CatalogConditionalMixin, CachedCatalogMixin, ModelViewSet):
     """
     API endpoint for manage product.
     - Allow authenticated admin to create, update and delete product
     - Allow anyone to access product list
-    - Support serching by name, description and category
+    - Support serching by name, description and category (full-text, ranked by relevance)
     - Support ordering by price and update_at
+    - Support cursor pagination with ?cursor= (count only with ?count=true)
+    - List and detail responses are served from the catalog cache
+    - ETag/Last-Modified follow the catalog version, revalidation answers 304
     """
 
-    queryset = Product.objects.all()
+    queryset = Product.objects.prefetch_related('images').all()
     serializer_class = ProductSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, OrderingFilter]
     filterset_class = ProductFilter
     search_fields = ['name', 'description', 'category__name']
     ordering_fields = ['price', 'updated_at']
-    pagination_class = CustomPageNumberPagination
+    pagination_class = KeysetOrPageNumberPagination
     permission_classes = [IsAdminOrReadonly]
 
 
@@ -49,45 +68,159 @@ class ProductViewsets(ModelViewSet):
         """ Only admin can create a product"""
         return super().create(request, *args, **kwargs)
 
+    @action(detail=False, methods=['get'], url_path='cache-stats', permission_classes=[IsAdminUser])
+    def cache_stats(self, request):
+        """ Hit and miss rates of the catalog cache, only for admin"""
+        return Response(catalog_cache.stats())
+
+    @action(detail=False, methods=['post'], url_path='import', permission_classes=[IsAdminUser], parser_classes=[MultiPartParser])
+    def import_products(self, request):
+        """
+        Upsert products from a CSV or NDJSON body (Content-Type text/csv or application/x-ndjson)
+        or a multipart `file`, rows with an id update that product, only for admin
+        """
+        upload = request.FILES.get('file') if request.content_type.startswith('multipart/') else None
+        stream, kind = (upload, f'{upload.name} {upload.content_type}') if upload else (request.stream, request.content_type)
+        reader = get_row_reader(kind)
+        if stream is None or reader is None:
+            return Response({'detail': 'Send a CSV or NDJSON body or file.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            report = ProductImportService.import_rows(reader(stream))
+        except UnicodeDecodeError:
+            return Response({'detail': 'The file must be UTF-8 encoded.'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report)
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser], renderer_classes=[NDJSONRenderer, CSVRenderer], filter_backends=[], pagination_class=None)
+    def export(self, request):
+        """ Stream the whole catalog with the import columns as ?format=ndjson or csv, only for admin"""
+        rows = ProductImportService.export_rows()
+        if request.accepted_renderer.format == 'csv':
+            fields = ProductImportService.FIELDS
+            stream = csv_stream(fields, ([row[field] for field in fields] for row in rows))
+        else:
+            stream = ndjson_stream(rows)
+        response = StreamingHttpResponse(stream, content_type=request.accepted_renderer.media_type)
+        response['Content-Disposition'] = f'attachment; filename="products.{request.accepted_renderer.format}"'
+        return response
+
+    @action(detail=False, methods=['get'], filter_backends=[], pagination_class=None)
+    def autocomplete(self, request):
+        """ Product and category name suggestions for ?q=, most popular first"""
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), 20)
+        except ValueError:
+            limit = 10
+        results = autocomplete_index.search(request.query_params.get('q', ''), limit=max(limit, 1))
+        return Response({'results': results})
+
 class ProductImageViewSet(ModelViewSet):
+    """
+    Images of a product.
+    - Uploads are streamed to a staging directory and refused as soon as they pass
+      PRODUCT_IMAGE_MAX_UPLOAD_SIZE, the response is a 202 with the pending image
+    - The image pipeline builds the normalized original, thumbnail and webp
+      derivatives in the background, status turns R (ready) or F (failed)
+    """
     serializer_class = ProductImageSerializer
     permission_classes = [IsAdminOrReadonly]
     
     def get_queryset(self):
         return ProductImage.objects.filter(product_id=self.kwargs.get('product_pk'))
-    
+
+    def create(self, request, *args, **kwargs):
+        return self.receive_upload(request, super().create, request, *args, **kwargs)
+
+    def update(self, request, *args, **kwargs):
+        return self.receive_upload(request, super().update, request, *args, **kwargs)
+
+    def receive_upload(self, request, handle, *args, **kwargs):
+        handler = limit_upload(request)
+        if handler is not None:
+            request.data  # parse the body now, the handler notices a too large file on the way
+        if handler is None or handler.too_large:
+            limit = settings.PRODUCT_IMAGE_MAX_UPLOAD_SIZE // 1024
+            return Response({'image': f"It can't be more than {limit} KB"}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        response = handle(*args, **kwargs)
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_201_CREATED) and response.data['status'] == ProductImage.PENDING:
+            response.status_code = status.HTTP_202_ACCEPTED
+        return response
+
     def perform_create(self, serializer):
-        serializer.save(product_id=self.kwargs.get('product_pk'))
+        self.save_upload(serializer, product_id=self.kwargs.get('product_pk'))
+
+    def perform_update(self, serializer):
+        previous = [serializer.instance.original, serializer.instance.thumbnail, serializer.instance.webp]
+        self.save_upload(serializer)
+        if serializer.instance.status == ProductImage.PENDING:
+            transaction.on_commit(lambda: image_pipeline.delete_files(previous))
 
-class CategoryViewsets(ModelViewSet):
+    def save_upload(self, serializer, **kwargs):
+        upload = serializer.validated_data.pop('image', None)
+        if upload is not None:
+            kwargs.update(
+                status=ProductImage.PENDING, source=image_pipeline.stage(upload), staged_at=timezone.now(),
+                original='', thumbnail='', webp='', error='',
+            )
+        with transaction.atomic():
+            image = serializer.save(**kwargs)
+            if upload is not None:
+                transaction.on_commit(lambda: image_pipeline.submit(image.pk))
+
+    def perform_destroy(self, instance):
+        files = [instance.original, instance.thumbnail, instance.webp]
+        with transaction.atomic():
+            instance.delete()
+            transaction.on_commit(lambda: image_pipeline.delete_files(files))
+
+class CategoryViewsets(CatalogConditionalMixin, ModelViewSet):
     permission_classes = [DjangoModelPermissionsOrAnonReadOnly]
     queryset = Category.objects.annotate(product_count=Count('products')).all()
     serializer_class = CategorySerializer
 
-class ReviewViewsets(ModelViewSet):
+class ReviewRatingMixin:
+    """ Keep the product rating aggregates in step with review writes, in the same transaction"""
+
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            review = serializer.save(user=self.request.user)
+            RatingService.add_rating(review.product_id, review.ratings)
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            old_rating = serializer.instance.ratings
+            review = serializer.save(user=self.request.user)
+            RatingService.change_rating(review.product_id, old_rating, review.ratings)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            RatingService.remove_rating(instance.product_id, instance.ratings)
+
+
+class ReviewViewsets(ReviewRatingMixin, ConditionalGetMixin, ModelViewSet):
     permission_classes = [IsReviewAuthorOrReadonly]
     serializer_class = ReviewSerializer
+    pagination_class = OptionalKeysetPagination
+
+    def get_validators(self, request):
+        # a delete doesn't move MAX(updated_at), it changes the count and bumps the catalog (ratings)
+        stats = Review.objects.filter(product_id=self.kwargs.get('product_pk')).aggregate(last=Max('updated_at'), total=Count('id'))
+        modified = max(filter(None, [stats['last'] and stats['last'].timestamp(), catalog_cache.get_last_modified()]))
+        return f"{stats['last']}:{stats['total']}", modified
 
     def get_queryset(self):
         queryset = Review.objects.filter(product_id = self.kwargs.get('product_pk'))
         return queryset
-    
-    # now we can also pass product from here
-    def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
-
-    def perform_update(self, serializer):
-        serializer.save(user=self.request.user)
 
     def get_serializer_context(self):
         return {'product_id': self.kwargs.get('product_pk')}
     
 
-class ReviewByUserViewSets(ModelViewSet):
+class ReviewByUserViewSets(ReviewRatingMixin, ModelViewSet):
     permission_classes = [IsAuthenticated]
     serializer_class = ReviewSerializer
     http_method_names = ['get', 'put', 'delete']
-    pagination_class = CustomPageNumberPagination
+    pagination_class = KeysetOrPageNumberPagination
     
     def get_queryset(self):
         return Review.objects.filter(user=self.request.user)
\ No newline at end of file
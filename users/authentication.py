@@ -0,0 +1,82 @@
+from django.conf import settings
+from django.core.cache import caches
+from api import versions
+from api.invalidation import invalidation_bus, is_process_local
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+
+class UserCache:
+    """
+    Resolved users for a short TTL, keyed by id and a per-user version.
+    The version goes up after every committed save or delete of the user, an
+    entry written under an older version is never served again.
+    """
+
+    @property
+    def cache(self):
+        return caches[settings.CATALOG_CACHE_ALIAS]
+
+    @property
+    def enabled(self):
+        # a process-local cache only hears of a save made in the same process,
+        # the other workers would keep honouring a revoked user until the entry expires
+        return not is_process_local(self.cache)
+
+    def _keys(self, user_id):
+        return f"auth-user:{user_id}:version", f"auth-user:{user_id}"
+
+    def get(self, user_id):
+        """ (cached user or None, current version)"""
+        version_key, entry_key = self._keys(user_id)
+        found = self.cache.get_many([version_key, entry_key])
+        version = found.get(version_key) or versions.get_version(self.cache, version_key)
+        entry = found.get(entry_key)
+        if entry is not None and entry[0] == version:
+            return entry[1], version
+        return None, version
+
+    def set(self, user_id, user, version):
+        _, entry_key = self._keys(user_id)
+        self.cache.set(entry_key, (version, user), timeout=settings.AUTH_USER_CACHE_TIMEOUT)
+
+    def invalidate(self, user_id):
+        version_key, _ = self._keys(user_id)
+        versions.bump_version(self.cache, version_key)
+
+    def invalidate_on_commit(self, user_id):
+        invalidation_bus.publish_on_commit('users.User', user_id)
+
+
+user_cache = UserCache()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that resolves the user from user_cache before going to the database.
+    Only with a shared cache backend, on a process-local one it is plain JWTAuthentication.
+    """
+
+    def get_user(self, validated_token):
+        if not user_cache.enabled:
+            return super().get_user(validated_token)
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+        # the version is read before the database, a save committing meanwhile outdates what we store
+        user, version = user_cache.get(user_id)
+        if user is None:
+            user = super().get_user(validated_token)
+            user_cache.set(user_id, user, version)
+            return user
+
+        # only active users are stored, but the token checks still run on every request
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+            raise AuthenticationFailed("The user's password has been changed.", code='password_changed')
+        return user
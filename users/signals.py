@@ -0,0 +1,14 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from users.models import User
+from api.invalidation import invalidation_bus
+from users.authentication import user_cache
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # saves cover profile edits, deactivation and password changes
+    user_cache.invalidate_on_commit(instance.pk)
+
+
+invalidation_bus.subscribe(User._meta.label, lambda event: user_cache.invalidate(event.pk), backend=user_cache.cache)
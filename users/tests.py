@@ -1,3 +1,51 @@
-from django.test import TestCase
+import tempfile
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from users.models import User
 
-# Create your tests here.
+
+def shared_cache():
+    """ A file-based cache, every process of the host sees the same entries"""
+    return {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': tempfile.mkdtemp()}}
+
+
+class CachedJWTAuthenticationTest(TestCase):
+    """ Warm requests skip the user query, a saved user is never served stale"""
+
+    url = '/api/v1/orders/has-ordered/?product_ids=1'
+
+    def setUp(self):
+        shared = override_settings(CACHES=shared_cache())
+        shared.enable()
+        self.addCleanup(shared.disable)
+        # ids come back after each test's rollback, entries of an earlier test must not answer
+        cache.clear()
+        self.user = User.objects.create_user(email='cached@example.com')
+        self.auth = {'HTTP_AUTHORIZATION': f'JWT {AccessToken.for_user(self.user)}'}
+
+    def test_warm_request_skips_user_query(self):
+        self.assertEqual(self.client.get(self.url, **self.auth).status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url, **self.auth).status_code, 200)
+
+    def test_deactivated_user_is_rejected_at_once(self):
+        self.client.get(self.url, **self.auth)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.client.get(self.url, **self.auth).status_code, 401)
+
+    def test_profile_change_is_visible_at_once(self):
+        self.client.get('/api/v1/auth/users/me/', **self.auth)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = 'Renamed'
+            self.user.save()
+        response = self.client.get('/api/v1/auth/users/me/', **self.auth)
+        self.assertEqual(response.data['first_name'], 'Renamed')
+
+    def test_process_local_cache_is_not_used(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual(self.client.get(self.url, **self.auth).status_code, 200)
+            with self.assertNumQueries(1):
+                self.assertEqual(self.client.get(self.url, **self.auth).status_code, 200)